@@ -5,11 +5,24 @@ import requests
 import json
 
 # Import our modules
-from cli_authenticate import authenticate_device_flow, check_token, load_token_json
-from cli_send_qasm_file import send_qasm_file
-from cli_qudi_commands import run_rabi, run_calibration, run_two_qubit_circuit, submit_two_qubit_batch
+from cli_authenticate import authenticate_device_flow, check_token, load_token_json, current_access_token
+from cli_send_qasm_file import send_qasm_files
+from cli_qudi_commands import run_rabi, run_two_qubit_circuit, submit_two_qubit_batch, stream_two_qubit_batch, STREAM_GROUP_SIZE, STREAM_MAX_IN_FLIGHT
 from cli_userinfo import get_user_info
 from cli_scheduling import get_job_status, list_jobs, download_job_result, batch_download_results, resubmit_job, job_details, check_availability, cancel_job, cancel_pending_jobs
+from cli_experiment import experiment_status, experiment_progress, cancel_experiment
+from cli_top import run_top
+from cli_http import set_cache_enabled, POOL_SIZE
+from cli_store import dedupe_directories
+from cli_archive import archive_results, parse_age
+from cli_batch_index import LAYOUTS, DEFAULT_LAYOUT
+from cli_synth import SynthOptions, synthesize, KINDS as SYNTH_KINDS, DEFAULT_BLOCKS as SYNTH_BLOCKS, SYNTH_ROOT
+from cli_catalog import index_results, print_query
+from cli_result_io import RESULT_FORMATS
+from cli_analyze import analyze_single_shot, analyze_rabi
+from cli_pipeline import run_pipeline
+from cli_events import wait_for_tasks, wait_for_experiment
+from cli_calibration import calibration_history, run_calibration_if_stale, CALIBRATION_MAX_AGE, CALIBRATION_DRIFT_TOLERANCE
 
 def load_config():
     with open("config.json", "r") as config_file:
@@ -19,9 +32,11 @@ def load_config():
 config = load_config()
 
 @click.group()
-def cli():
+@click.option('--no-cache', is_flag=True, help='Bypass the local cache of task responses')
+def cli(no_cache):
     """GUEST CLI - Command line interface for GUEST services"""
-    pass
+    if no_cache:
+        set_cache_enabled(False)
 
 @cli.command()
 def auth():
@@ -43,13 +58,16 @@ def userinfo():
 # ----------------- ACTUAL COMMANDS -----------------------------------------------------------        
 
 @cli.command()
-@click.argument('qasm_file', type=click.Path(exists=True))
-def submit(qasm_file):
-    """Submit a QASM file to the GUEST backend service"""
+@click.argument('qasm_files', nargs=-1, required=True)
+@click.option('--concurrency', '-j', type=click.IntRange(1), default=POOL_SIZE, show_default=True, help='Maximum number of concurrent uploads')
+def submit(qasm_files, concurrency):
+    """Submit QASM files, glob patterns or directories to the GUEST backend service"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
-    send_qasm_file(qasm_file, token)
+        return
+
+    send_qasm_files(qasm_files, token, concurrency)
 
 @cli.command()
 def rabi():
@@ -60,12 +78,18 @@ def rabi():
     run_rabi(token)
 
 @cli.command()
-def calibrate():
+@click.option('--force', is_flag=True, help='Queue a new calibration run even if a recent one is still valid')
+@click.option('--max-age', type=float, default=CALIBRATION_MAX_AGE, show_default=True, help='Minutes a finished calibration stays valid')
+@click.option('--drift-tolerance', type=float, default=CALIBRATION_DRIFT_TOLERANCE, show_default=True,
+              help='Largest expected relative drift of any calibration parameter')
+def calibrate(force, max_age, drift_tolerance):
     """Run a calibration experiment on the remote qudi server"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
-    run_calibration(token)
+        return
+
+    run_calibration_if_stale(token, force, max_age, drift_tolerance)
 
 @cli.command()
 def two_qubit_circuit():
@@ -76,51 +100,92 @@ def two_qubit_circuit():
     run_two_qubit_circuit(token)
 
 @cli.command('submit-tq-batch')
+@click.argument('source', required=False)
 @click.option(
     '--experiment-path',
     '-e',
     type=click.Path(exists=True),
     help='Path to a custom two-qubit experiment definition JSON file'
 )
-def submit_tq_batch(experiment_path):
-    """Submit a batch of experiments to be run as two qubit circuits"""
+@click.option('--group-size', type=click.IntRange(1), default=STREAM_GROUP_SIZE, show_default=True,
+              help="Experiments per submission request when reading from stdin ('-')")
+@click.option('--max-in-flight', type=click.IntRange(1), default=STREAM_MAX_IN_FLIGHT, show_default=True,
+              help="Concurrent submission requests when reading from stdin ('-')")
+@click.option('--simulate/--no-simulate', default=None, help="Run the experiments read from stdin ('-') in simulation")
+def submit_tq_batch(source, experiment_path, group_size, max_in_flight, simulate):
+    """Submit a batch of experiments to be run as two qubit circuits.
+
+    Pass '-' as SOURCE to stream NDJSON experiments (one JSON object per line) from stdin.
+    """
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    if source == '-':
+        stream_two_qubit_batch(token, click.get_text_stream('stdin'), group_size, max_in_flight, simulate)
+    else:
+        submit_two_qubit_batch(token, source or experiment_path)
+
+@cli.command('run')
+@click.argument('experiment', type=str)
+@click.option('--output-dir', '-o', default=None, help='Output directory for results (default: batch_results/<timestamp>)')
+@click.option('--format', 'output_format', type=click.Choice(RESULT_FORMATS), default='json', show_default=True, help='File format of the results')
+@click.option('--aggregates', default=None, help='Write the final aggregates as JSON to this file')
+@click.option('--layout', type=click.Choice(LAYOUTS), default=None, help=f'Layout of a new results directory (default: {DEFAULT_LAYOUT})')
+def run(experiment, output_dir, output_format, aggregates, layout):
+    """Submit a two-qubit experiment file, then download and aggregate results as tasks finish.
+
+    EXPERIMENT may also be an experiment info file of an earlier submission, to resume it.
+    """
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
-    submit_two_qubit_batch(token, experiment_path)
+        return
+
+    run_pipeline(token, experiment, output_dir, output_format, aggregates, layout)
 
 # ------------ QUEUE MANAGEMENT STUFF ---------------------
 
 @cli.command('job-status')
 @click.argument('job_id')
-def job_status(job_id):
+@click.option('--wait', 'wait_for_job', is_flag=True, help='Wait until the job has finished')
+def job_status(job_id, wait_for_job):
     """Check the status of a job and retrieve results if complete"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    if wait_for_job:
+        wait_for_tasks(token, [job_id])
+        # The wait may have outlived the token
+        token = current_access_token(token)
     get_job_status(token, job_id)
 
 @cli.command('list-jobs')
 @click.option('--limit', type=int, default=30, help='Maximum number of jobs to list')
-def jobs_list(limit):
+@click.option('--wide', is_flag=True, help='Do not clip lines to the terminal width')
+def jobs_list(limit, wide):
     """List your recent jobs"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
         return
     
-    list_jobs(token, limit)
+    list_jobs(token, limit, truncate=not wide)
 
 @cli.command('job-details')
 @click.option('--limit', type=int, default=30, help='Maximum number of jobs to list')
-def jobs_details(limit):
+@click.option('--wide', is_flag=True, help='Do not clip lines to the terminal width')
+def jobs_details(limit, wide):
     """List your recent jobs with detailed information"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
         return
     
-    job_details(token, limit)
+    job_details(token, limit, truncate=not wide)
 
 @cli.command('resubmit')
 @click.argument('job_id')
@@ -156,26 +221,29 @@ def cancel_pending_cmd():
 @cli.command('download-result')
 @click.argument('job_id')
 @click.option('--output', '-o', help='Output file path')
-def download_result(job_id, output):
+@click.option('--format', 'output_format', type=click.Choice(RESULT_FORMATS), default='json', help='Store arrays as JSON or as binary npy/npz files with a JSON sidecar')
+def download_result(job_id, output, output_format):
     """Download the result file for a completed job"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
         return
     
-    download_job_result(token, job_id, output)
+    download_job_result(token, job_id, output, output_format)
 
 @cli.command('batch-download')
 @click.argument('experiment_info_json')
 @click.option('--output-dir', '-o', help='Output directory for downloaded files')
-def batch_download(experiment_info_json, output_dir):
+@click.option('--format', 'output_format', type=click.Choice(RESULT_FORMATS), default='json', help='Store arrays as JSON or as binary npy/npz files with a JSON sidecar')
+@click.option('--layout', type=click.Choice(LAYOUTS), default=None, help=f'Layout of a new output directory; sharded spreads results over hashed subdirectories (default: {DEFAULT_LAYOUT})')
+def batch_download(experiment_info_json, output_dir, output_format, layout):
     """Batch download all results from an experiment info file"""
     token = load_token_json()["access_token"]
     if not token:
         click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
         return
     
-    batch_download_results(token, experiment_info_json, output_dir)
+    batch_download_results(token, experiment_info_json, output_dir, output_format, layout)
 
 @cli.command('check-availability')
 def check_availability_cmd():
@@ -186,7 +254,196 @@ def check_availability_cmd():
         return
     
     check_availability(token)
-    
+
+@cli.command('top')
+@click.option('--interval', '-n', type=float, default=2.0, help='Seconds between refreshes')
+@click.option('--limit', type=int, default=30, help='Maximum number of jobs to show')
+def top(interval, limit):
+    """Live view of the job queue and module states, refreshed in place"""
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    run_top(token, interval, limit)
+
+@cli.command('dedupe')
+@click.argument('directories', nargs=-1, type=click.Path(exists=True, file_okay=False))
+def dedupe(directories):
+    """Replace duplicate result files by read-only hardlinks into the object store"""
+    dedupe_directories(directories or ("results", "batch_results"))
+
+def _check_age(ctx, param, value):
+    try:
+        parse_age(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return value
+
+@cli.command('archive')
+@click.option('--older-than', default='30d', show_default=True, callback=_check_age,
+              help='Archive results not modified for this long, e.g. 30d, 12h or 2w')
+@click.option('--dry-run', is_flag=True, help='Only show what would be archived')
+def archive(older_than, dry_run):
+    """Pack old batch_results directories and results/ files into compressed archives.
+
+    Archived results stay readable by task ID for downloads, the catalog and analysis.
+    """
+    archive_results(older_than, dry_run)
+
+@cli.command('synth')
+@click.option('--kind', type=click.Choice(SYNTH_KINDS), default='tq', show_default=True, help='Two-qubit circuit or Rabi results')
+@click.option('--tasks', '-n', type=click.IntRange(1), default=1000, show_default=True, help='Tasks per experiment')
+@click.option('--experiments', type=click.IntRange(1), default=1, show_default=True, help='Number of experiments')
+@click.option('--interval', type=float, default=60.0, show_default=True, help='Minutes between the experiments, the last one ending now')
+@click.option('--blocks', type=click.IntRange(1), default=SYNTH_BLOCKS, show_default=True, help='Two-qubit readout blocks of 4 calibration and 10 measurement points')
+@click.option('--points', type=click.IntRange(2), default=50, show_default=True, help='Points per Rabi trace')
+@click.option('--sweeps', type=click.IntRange(1), default=500000, show_default=True, help='Sweeps per task; noise shrinks with their square root')
+@click.option('--noise', type=float, default=0.05, show_default=True, help='Relative signal noise at 100000 sweeps')
+@click.option('--fidelity', type=click.FloatRange(0, 1), default=0.95, show_default=True, help='Weight of the ideal circuit populations against the mixed state')
+@click.option('--drift', type=float, default=1e-5, show_default=True, help='Relative calibration drift per hour')
+@click.option('--single-shot', type=click.IntRange(0), default=0, show_default=True, help='Per-shot photon counts to add to every two-qubit result')
+@click.option('--circuit', 'circuits', multiple=True, help='Circuit to draw from, e.g. sxQB1_c0xQB2; "" for reference runs (repeatable)')
+@click.option('--format', 'output_format', type=click.Choice(RESULT_FORMATS), default='json', show_default=True, help='File format of the results')
+@click.option('--layout', type=click.Choice(LAYOUTS), default=None, help=f'Layout of the batch directories (default: {DEFAULT_LAYOUT})')
+@click.option('--jobs', '-j', type=int, default=None, help='Worker processes (default: one per CPU)')
+@click.option('--seed', type=int, default=0, show_default=True, help='Random seed; the same seed gives the same results')
+@click.option('--output-dir', '-o', type=click.Path(file_okay=False), default=SYNTH_ROOT, show_default=True, help='Scratch directory for the experiment_infos/ and batch_results/ of the synthetic data')
+def synth(kind, tasks, experiments, interval, blocks, points, sweeps, noise, fidelity, drift, single_shot, circuits,
+          output_format, layout, jobs, seed, output_dir):
+    """Generate synthetic results and experiment infos to benchmark analysis and storage locally.
+
+    They are written below a scratch directory, never next to the real results, and are left out of the catalog.
+    """
+    options = SynthOptions(kind=kind, blocks=blocks, points=points, sweeps=sweeps, noise=noise, fidelity=fidelity,
+                           drift=drift, single_shot=single_shot, output_format=output_format)
+    if circuits:
+        options.circuits = tuple(circuits)
+    if os.path.abspath(output_dir) == os.getcwd():
+        raise click.BadParameter("must not be the working directory with the real results", param_hint="'--output-dir'")
+    synthesize(options, tasks, experiments, interval, layout, jobs, seed, output_dir)
+
+# ------------ LOCAL RESULT CATALOG ---------------------
+
+@cli.group()
+def results():
+    """Search the locally stored results"""
+    pass
+
+@results.command('index')
+def results_index():
+    """Index new and modified result and experiment info files"""
+    index_results()
+
+@results.command('query')
+@click.option('--where', '-w', 'filters', multiple=True, help='Filter like initState=01, sweeps>=100000 or qb1_calibration_results.odmr_res_freq<1.463e9 (repeatable)')
+@click.option('--since', help='Only results from this date on (e.g. 2025-09-01)')
+@click.option('--until', help='Only results before this date (e.g. 2025-10-01)')
+@click.option('--limit', type=int, help='Maximum number of results')
+@click.option('--format', 'output_format', type=click.Choice(['paths', 'table', 'json']), default='paths', help='Output format')
+@click.option('--no-refresh', is_flag=True, help='Query the catalog without rescanning for new files')
+def results_query(filters, since, until, limit, output_format, no_refresh):
+    """Find stored results by experiment parameters and result fields"""
+    print_query(filters, since, until, limit, output_format, refresh=not no_refresh)
+
+# ------------ EXPERIMENT MANAGEMENT ---------------------
+
+@cli.group()
+def experiment():
+    """Manage all tasks of an experiment info file at once"""
+    pass
+
+@experiment.command('status')
+@click.argument('experiment_info_json')
+def experiment_status_cmd(experiment_info_json):
+    """Show the aggregated task states of an experiment"""
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    experiment_status(token, experiment_info_json)
+
+@experiment.command('progress')
+@click.argument('experiment_info_json')
+def experiment_progress_cmd(experiment_info_json):
+    """Show the completion percentage and ETA of an experiment"""
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    experiment_progress(token, experiment_info_json)
+
+@experiment.command('wait')
+@click.argument('experiment_info_json')
+def experiment_wait_cmd(experiment_info_json):
+    """Wait until all tasks of an experiment have finished, printing status changes"""
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    wait_for_experiment(token, experiment_info_json)
+
+@experiment.command('cancel')
+@click.argument('experiment_info_json')
+@click.option('--terminate/--no-terminate', default=False, help='Terminate tasks that are already running')
+def experiment_cancel_cmd(experiment_info_json, terminate):
+    """Cancel all unfinished tasks of an experiment"""
+    token = load_token_json()["access_token"]
+    if not token:
+        click.echo("You are not authenticated. Please authenticate using the 'auth' command.")
+        return
+
+    cancel_experiment(token, experiment_info_json, terminate)
+
+@cli.group()
+def analyze():
+    """Analyze downloaded experiment results"""
+    pass
+
+@analyze.command('single-shot')
+@click.argument('experiment_info_json')
+@click.option('--results-dir', default=None, help='Directory with the downloaded results (default: batch_results/<timestamp>)')
+@click.option('--counts-key', default='photon_counts', show_default=True, help='Result field holding the per-shot photon counts')
+@click.option('--threshold', type=int, default=None, help='Photon count threshold (default: fitted from the reference runs)')
+@click.option('--jobs', '-j', type=int, default=None, help='Number of worker processes (default: number of cores)')
+@click.option('--output', '-o', default=None, help='Write the analysis as JSON to this file')
+def analyze_single_shot_cmd(experiment_info_json, results_dir, counts_key, threshold, jobs, output):
+    """Histogram single-shot photon counts and classify them with a readout threshold"""
+    analyze_single_shot(experiment_info_json, results_dir, counts_key, threshold, jobs, output=output)
+
+@analyze.command('rabi')
+@click.argument('result_files', nargs=-1, type=click.Path(exists=True))
+@click.option('--qubit', type=click.IntRange(1, 2), default=1, show_default=True, help='Qubit whose stored Rabi periods seed the fits')
+@click.option('--output', '-o', default=None, help='Write the fits as JSON to this file')
+def analyze_rabi_cmd(result_files, qubit, output):
+    """Fit Rabi oscillations of many results at once (default: results/run_rabi_oscillation_*.json).
+
+    RESULT_FILES may also be batch directories, e.g. from 'guest synth --kind rabi'.
+    """
+    analyze_rabi(list(result_files), qubit, output)
+
+@cli.group()
+def calibration():
+    """Inspect calibration results embedded in downloaded results"""
+    pass
+
+@calibration.command('history')
+@click.option('--qubit', '-q', 'qubits', type=int, multiple=True, help='Only this qubit (repeatable)')
+@click.option('--parameter', '-p', 'parameters', multiple=True, help='Only this parameter, e.g. odmr_res_freq (repeatable)')
+@click.option('--since', default=None, help='Only results at or after this time (e.g. 2025-09-01 or 2025-09-01T12:00:00)')
+@click.option('--until', default=None, help='Only results before this time')
+@click.option('--window', type=click.IntRange(2), default=5, show_default=True, help='Points a value is compared against for change points')
+@click.option('--threshold', type=float, default=5.0, show_default=True, help='Change point threshold in robust standard deviations')
+@click.option('--series', is_flag=True, help='Print every point of each time series')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json']), default='table', show_default=True)
+@click.option('--no-refresh', is_flag=True, help='Do not index new result files first')
+def calibration_history_cmd(qubits, parameters, since, until, window, threshold, series, output_format, no_refresh):
+    """Show calibration time series, drift rates and change points"""
+    calibration_history(qubits, parameters, since, until, window, threshold, series, output_format, not no_refresh)
+
 if __name__ == '__main__':
     # Ensure we're in the correct directory
     script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -0,0 +1,369 @@
+import glob
+import json
+import os
+import time
+import click
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from cli_experiment import load_experiment_info, resolve_experiment_info_path
+from cli_result_io import iter_array_chunks, load_result, DEFAULT_CHUNK_SIZE
+from cli_catalog import query_catalog
+from cli_archive import find_archived, archived_results
+from cli_batch_index import batch_result_path, batch_results
+
+def default_results_dir(experiment_info):
+    """batch_results/<timestamp>, where batch-download puts the results of an experiment info file"""
+    filename = os.path.basename(resolve_experiment_info_path(experiment_info))
+    return os.path.join("batch_results", filename[:filename.find('_')])
+
+def find_result_path(task_id, results_dir=None):
+    """Locate the downloaded result of a task in a batch directory, in results/ or in an archive"""
+    if results_dir:
+        path = batch_result_path(results_dir, task_id)
+        if path:
+            return path
+    matches = glob.glob(os.path.join("results", f"*_{task_id}.json"))
+    if matches:
+        return matches[0]
+    archived = find_archived(task_id)
+    return archived['path'] if archived else None
+
+def histogram_counts(path, counts_key, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Histogram the per-shot photon counts of a result file chunk by chunk"""
+    histogram = np.zeros(1, dtype=np.int64)
+    for chunk in iter_array_chunks(path, counts_key, chunk_size):
+        counts = chunk.ravel()
+        # Missing shots (null in JSON) are left out
+        counts = np.clip(np.rint(counts[np.isfinite(counts)]), 0, None).astype(np.int64)
+        if counts.size == 0:
+            continue
+        chunk_histogram = np.bincount(counts)
+        if len(chunk_histogram) > len(histogram):
+            histogram = np.pad(histogram, (0, len(chunk_histogram) - len(histogram)))
+        histogram[:len(chunk_histogram)] += chunk_histogram
+    return histogram
+
+def _pad(histogram, length):
+    return np.pad(histogram, (0, length - len(histogram)))
+
+def choose_threshold(bright, dark):
+    """Return (threshold, fidelity) best separating two reference histograms.
+
+    A shot counts as bright if its photon count is >= threshold. The
+    threshold maximises 1 - (P(bright shot < t) + P(dark shot >= t)) / 2.
+    """
+    length = max(len(bright), len(dark)) + 1
+    bright = _pad(bright, length) / max(bright.sum(), 1)
+    dark = _pad(dark, length) / max(dark.sum(), 1)
+    # P(count < t) for t = 0 .. length - 1
+    bright_below = np.concatenate(([0.0], np.cumsum(bright)[:-1]))
+    dark_below = np.concatenate(([0.0], np.cumsum(dark)[:-1]))
+    fidelity = 1.0 - 0.5 * (bright_below + (1.0 - dark_below))
+    threshold = int(np.argmax(fidelity))
+    return threshold, float(fidelity[threshold])
+
+def bright_fraction(histogram, threshold):
+    total = histogram.sum()
+    return float(histogram[threshold:].sum() / total) if total else float("nan")
+
+def _is_reference(params):
+    return not params.get("circuit")
+
+def analyze_single_shot(experiment_info, results_dir=None, counts_key="photon_counts", threshold=None,
+                        jobs=None, chunk_size=DEFAULT_CHUNK_SIZE, output=None):
+    """Classify the shots of a single-shot experiment with a readout threshold from its reference runs"""
+    try:
+        experiment_data = load_experiment_info(experiment_info)
+    except FileNotFoundError as e:
+        click.echo(f"Experiment info file not found: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in experiment info file: {str(e)}")
+        return None
+
+    results_dir = results_dir or default_results_dir(experiment_info)
+    paths = {}
+    for task_id in experiment_data:
+        path = find_result_path(task_id, results_dir)
+        if path is None:
+            click.echo(f"WARNING: No downloaded result for {task_id}, skipping")
+        else:
+            paths[task_id] = path
+    if not paths:
+        click.echo("No results to analyze. Use 'guest batch-download' first.")
+        return None
+
+    click.echo(f"Histogramming {len(paths)} result(s)...")
+    task_ids = list(paths)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        histograms = dict(zip(task_ids, pool.map(
+            histogram_counts, [paths[t] for t in task_ids],
+            [counts_key] * len(task_ids), [chunk_size] * len(task_ids)
+        )))
+
+    # Reference runs (no circuit) grouped by prepared state
+    references = {}
+    for task_id, histogram in histograms.items():
+        params = experiment_data[task_id]
+        if _is_reference(params) and histogram.sum():
+            state = params.get("initState", "?")
+            previous = references.get(state, np.zeros(1, dtype=np.int64))
+            length = max(len(previous), len(histogram))
+            references[state] = _pad(previous, length) + _pad(histogram, length)
+
+    fidelity = None
+    bright_state = dark_state = None
+    if len(references) >= 2:
+        means = {state: np.dot(np.arange(len(h)), h) / h.sum() for state, h in references.items()}
+        bright_state = max(means, key=means.get)
+        dark_state = min(means, key=means.get)
+        fitted_threshold, fidelity = choose_threshold(references[bright_state], references[dark_state])
+        if threshold is None:
+            threshold = fitted_threshold
+    if threshold is None:
+        click.echo("Need reference runs of at least two initial states (or --threshold) to classify shots.")
+        return None
+
+    # Readout correction from the reference runs' bright fractions
+    bright_ref = bright_fraction(references[bright_state], threshold) if bright_state else 1.0
+    dark_ref = bright_fraction(references[dark_state], threshold) if dark_state else 0.0
+    contrast = bright_ref - dark_ref
+
+    click.echo(f"\nThreshold: {threshold} photon(s)")
+    if fidelity is not None:
+        click.echo(f"Reference: bright = |{bright_state}>, dark = |{dark_state}>, readout fidelity {fidelity:.4f}")
+    click.echo("-" * 100)
+    click.echo(f"{'Task ID':<38} {'initState':<9} {'Ref':<4} {'Shots':>10} {'Mean':>8} {'P(bright)':>10} {'Corrected':>10}")
+    click.echo("-" * 100)
+
+    rows = []
+    for task_id in task_ids:
+        histogram = histograms[task_id]
+        params = experiment_data[task_id]
+        shots = int(histogram.sum())
+        mean = float(np.dot(np.arange(len(histogram)), histogram) / shots) if shots else float("nan")
+        fraction = bright_fraction(histogram, threshold)
+        corrected = (fraction - dark_ref) / contrast if contrast else float("nan")
+        rows.append({
+            "task_id": task_id,
+            "initState": params.get("initState"),
+            "reference": _is_reference(params),
+            "shots": shots,
+            "mean_counts": mean,
+            "bright_fraction": fraction,
+            "corrected_bright_fraction": corrected,
+        })
+        click.echo(f"{task_id:<38} {str(params.get('initState')):<9} {'yes' if _is_reference(params) else '':<4} "
+                   f"{shots:>10} {mean:>8.3f} {fraction:>10.4f} {corrected:>10.4f}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({
+                "experiment_info": experiment_info,
+                "threshold": threshold,
+                "readout_fidelity": fidelity,
+                "bright_state": bright_state,
+                "dark_state": dark_state,
+                "tasks": rows,
+            }, f, indent=2)
+        click.echo(f"\nSaved analysis to {output}")
+    return rows
+
+# ----------------- RABI FITTING -----------------------------------------------------------------
+
+RABI_GLOB = os.path.join("results", "run_rabi_oscillation_*.json")
+
+# Candidate periods tried around each seed, relative to the seed
+SEED_SPAN = np.geomspace(0.5, 2.0, 41)
+# Candidate periods of the unseeded scan, relative to the sampled time span
+SCAN_POINTS = 61
+# Upper bound for traces * candidates * samples evaluated at once in the grid search
+GRID_BLOCK = 4_000_000
+
+def stored_rabi_periods(qubit=1):
+    """Most recent stored (rabi_period_fast, rabi_period_slow) of a qubit in ns, from the results catalog"""
+    key = f"qb{qubit}_calibration_results"
+    rows = query_catalog([f"{key}.rabi_period_fast>0"])
+    for row in reversed(rows):
+        calibration = row.get(key) or {}
+        seeds = {name: calibration.get(f"rabi_period_{name}") for name in ("fast", "slow")}
+        return {name: period * 1e9 for name, period in seeds.items() if period}
+    return {}
+
+def load_rabi_trace(path):
+    """Return (pulse durations in ns, photon counts) of a Rabi result, or None if it is not one"""
+    data = load_result(path)
+    if not isinstance(data, dict) or "pulse_durations_ns" not in data or "photon_counts" not in data:
+        return None
+    t = np.asarray(data["pulse_durations_ns"], dtype=np.float64).ravel()
+    y = np.asarray(data["photon_counts"], dtype=np.float64).ravel()
+    n = min(len(t), len(y))
+    return t[:n], y[:n]
+
+def _stack_traces(traces):
+    """Pad traces of different lengths into (N, M) arrays with a 0/1 weight mask"""
+    length = max(len(t) for t, _ in traces)
+    T = np.zeros((len(traces), length))
+    Y = np.zeros((len(traces), length))
+    W = np.zeros((len(traces), length))
+    for i, (t, y) in enumerate(traces):
+        T[i, :len(t)] = t
+        Y[i, :len(y)] = y
+        W[i, :len(t)] = 1.0
+    return T, Y, W
+
+def _linear_fit(T, Y, W, periods):
+    """Solve offset and amplitude in closed form for every (trace, candidate period); returns (offset, amplitude, sse)"""
+    C = np.cos(2 * np.pi / periods[:, :, None] * T[:, None, :])
+    WC = W[:, None, :] * C
+    s1 = W.sum(axis=1)[:, None]
+    sy = (W * Y).sum(axis=1)[:, None]
+    syy = (W * Y * Y).sum(axis=1)[:, None]
+    sc = WC.sum(axis=2)
+    scc = (WC * C).sum(axis=2)
+    syc = (WC * Y[:, None, :]).sum(axis=2)
+    det = s1 * scc - sc ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amplitude = (s1 * syc - sc * sy) / det
+        offset = (sy - amplitude * sc) / s1
+        sse = syy - offset * sy - amplitude * syc
+    sse[~np.isfinite(sse) | (np.abs(det) < 1e-12 * s1 * s1)] = np.inf
+    return offset, amplitude, sse
+
+def _grid_search(T, Y, W, periods):
+    """Best (offset, amplitude, period) per trace over a (N, K) grid of candidate periods"""
+    n, k = periods.shape
+    block = max(1, GRID_BLOCK // max(1, k * T.shape[1]))
+    result = np.empty((n, 3))
+    for start in range(0, n, block):
+        rows = slice(start, start + block)
+        offset, amplitude, sse = _linear_fit(T[rows], Y[rows], W[rows], periods[rows])
+        best = np.argmin(sse, axis=1)
+        index = np.arange(len(best))
+        result[rows, 0] = offset[index, best]
+        result[rows, 1] = amplitude[index, best]
+        result[rows, 2] = periods[rows][index, best]
+    return result
+
+def _model(params, T):
+    offset, amplitude, omega = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+    return offset + amplitude * np.cos(omega * T)
+
+def _refine(T, Y, W, params, max_iterations=50, tolerance=1e-10):
+    """Levenberg-Marquardt on (offset, amplitude, omega), one damped step per trace per iteration"""
+    params = params.copy()
+    damping = np.full(len(params), 1e-3)
+    sse = (W * (Y - _model(params, T)) ** 2).sum(axis=1)
+    converged = np.zeros(len(params), dtype=bool)
+    for _ in range(max_iterations):
+        active = ~converged
+        if not active.any():
+            break
+        p, t, y, w = params[active], T[active], Y[active], W[active]
+        phase = p[:, 2:3] * t
+        J = np.stack([np.ones_like(t), np.cos(phase), -p[:, 1:2] * t * np.sin(phase)], axis=2) * w[:, :, None]
+        r = (y - _model(p, t)) * w
+        JtJ = np.einsum("nmi,nmj->nij", J, J)
+        Jtr = np.einsum("nmi,nm->ni", J, r)
+        diagonal = np.einsum("nii->ni", JtJ)
+        lm = damping[active][:, None, None] * (np.eye(3) * (diagonal[:, :, None] + 1e-12))
+        step = np.einsum("nij,nj->ni", np.linalg.pinv(JtJ + lm), Jtr)
+        trial = p + step
+        trial_sse = (w * (y - _model(trial, t)) ** 2).sum(axis=1)
+
+        improved = trial_sse < sse[active]
+        relative = np.abs(sse[active] - trial_sse) / np.maximum(sse[active], 1e-300)
+        indices = np.flatnonzero(active)
+        params[indices[improved]] = trial[improved]
+        sse[indices[improved]] = trial_sse[improved]
+        damping[indices[improved]] /= 10
+        damping[indices[~improved]] *= 10
+        converged[indices[(improved & (relative < tolerance)) | (damping[indices] > 1e10)]] = True
+    return params, sse, converged
+
+def fit_rabi_traces(traces, seeds=None):
+    """Fit offset + amplitude * cos(2 pi t / period) to many Rabi traces at once.
+
+    traces is a list of (t_ns, counts) pairs. Candidate periods around each
+    seed (in ns) and a coarse scan over the sampled span are solved in closed
+    form, and the best candidate of each trace is refined by Levenberg-Marquardt.
+    Returns one dict per trace.
+    """
+    T, Y, W = _stack_traces(traces)
+    t_min = np.where(W > 0, T, np.inf).min(axis=1)
+    t_max = np.where(W > 0, T, -np.inf).max(axis=1)
+    span = np.maximum(t_max - t_min, 1e-12)
+    counts = W.sum(axis=1)
+
+    # Shortest resolvable period is ~2 samples, the longest ~2 spans
+    scan = np.geomspace(2 * span / np.maximum(counts - 1, 1), 2 * span, SCAN_POINTS, axis=1)
+    candidates = [scan]
+    names = ["scan"] * SCAN_POINTS
+    for name, period in (seeds or {}).items():
+        candidates.append(np.broadcast_to(period * SEED_SPAN, (len(traces), len(SEED_SPAN))))
+        names += [name] * len(SEED_SPAN)
+    periods = np.concatenate(candidates, axis=1)
+
+    start = _grid_search(T, Y, W, periods)
+    origin = [names[np.flatnonzero(periods[i] == start[i, 2])[0]] for i in range(len(traces))]
+    start[:, 2] = 2 * np.pi / start[:, 2]
+    params, sse, converged = _refine(T, Y, W, start)
+
+    fits = []
+    for i in range(len(traces)):
+        offset, amplitude, omega = params[i]
+        fits.append({
+            "period_ns": float(2 * np.pi / abs(omega)) if omega else float("inf"),
+            "offset": float(offset),
+            "amplitude": float(amplitude),
+            "rms": float(np.sqrt(sse[i] / counts[i])) if counts[i] else float("nan"),
+            "seed": origin[i],
+            "converged": bool(converged[i]),
+        })
+    return fits
+
+def analyze_rabi(paths=None, qubit=1, output=None):
+    """Fit all Rabi traces at once, warm-started from the latest stored calibration of a qubit"""
+    paths = paths or sorted(glob.glob(RABI_GLOB)) + archived_results("run_rabi_oscillation")
+    paths = [result for path in paths for result in (batch_results(path) if os.path.isdir(path) else [path])]
+    traces = []
+    used = []
+    for path in paths:
+        try:
+            trace = load_rabi_trace(path)
+        except (OSError, ValueError) as e:
+            click.echo(f"WARNING: Cannot read {path}: {e}")
+            continue
+        if trace is None or len(trace[0]) < 4:
+            click.echo(f"WARNING: {path} is not a Rabi result with enough points, skipping")
+            continue
+        traces.append(trace)
+        used.append(path)
+    if not traces:
+        click.echo("No Rabi traces to fit.")
+        return None
+
+    seeds = stored_rabi_periods(qubit)
+    if seeds:
+        click.echo("Seeds from stored calibration of qubit {}: {}".format(
+            qubit, ", ".join(f"{name} {period:.1f} ns" for name, period in seeds.items())))
+    else:
+        click.echo(f"No stored Rabi periods for qubit {qubit}, scanning the sampled range only")
+
+    started = time.time()
+    fits = fit_rabi_traces(traces, seeds)
+    click.echo(f"Fitted {len(fits)} trace(s) in {time.time() - started:.2f} s\n")
+
+    click.echo(f"{'File':<60} {'Period (ns)':>12} {'Offset':>10} {'Amplitude':>10} {'RMS':>10} {'Seed':<5} {'Conv':<4}")
+    click.echo("-" * 116)
+    for path, fit in zip(used, fits):
+        fit["path"] = path
+        click.echo(f"{os.path.basename(path):<60} {fit['period_ns']:>12.3f} {fit['offset']:>10.4g} "
+                   f"{fit['amplitude']:>10.4g} {fit['rms']:>10.4g} {fit['seed']:<5} {'yes' if fit['converged'] else 'no':<4}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump({"qubit": qubit, "seeds_ns": seeds, "fits": fits}, f, indent=2)
+        click.echo(f"\nSaved fits to {output}")
+    return fits
@@ -0,0 +1,350 @@
+import io
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+import click
+
+from cli_store import OBJECTS_DIR, task_from_filename, lookup_task, object_path, file_digest
+from cli_batch_index import load_batch_index
+
+RESULT_DIRS = ("results", "batch_results")
+ARCHIVE_SUFFIX = ".zip"
+# Per-archive member index next to each archive: <archive>.zip.idx
+INDEX_SUFFIX = ".idx"
+# Columns of a member index row
+INDEX_FIELDS = ("member", "task_id", "task_type", "sidecar", "offset", "compressed_size", "size", "crc", "method", "mtime")
+
+_AGE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$")
+_AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "": 86400}
+
+# Fixed part of a zip local file header; the name and extra field follow it
+_LOCAL_HEADER = struct.Struct("<4s5HL2L2H")
+
+_archive_index = None
+_member_indexes = {}
+_index_lock = threading.Lock()
+
+def parse_age(text):
+    """Seconds in an age like 30d, 12h, 90m, 2w or 45s; a plain number means days"""
+    match = _AGE.match(text)
+    if not match:
+        raise ValueError(f"Invalid age '{text}', expected e.g. 30d, 12h or 2w")
+    value, unit = match.groups()
+    return float(value) * _AGE_UNITS[unit]
+
+# ----------------- READING ----------------------------------------------------------------------
+
+def split_archive_path(path):
+    """Return (archive, member) for a path inside an archive like batch_results/<ts>.zip/<id>.json, else None"""
+    path = str(path)
+    marker = path.find(ARCHIVE_SUFFIX + "/")
+    if marker < 0:
+        return None
+    archive = path[:marker + len(ARCHIVE_SUFFIX)]
+    if not os.path.isfile(archive):
+        return None
+    return archive, path[marker + len(ARCHIVE_SUFFIX) + 1:]
+
+def is_archived(path):
+    return split_archive_path(path) is not None
+
+def load_archive_index(archive):
+    """Member index of an archive: {member: {task_id, task_type, offset, compressed_size, size, crc, method}}"""
+    index_path = archive + INDEX_SUFFIX
+    mtime = os.stat(index_path).st_mtime
+    with _index_lock:
+        cached = _member_indexes.get(archive)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(index_path, "r") as f:
+        rows = json.load(f)["members"]
+    members = {row[0]: dict(zip(INDEX_FIELDS[1:], row[1:])) for row in rows}
+    with _index_lock:
+        _member_indexes[archive] = (mtime, members)
+    return members
+
+class _MemberReader(io.RawIOBase):
+    """Stream one member of an archive, starting at its offset from the member index.
+
+    Only the member's own bytes are read; the archive's central directory is
+    never parsed, so access time does not depend on the archive size.
+    """
+
+    def __init__(self, archive, entry):
+        self.file = open(archive, "rb")
+        self.file.seek(entry["offset"])
+        header = _LOCAL_HEADER.unpack(self.file.read(_LOCAL_HEADER.size))
+        if header[0] != b"PK\x03\x04":
+            self.file.close()
+            raise ValueError(f"Corrupt archive {archive}: no member at offset {entry['offset']}")
+        name_length, extra_length = header[-2:]
+        self.file.seek(name_length + extra_length, os.SEEK_CUR)
+        self.remaining = entry["compressed_size"]
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if entry["method"] == zipfile.ZIP_DEFLATED else None
+        self.buffer = b""
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while self.position == len(self.buffer) and self.remaining:
+            data = self.file.read(min(self.remaining, 1 << 20))
+            if not data:
+                raise EOFError("Archive member is truncated")
+            self.remaining -= len(data)
+            if self.decompressor is not None:
+                data = self.decompressor.decompress(data)
+                if not self.remaining:
+                    data += self.decompressor.flush()
+            self.buffer = data
+            self.position = 0
+        size = min(len(target), len(self.buffer) - self.position)
+        target[:size] = self.buffer[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+def open_result(path, mode="r"):
+    """open() for result files that also reads members of archives"""
+    location = split_archive_path(path)
+    if location is None:
+        return open(path, mode)
+    archive, member = location
+    entry = load_archive_index(archive).get(member)
+    if entry is None:
+        raise FileNotFoundError(f"{member} is not in {archive}")
+    reader = io.BufferedReader(_MemberReader(archive, entry), buffer_size=1 << 20)
+    return reader if "b" in mode else io.TextIOWrapper(reader, encoding="utf-8")
+
+def binary_source(path):
+    """A path or, for archive members, an in-memory file that np.load and zipfile can seek in"""
+    if not is_archived(path):
+        return path
+    with open_result(path, "rb") as f:
+        return io.BytesIO(f.read())
+
+def result_size(path):
+    location = split_archive_path(path)
+    if location is None:
+        return os.path.getsize(path)
+    archive, member = location
+    return load_archive_index(archive)[member]["size"]
+
+def _load_archive_index():
+    global _archive_index
+    if _archive_index is None:
+        index = {}
+        for root in RESULT_DIRS:
+            if not os.path.isdir(root):
+                continue
+            for name in sorted(os.listdir(root)):
+                if not name.endswith(ARCHIVE_SUFFIX + INDEX_SUFFIX):
+                    continue
+                archive = os.path.join(root, name[:-len(INDEX_SUFFIX)])
+                for member, entry in load_archive_index(archive).items():
+                    if entry.get("task_id"):
+                        index[entry["task_id"]] = dict(entry, path=f"{archive}/{member}")
+        _archive_index = index
+    return _archive_index
+
+def archived_results(task_type=None):
+    """Paths inside archives of all archived task results, optionally of one task type"""
+    return sorted(entry["path"] for entry in _load_archive_index().values()
+                  if task_type is None or entry.get("task_type") == task_type)
+
+def find_archived(task_id):
+    """Return the index entry of an archived task result, with its 'path' inside the archive, or None"""
+    return _load_archive_index().get(task_id)
+
+# ----------------- WRITING ----------------------------------------------------------------------
+
+def _disk_usage(paths):
+    """Allocated bytes and inodes of the given files"""
+    blocks = 0
+    inodes = set()
+    for path in paths:
+        st = os.stat(path)
+        if (st.st_dev, st.st_ino) not in inodes:
+            inodes.add((st.st_dev, st.st_ino))
+            blocks += st.st_blocks * 512
+    return blocks, len(inodes)
+
+def _write_atomic(path, write):
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_archive(archive, files, task_ids=None):
+    """Pack (path, member name) pairs into a compressed archive and write its member index.
+
+    task_ids maps paths to task IDs where the file name does not tell, as in sharded batch directories.
+    """
+    task_ids = task_ids or {}
+    members = {}
+
+    # <base>.npz or <base>.<key>.npy hold the arrays of the sidecar <base>.json
+    binary_bases = {member[:-4] for _, member in files if member.endswith(".npz")}
+    binary_bases.update(member[:-4].rsplit(".", 1)[0] for _, member in files if member.endswith(".npy"))
+
+    def write_zip(f):
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            for path, member in files:
+                zf.write(path, member)
+                task_id, task_type = task_from_filename(path)
+                task_id = task_ids.get(path, task_id)
+                if task_id and not task_type:
+                    # Batch results are named by task ID only; the store knows what they ran
+                    task_type = (lookup_task(task_id) or {}).get("task_type")
+                info = zf.getinfo(member)
+                members[member] = {
+                    "task_id": task_id if member.endswith(".json") else None,
+                    "task_type": task_type,
+                    "sidecar": member.endswith(".json") and member[:-5] in binary_bases,
+                    "offset": info.header_offset,
+                    "compressed_size": info.compress_size,
+                    "size": info.file_size,
+                    "crc": info.CRC,
+                    "method": info.compress_type,
+                    "mtime": int(os.stat(path).st_mtime),
+                }
+
+    _write_atomic(archive, write_zip)
+    # One row per member instead of one object, which keeps the index a fraction of the archive size
+    rows = [[member] + [entry[name] for name in INDEX_FIELDS[1:]] for member, entry in members.items()]
+    _write_atomic(archive + INDEX_SUFFIX, lambda f: f.write(
+        json.dumps({"format": 1, "fields": INDEX_FIELDS, "members": rows}, separators=(",", ":")).encode("utf-8")))
+    return members
+
+def _stored_objects(files, task_ids):
+    """Object store paths of the results among the files whose content the archive keeps"""
+    objects = set()
+    for path, _ in files:
+        task_id = task_ids.get(path, task_from_filename(path)[0])
+        stored = lookup_task(task_id) if task_id and path.endswith(".json") else None
+        if not stored:
+            continue
+        target = object_path(stored["digest"])
+        # A copy edited since it was saved does not replace the stored original
+        if os.path.samefile(path, target) or (os.path.getsize(path) == os.path.getsize(target)
+                                              and file_digest(path) == stored["digest"]):
+            objects.add(target)
+    return objects
+
+def _remove_archived(files, objects):
+    """Delete archived files and their store objects that no remaining file links to.
+
+    Results are looked up in the archive index once their object is gone.
+    """
+    directories = set()
+    for path, _ in files:
+        os.remove(path)
+        directories.add(os.path.dirname(path))
+    kept = [target for target in objects if os.stat(target).st_nlink > 1]
+    for target in objects.difference(kept):
+        os.remove(target)
+        directories.add(os.path.dirname(target))
+    # Deepest first, so that emptied parents can go as well
+    for directory in sorted(directories, key=lambda directory: -directory.count(os.sep)):
+        while directory and directory not in RESULT_DIRS and directory != OBJECTS_DIR:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+def _files_below(directory):
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            files.append((path, os.path.relpath(path, directory)))
+    return sorted(files, key=lambda item: item[1])
+
+def _archive_groups(cutoff):
+    """Yield (archive path, files, task IDs by path) for the batch directories and loose results last modified before cutoff"""
+    if os.path.isdir("batch_results"):
+        for name in sorted(os.listdir("batch_results")):
+            directory = os.path.join("batch_results", name)
+            if not os.path.isdir(directory):
+                continue
+            files = _files_below(directory)
+            if files and max(os.lstat(path).st_mtime for path, _ in files) < cutoff:
+                indexed = load_batch_index(directory) or {}
+                yield directory + ARCHIVE_SUFFIX, files, {entry["path"]: task_id for task_id, entry in indexed.items()}
+    if os.path.isdir("results"):
+        entries = [entry for entry in os.scandir("results") if entry.is_file()]
+        old = {entry.name[:-5] for entry in entries if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff}
+        # Arrays of binary results go along with their sidecar JSON
+        files = [
+            (entry.path, entry.name) for entry in entries
+            if entry.name[:-5] in old and entry.name.endswith(".json")
+            or entry.name[:-4] in old and entry.name.endswith(".npz")
+            or entry.name[:-4].rsplit(".", 1)[0] in old and entry.name.endswith(".npy")
+        ]
+        if files:
+            stamp = time.strftime("%Y-%m-%dT%H-%M-%S")
+            yield os.path.join("results", f"archive_{stamp}{ARCHIVE_SUFFIX}"), sorted(files, key=lambda item: item[1]), {}
+
+def archive_results(older_than="30d", dry_run=False):
+    """Pack batch result directories and results/ files older than the given age into archives"""
+    cutoff = time.time() - parse_age(older_than)
+    archived_files = 0
+    before_bytes = before_inodes = after_bytes = 0
+    all_objects = set()
+    archives = 0
+    for archive, files, task_ids in _archive_groups(cutoff):
+        if os.path.exists(archive):
+            click.echo(f"Skipping {archive}: it exists already")
+            continue
+        objects = _stored_objects(files, task_ids)
+        # Hard links into the object store are counted once
+        blocks, inodes = _disk_usage([path for path, _ in files] + sorted(objects))
+        if dry_run:
+            click.echo(f"Would archive {len(files)} file(s) into {archive}")
+        else:
+            write_archive(archive, files, task_ids)
+            _remove_archived(files, objects)
+            all_objects.update(objects)
+            after_bytes += _disk_usage([archive, archive + INDEX_SUFFIX])[0]
+            click.echo(f"Archived {len(files)} file(s) into {archive}")
+        archives += 1
+        archived_files += len(files)
+        before_bytes += blocks
+        before_inodes += inodes
+
+    if not archives:
+        click.echo(f"No results older than {older_than} to archive.")
+        return 0
+    if dry_run:
+        click.echo(f"\n{archived_files} file(s) in {archives} archive(s), {before_bytes / 1024:.1f} KiB on disk "
+                   f"with their store objects")
+        return archived_files
+    click.echo(f"\nArchived {archived_files} file(s): {before_bytes / 1024:.1f} KiB in {before_inodes} inode(s) "
+               f"with their store objects -> {after_bytes / 1024:.1f} KiB in {2 * archives} file(s)")
+    kept_bytes, kept_objects = _disk_usage(target for target in all_objects if os.path.exists(target))
+    if kept_objects:
+        click.echo(f"Kept {kept_objects} store object(s), {kept_bytes / 1024:.1f} KiB, still linked by other results")
+    global _archive_index
+    _archive_index = None
+    return archived_files
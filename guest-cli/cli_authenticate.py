@@ -3,6 +3,16 @@ import time
 import sys
 import json
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 
 def load_config():
     with open("config.json", "r") as config_file:
@@ -21,28 +31,122 @@ TOKEN_FILE_PATH = config["paths"]["token_file_path"]
 DEVICE_ENDPOINT = f"{KEYCLOAK_BASE_URL}/realms/{REALM}/protocol/openid-connect/auth/device"
 TOKEN_ENDPOINT = f"{KEYCLOAK_BASE_URL}/realms/{REALM}/protocol/openid-connect/token"
 
-def store_token_json(token_json):
+# Seconds of remaining validity below which the access token is renewed
+RENEW_MARGIN = 60
+
+_TOKEN_LOCK_PATH = TOKEN_FILE_PATH + ".lock"
+# Serializes renewal between threads of one process; the file lock does so between processes
+_thread_lock = threading.Lock()
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive lock on lock_path, held against other processes; threads of one process need their own lock"""
+    with open(lock_path, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def token_lock():
+    """Exclusive lock around token renewal, shared by all guest processes using this token file"""
+    os.makedirs(os.path.dirname(TOKEN_FILE_PATH), exist_ok=True)
+    with _thread_lock, file_lock(_TOKEN_LOCK_PATH):
+        yield
+
+def store_token_json(token_json, quiet=False):
     # Add expiration timestamp
     token_json["expires_at"] = time.time() + token_json["expires_in"]
+    if "refresh_expires_in" in token_json:
+        token_json["refresh_expires_at"] = time.time() + token_json["refresh_expires_in"]
     
     # Ensure directory exists
     os.makedirs(os.path.dirname(TOKEN_FILE_PATH), exist_ok=True)
     
-    # Save token to file
-    with open(TOKEN_FILE_PATH, "w") as token_file:
-        json.dump(token_json, token_file)
+    # Write a temporary file and rename it, so readers never see a half-written token
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(TOKEN_FILE_PATH), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as token_file:
+            json.dump(token_json, token_file)
+            token_file.flush()
+            os.fsync(token_file.fileno())
+        os.replace(tmp_path, TOKEN_FILE_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
     
-    print(f"Token stored at {TOKEN_FILE_PATH}")
+    if not quiet:
+        print(f"Token stored at {TOKEN_FILE_PATH}")
 
-def load_token_json():
-    # Check if token file exists
-    if os.path.exists(TOKEN_FILE_PATH):
+def _read_token_file():
+    try:
         with open(TOKEN_FILE_PATH, "r") as token_file:
-            token_json = json.load(token_file)
-            return token_json
-    else:
+            return json.load(token_file)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        # Left behind by a crash of an older version that wrote the file in place
         return None
 
+def _needs_renewal(token_json):
+    return token_json['expires_at'] - time.time() < RENEW_MARGIN
+
+def refresh_token_json(token_json):
+    """Renew the access token with the refresh token; returns the new token or None"""
+    if not token_json.get("refresh_token"):
+        return None
+    if token_json.get("refresh_expires_at", float("inf")) - time.time() < RENEW_MARGIN:
+        return None
+    try:
+        token_resp = requests.post(TOKEN_ENDPOINT,
+                                   data={
+                                       "client_id": CLIENT_ID,
+                                       "grant_type": "refresh_token",
+                                       "refresh_token": token_json["refresh_token"]
+                                   },
+                                   verify=VERIFY_SERVER_CERT)
+    except requests.exceptions.RequestException:
+        return None
+    if token_resp.status_code != 200:
+        return None
+    new_token = token_resp.json()
+    store_token_json(new_token, quiet=True)
+    return new_token
+
+def load_token_json():
+    """Load the stored token, renewing it first if it is about to expire.
+
+    Only one process renews at a time: the others wait for the lock and
+    then find the renewed token in the file.
+    """
+    token_json = _read_token_file()
+    if token_json is None or not _needs_renewal(token_json):
+        return token_json
+    with token_lock():
+        # Another process may have renewed it while we waited
+        token_json = _read_token_file()
+        if token_json is None or not _needs_renewal(token_json):
+            return token_json
+        return refresh_token_json(token_json) or token_json
+
+def current_access_token(fallback=None):
+    """The stored access token, renewed if it is about to expire; fallback if there is none.
+
+    Long-running commands call this again before requests instead of
+    keeping the token they started with, which expires after an hour.
+    """
+    token_json = load_token_json()
+    return token_json["access_token"] if token_json else fallback
+
 def check_token():
     token_json = load_token_json()
     
@@ -92,7 +196,8 @@ def authenticate_device_flow():
             print(f"Access token expires in {expires_in // 60} minutes")
             
             # Store the token
-            store_token_json(token_json)
+            with token_lock():
+                store_token_json(token_json)
             return token_json
 
         elif token_resp.status_code == 400:
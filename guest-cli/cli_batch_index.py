@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+
+from cli_http import config
+from cli_ledger import _repair_tail
+
+BATCH_CONFIG = config.get("batch_layout", {})
+# "flat" puts every result straight into batch_results/<timestamp>/, "sharded" spreads them over hashed subdirectories
+DEFAULT_LAYOUT = BATCH_CONFIG.get("layout", "flat")
+# Subdirectory levels and hex digits of the task ID hash per level; 1 x 2 gives 256 shards of ~400 files per 100k tasks
+FANOUT_LEVELS = BATCH_CONFIG.get("fanout_levels", 1)
+FANOUT_WIDTH = BATCH_CONFIG.get("fanout_width", 2)
+LAYOUTS = ("flat", "sharded")
+
+# Per-batch index: batch_results/<timestamp>/index.jsonl
+INDEX_NAME = "index.jsonl"
+# Index lines are written in batches of this many
+INDEX_WRITE_BATCH = 256
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def index_path(directory):
+    return os.path.join(directory, INDEX_NAME)
+
+def shard_path(task_id, levels=FANOUT_LEVELS, width=FANOUT_WIDTH):
+    """Relative path of a task's result in the sharded layout, e.g. 3f/<task_id>.json"""
+    digest = hashlib.sha1(task_id.encode("utf-8")).hexdigest()
+    shards = [digest[level * width:(level + 1) * width] for level in range(levels)]
+    return os.path.join(*shards, f"{task_id}.json")
+
+def _read_index(path):
+    """Return (header, {task_id: {'path', 'size', 'mtime'}}) with paths relative to the batch directory"""
+    header = {"layout": "flat"}
+    entries = {}
+    with open(path, "r") as f:
+        lines = [line for line in f.read().split("\n") if line]
+    try:
+        # One parse for the whole file is several times faster than one per line
+        parsed = json.loads("[" + ",".join(lines) + "]")
+    except ValueError:
+        parsed = []
+        for line in lines:
+            try:
+                parsed.append(json.loads(line))
+            except ValueError:
+                # Torn last line of an interrupted write
+                continue
+    for entry in parsed:
+        if "task_id" in entry:
+            entries[entry.pop("task_id")] = entry
+        else:
+            header = entry
+    return header, entries
+
+def load_batch_index(directory):
+    """{task_id: {'path', 'size', 'mtime'}} of a batch directory with an index, else None; paths include the directory"""
+    path = index_path(directory)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime, st.st_size)
+    with _indexes_lock:
+        cached = _indexes.get(directory)
+        if cached and cached[0] == key:
+            return cached[1]
+    _, entries = _read_index(path)
+    entries = {task_id: dict(entry, path=os.path.join(directory, entry["path"])) for task_id, entry in entries.items()}
+    with _indexes_lock:
+        _indexes[directory] = (key, entries)
+    return entries
+
+def batch_result_path(directory, task_id):
+    """Path of a task's result in a batch directory, or None if it is not there"""
+    entries = load_batch_index(directory)
+    if entries is not None:
+        entry = entries.get(task_id)
+        return entry["path"] if entry else None
+    # Batches downloaded before the index existed are flat
+    candidate = os.path.join(directory, f"{task_id}.json")
+    return candidate if os.path.exists(candidate) else None
+
+def batch_results(directory):
+    """Paths of the task results in a batch directory, in index order"""
+    entries = load_batch_index(directory)
+    if entries is not None:
+        return [entry["path"] for entry in entries.values()]
+    return [path for _, path in _scan_flat(directory)]
+
+class BatchIndex:
+    """Writer of the index of a batch result directory.
+
+    The layout is fixed when the index is created: a directory that
+    already holds results without an index is flat and gets indexed from
+    one scan. New entries are appended to index.jsonl in batches and on
+    close; a later entry for the same task replaces an earlier one.
+    """
+
+    def __init__(self, directory, layout=None):
+        self.directory = str(directory)
+        self.path = index_path(self.directory)
+        self.lock = threading.Lock()
+        self.pending = []
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            self.header, self.entries = _read_index(self.path)
+            self.file = open(self.path, "a+b")
+            _repair_tail(self.file)
+        else:
+            existing = _scan_flat(self.directory)
+            layout = "flat" if existing else layout or DEFAULT_LAYOUT
+            if layout not in LAYOUTS:
+                raise ValueError(f"Unknown batch layout '{layout}', expected one of {', '.join(LAYOUTS)}")
+            self.header = {"layout": layout}
+            if layout == "sharded":
+                self.header.update(fanout_levels=FANOUT_LEVELS, fanout_width=FANOUT_WIDTH)
+            self.entries = {}
+            self.file = open(self.path, "a+b")
+            self.pending.append(json.dumps(self.header))
+            for task_id, path in existing:
+                self.add(task_id, path)
+            self.flush()
+
+    @property
+    def layout(self):
+        return self.header.get("layout", "flat")
+
+    def result_path(self, task_id):
+        """Where a task's result goes in this directory"""
+        if self.layout == "sharded":
+            relative = shard_path(task_id, self.header.get("fanout_levels", FANOUT_LEVELS),
+                                  self.header.get("fanout_width", FANOUT_WIDTH))
+        else:
+            relative = f"{task_id}.json"
+        return os.path.join(self.directory, relative)
+
+    def add(self, task_id, path):
+        """Record the file a task's result was saved to"""
+        st = os.stat(path)
+        entry = {"path": os.path.relpath(path, self.directory), "size": st.st_size, "mtime": st.st_mtime}
+        with self.lock:
+            if self.entries.get(task_id) == entry:
+                return
+            self.entries[task_id] = entry
+            self.pending.append(json.dumps(dict(entry, task_id=task_id)))
+            if len(self.pending) >= INDEX_WRITE_BATCH:
+                self._write()
+
+    def _write(self):
+        if self.pending:
+            self.file.write(("\n".join(self.pending) + "\n").encode("utf-8"))
+            self.file.flush()
+            self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _scan_flat(directory):
+    """(task_id, path) of the results of a batch directory written before it had an index"""
+    found = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                found.append((entry.name[:-5], entry.path))
+    return sorted(found)
@@ -0,0 +1,157 @@
+import io
+import json
+import os
+import re
+import time
+import hashlib
+import tempfile
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+
+TOKEN_FILE_PATH = config["paths"]["token_file_path"]
+CACHE_DIR = os.path.join(os.path.dirname(TOKEN_FILE_PATH), "http_cache")
+
+# How long responses for unfinished tasks are served without asking the server
+CACHE_TTL = config.get("cache", {}).get("ttl_seconds", 5)
+
+# Statuses after which a task will not change anymore
+TERMINAL_STATUSES = {'SUCCESS', 'FAILURE', 'REVOKED', 'CANCELED'}
+
+# Failure types the server retries automatically, so such a FAILURE can still change
+RETRYABLE_FAILURE_TYPES = {'QUDI_MODULES_BUSY', 'QUDI_SERVER_UNREACHABLE', 'TIMEOUT', 'CONNECTION_ERROR'}
+
+def is_final(task):
+    """Whether a task response can be cached forever; a FAILURE only once its failure type is not retried"""
+    status = task.get("status")
+    if status == 'FAILURE':
+        return bool(task.get("failure_type")) and task["failure_type"] not in RETRYABLE_FAILURE_TYPES
+    return status in TERMINAL_STATUSES
+
+# /api/tasks/<id>; result downloads are deduplicated by the object store instead
+CACHEABLE_PATH = re.compile(r"/api/tasks/[^/?]+$")
+
+# Headers that describe the wire encoding rather than the decoded body we store
+_WIRE_HEADERS = ("Content-Encoding", "Content-Length", "Transfer-Encoding", "Connection")
+
+class CachingAdapter(HTTPAdapter):
+    """Transport adapter serving task responses from an on-disk cache.
+
+    Responses of finished tasks are kept forever, except failures the
+    server still retries. Responses of unfinished tasks are served for
+    CACHE_TTL seconds and then revalidated with ETag/Last-Modified.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".body"
+
+    def _load_entry(self, meta_path):
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, meta_path)
+
+    def _is_cacheable(self, request):
+        if request.method != "GET" or request.headers.get("Accept") == "text/event-stream":
+            return False
+        path = request.path_url.split("?", 1)[0]
+        return CACHEABLE_PATH.search(path) is not None
+
+    def _cached_response(self, request, entry, body_path, source):
+        response = Response()
+        response.status_code = entry["status_code"]
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.headers["X-Guest-Cache"] = source
+        response.encoding = get_encoding_from_headers(response.headers)
+        # Cached bodies are small; reading them whole leaves no file open behind the response
+        with open(body_path, "rb") as f:
+            response._content = f.read()
+        response._content_consumed = True
+        response.raw = io.BytesIO(response._content)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def _store(self, request, response, meta_path, body_path):
+        """Stream the response body into the cache and return the cache entry"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                f.write(chunk)
+        response.close()
+        os.replace(tmp_path, body_path)
+
+        try:
+            with open(body_path, "rb") as f:
+                permanent = is_final(json.load(f))
+        except (ValueError, AttributeError):
+            permanent = False
+
+        headers = {k: v for k, v in response.headers.items() if k not in _WIRE_HEADERS}
+        entry = {
+            "url": request.url,
+            "status_code": response.status_code,
+            "headers": headers,
+            "stored_at": time.time(),
+            "permanent": permanent,
+        }
+        self._write_meta(meta_path, entry)
+        return entry
+
+    def send(self, request, **kwargs):
+        if not self._is_cacheable(request):
+            return super().send(request, **kwargs)
+
+        meta_path, body_path = self._paths(request.url)
+        entry = self._load_entry(meta_path)
+        if entry is not None and not os.path.exists(body_path):
+            entry = None
+
+        if entry is not None:
+            if entry["permanent"] or time.time() - entry["stored_at"] < self.ttl:
+                return self._cached_response(request, entry, body_path, "HIT")
+            etag = entry["headers"].get("ETag")
+            last_modified = entry["headers"].get("Last-Modified")
+            if etag:
+                request.headers["If-None-Match"] = etag
+            if last_modified:
+                request.headers["If-Modified-Since"] = last_modified
+
+        kwargs["stream"] = True
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            entry["stored_at"] = time.time()
+            self._write_meta(meta_path, entry)
+            return self._cached_response(request, entry, body_path, "REVALIDATED")
+        if response.status_code != 200:
+            return response
+
+        entry = self._store(request, response, meta_path, body_path)
+        return self._cached_response(request, entry, body_path, "MISS")
@@ -0,0 +1,251 @@
+import json
+import time
+import click
+import numpy as np
+import requests
+from datetime import datetime, timezone
+
+from cli_catalog import connect, refresh_catalog
+from cli_http import get_session, auth_headers, echo_request_error
+from cli_qudi_commands import run_calibration
+from cli_cache import TERMINAL_STATUSES
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+VERIFY_SERVER_CERT = config.get("security", {}).get("verify_server_cert", True)
+
+# A finished calibration is reused for this long unless the expected drift exceeds the tolerance
+CALIBRATION_MAX_AGE = config.get("calibration", {}).get("max_age_minutes", 60)
+# Largest relative change of any calibration parameter, extrapolated from its drift rate, that is still accepted
+CALIBRATION_DRIFT_TOLERANCE = config.get("calibration", {}).get("drift_tolerance", 1e-4)
+# How many recent tasks are searched for the last calibration run
+RECENT_TASKS_LIMIT = 100
+
+# Points before a value that define the "normal" range a change point is judged against
+DEFAULT_WINDOW = 5
+# Deviation from the rolling median, in robust standard deviations, that counts as a change point
+DEFAULT_THRESHOLD = 5.0
+
+SECONDS_PER_DAY = 86400.0
+
+def load_series(qubits=(), parameters=(), since=None, until=None, refresh=True):
+    """Return {(qubit, parameter): (timestamps, epoch seconds, values)} from the catalog, oldest first"""
+    connection = connect()
+    try:
+        if refresh:
+            refresh_catalog(connection)
+        where = []
+        args = []
+        if qubits:
+            where.append(f"q.qubit IN ({', '.join('?' * len(qubits))})")
+            args.extend(qubits)
+        if parameters:
+            where.append(f"q.parameter IN ({', '.join('?' * len(parameters))})")
+            args.extend(parameters)
+        # The same task may be stored under results/ and batch_results/; count it once
+        sql = """
+            SELECT * FROM (
+                SELECT c.qubit, c.parameter, COALESCE(MIN(e.timestamp), c.timestamp) AS timestamp, c.value
+                FROM calibrations c
+                LEFT JOIN experiments e ON e.task_id = c.task_id
+                GROUP BY COALESCE(c.task_id, c.path), c.qubit, c.parameter
+            ) q
+        """
+        if since:
+            where.append("q.timestamp >= ?")
+            args.append(since)
+        if until:
+            where.append("q.timestamp < ?")
+            args.append(until)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY q.qubit, q.parameter, q.timestamp"
+
+        series = {}
+        for qubit, parameter, timestamp, value in connection.execute(sql, args):
+            series.setdefault((qubit, parameter), []).append((timestamp, value))
+    finally:
+        connection.close()
+
+    result = {}
+    for key, points in series.items():
+        timestamps = [timestamp for timestamp, _ in points]
+        seconds = np.array([time.mktime(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%S")) for timestamp in timestamps])
+        result[key] = (timestamps, seconds, np.array([value for _, value in points]))
+    return result
+
+def drift_rate(seconds, values):
+    """Least-squares slope in units per day, or NaN with fewer than two distinct times"""
+    if len(values) < 2 or np.ptp(seconds) == 0:
+        return float("nan")
+    days = (seconds - seconds[0]) / SECONDS_PER_DAY
+    return float(np.polyfit(days, values, 1)[0])
+
+def change_points(values, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """Flag values deviating from the median of the preceding window by more than threshold robust sigmas"""
+    flags = np.zeros(len(values), dtype=bool)
+    if len(values) <= window:
+        return flags
+    previous = np.lib.stride_tricks.sliding_window_view(values[:-1], window)
+    median = np.median(previous, axis=1)
+    sigma = 1.4826 * np.median(np.abs(previous - median[:, None]), axis=1)
+    # A perfectly stable window would flag any noise at all, so allow a relative floor
+    sigma = np.maximum(sigma, 1e-9 * np.abs(median))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        flags[window:] = np.abs(values[window:] - median) > threshold * sigma
+    return flags
+
+def calibration_history(qubits=(), parameters=(), since=None, until=None, window=DEFAULT_WINDOW,
+                        threshold=DEFAULT_THRESHOLD, show_series=False, output_format="table", refresh=True):
+    """Print the calibration time series with drift rates and change points"""
+    series = load_series(qubits, parameters, since, until, refresh)
+    if not series:
+        click.echo("No calibration results found. Download two-qubit results first.")
+        return None
+
+    report = []
+    for (qubit, parameter), (timestamps, seconds, values) in series.items():
+        flags = change_points(values, window, threshold)
+        report.append({
+            "qubit": qubit,
+            "parameter": parameter,
+            "count": len(values),
+            "first": timestamps[0],
+            "last": timestamps[-1],
+            "latest": float(values[-1]),
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "drift_per_day": drift_rate(seconds, values),
+            "change_points": [timestamps[i] for i in np.flatnonzero(flags)],
+            "series": [{"timestamp": t, "value": float(v), "change_point": bool(f)}
+                       for t, v, f in zip(timestamps, values, flags)],
+        })
+
+    if output_format == "json":
+        if not show_series:
+            for entry in report:
+                del entry["series"]
+        click.echo(json.dumps(report, indent=2))
+        return report
+
+    click.echo(f"{'Qubit':<6} {'Parameter':<22} {'N':>5} {'Latest':>14} {'Std':>11} {'Drift/day':>11} {'Changes':>8}  {'Last':<20}")
+    click.echo("-" * 110)
+    for entry in report:
+        click.echo(f"{'qb' + str(entry['qubit']):<6} {entry['parameter']:<22} {entry['count']:>5} {entry['latest']:>14.6g} "
+                   f"{entry['std']:>11.4g} {entry['drift_per_day']:>11.4g} {len(entry['change_points']):>8}  {entry['last']:<20}")
+        if show_series:
+            for point in entry["series"]:
+                marker = "  <- change point" if point["change_point"] else ""
+                click.echo(f"{'':<8}{point['timestamp']:<20} {point['value']:>16.8g}{marker}")
+    return report
+
+# ----------------- CALIBRATION REUSE ------------------------------------------------------------
+
+def _parse_time(value):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def latest_calibration_task(token):
+    """Return the most recent calibration task that succeeded or is still queued/running, or None"""
+    session = get_session()
+    response = session.get(
+        f"{config['server']['url']}/api/tasks",
+        headers=auth_headers(token),
+        params={"limit": RECENT_TASKS_LIMIT},
+        verify=VERIFY_SERVER_CERT
+    )
+    response.raise_for_status()
+    candidates = [
+        task for task in response.json().get('tasks', [])
+        if task.get('task_type') == 'run_calibration'
+        and (task.get('status') == 'SUCCESS' or task.get('status') not in TERMINAL_STATUSES)
+        and _parse_time(task.get('submitted_at')) is not None
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda task: _parse_time(task['submitted_at']))
+
+def calibration_age(task):
+    """Seconds since the calibration task finished"""
+    finished = _parse_time(task['submitted_at']).timestamp()
+    try:
+        finished += float(task.get('duration') or 0)
+    except ValueError:
+        pass
+    return max(0.0, time.time() - finished)
+
+def calibration_values(token, task_id):
+    """Return {(qubit, parameter): value} from the result of a calibration task"""
+    session = get_session()
+    response = session.get(
+        f"{config['server']['url']}/api/tasks/{task_id}",
+        headers=auth_headers(token),
+        verify=VERIFY_SERVER_CERT
+    )
+    response.raise_for_status()
+    result = response.json().get('result') or {}
+    values = {}
+    for qubit in (1, 2):
+        calibration = result.get(f"qb{qubit}_calibration_results") if isinstance(result, dict) else None
+        for parameter, value in (calibration or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[(qubit, parameter)] = float(value)
+    return values
+
+def expected_drift(values, age_seconds):
+    """Relative change of each calibration parameter since it was measured, from the historic drift rates"""
+    drifts = {}
+    if not values:
+        return drifts
+    series = load_series(parameters=sorted({parameter for _, parameter in values}))
+    for key, value in values.items():
+        if key not in series or not value:
+            continue
+        _, seconds, history = series[key]
+        rate = drift_rate(seconds, history)
+        if np.isfinite(rate):
+            drifts[key] = abs(rate) * age_seconds / SECONDS_PER_DAY / abs(value)
+    return drifts
+
+def check_calibration(token, max_age=CALIBRATION_MAX_AGE, tolerance=CALIBRATION_DRIFT_TOLERANCE):
+    """Return (task, reason) for a reusable calibration, or (None, reason) if a new run is needed"""
+    task = latest_calibration_task(token)
+    if task is None:
+        return None, "no recent calibration found"
+    if task.get('status') != 'SUCCESS':
+        return task, f"it is still {task.get('status')}"
+
+    age = calibration_age(task)
+    if age >= max_age * 60:
+        return None, f"last calibration finished {age / 60:.0f} min ago (max age {max_age:g} min)"
+    drifts = expected_drift(calibration_values(token, task['task_id']), age)
+    if drifts:
+        (qubit, parameter), drift = max(drifts.items(), key=lambda item: item[1])
+        if drift > tolerance:
+            return None, f"qb{qubit} {parameter} expected to have drifted by {drift:.2g} (tolerance {tolerance:.2g})"
+    return task, f"finished {age / 60:.0f} min ago (max age {max_age:g} min), expected drift within tolerance"
+
+def run_calibration_if_stale(token, force=False, max_age=CALIBRATION_MAX_AGE, tolerance=CALIBRATION_DRIFT_TOLERANCE):
+    """Queue a calibration run unless a recent one is still valid"""
+    if not force:
+        try:
+            task, reason = check_calibration(token, max_age, tolerance)
+        except requests.exceptions.RequestException as e:
+            click.echo("Could not check for a recent calibration, queuing a new run:")
+            echo_request_error(e, indent="  ")
+            task, reason = None, None
+        if task is not None:
+            click.echo(f"Reusing calibration {task['task_id']}: {reason}")
+            click.echo("Use 'guest calibrate --force' to queue a new calibration run anyway.")
+            return task['task_id']
+        if reason:
+            click.echo(f"Queuing a new calibration run: {reason}")
+    run_calibration(token)
+    return None
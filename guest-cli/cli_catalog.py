@@ -0,0 +1,352 @@
+import json
+import os
+import re
+import sqlite3
+import time
+import click
+
+from cli_store import task_from_filename
+from cli_result_io import read_result_fields
+from cli_table import render_table
+from cli_ledger import LEDGER_SUFFIX, is_ledger, load_ledger
+from cli_archive import ARCHIVE_SUFFIX, load_archive_index
+from cli_batch_index import load_batch_index
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+
+CATALOG_PATH = config["paths"].get("catalog_path", "catalog.sqlite")
+EXPERIMENT_INFO_DIR = "experiment_infos"
+RESULT_DIRS = ("results", "batch_results")
+# Data from 'guest synth' is marked "synthetic" and kept out of queries and calibration history unless enabled
+INCLUDE_SYNTHETIC = config.get("catalog", {}).get("include_synthetic", False)
+
+# Columns that can be filtered on directly; everything else is looked up in the JSON fields
+COLUMNS = ("path", "task_id", "task_type", "experiment", "timestamp")
+
+# 2025-09-01T09-35-28 as used for experiment info files and batch_results folders
+_TIMESTAMP = re.compile(r"(\d{4}-\d{2}-\d{2})T(\d{2})-(\d{2})-(\d{2})")
+
+# FIELD OP VALUE, e.g. initState=01, sweeps>=100000, qb1_calibration_results.odmr_res_freq<1.463e9
+_FILTER = re.compile(r"^\s*([\w.]+)\s*(!=|>=|<=|=|>|<)\s*(.*?)\s*$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS experiments (
+    task_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    experiment TEXT NOT NULL,
+    timestamp TEXT,
+    params TEXT NOT NULL,
+    PRIMARY KEY (task_id, source)
+);
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT PRIMARY KEY,
+    task_id TEXT,
+    task_type TEXT,
+    timestamp TEXT,
+    fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calibrations (
+    path TEXT NOT NULL,
+    task_id TEXT,
+    timestamp TEXT,
+    qubit INTEGER NOT NULL,
+    parameter TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (path, qubit, parameter)
+);
+CREATE INDEX IF NOT EXISTS results_task_id ON results (task_id);
+CREATE INDEX IF NOT EXISTS experiments_source ON experiments (source);
+CREATE INDEX IF NOT EXISTS calibrations_series ON calibrations (qubit, parameter, timestamp);
+"""
+
+# Bumped whenever a table is added that has to be filled from already indexed results
+SCHEMA_VERSION = 1
+
+# qb1_calibration_results, qb2_calibration_results
+_CALIBRATION_KEY = re.compile(r"^qb(\d+)_calibration_results$")
+
+def _timestamp_from_name(name):
+    match = _TIMESTAMP.search(name)
+    if not match:
+        return None
+    date, hours, minutes, seconds = match.groups()
+    return f"{date}T{hours}:{minutes}:{seconds}"
+
+def connect(path=CATALOG_PATH):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        _backfill_calibrations(connection)
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+    return connection
+
+def _backfill_calibrations(connection):
+    """Fill the calibrations table from results indexed before it existed, without touching the files"""
+    rows = connection.execute("SELECT path, task_id, timestamp, fields FROM results").fetchall()
+    for path, task_id, timestamp, fields in rows:
+        _index_calibrations(connection, path, task_id, timestamp, json.loads(fields))
+
+def _index_calibrations(connection, path, task_id, timestamp, fields):
+    connection.execute("DELETE FROM calibrations WHERE path = ?", (path,))
+    values = []
+    for key, calibration in fields.items():
+        match = _CALIBRATION_KEY.match(key)
+        if not match or not isinstance(calibration, dict):
+            continue
+        for parameter, value in calibration.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values.append((path, task_id, timestamp, int(match.group(1)), parameter, float(value)))
+    connection.executemany(
+        "INSERT OR REPLACE INTO calibrations (path, task_id, timestamp, qubit, parameter, value) VALUES (?, ?, ?, ?, ?, ?)",
+        values
+    )
+
+def _scan(roots):
+    """Yield (path, mtime, size, task_id) of all JSON files, experiment ledgers and result archives below the given roots.
+
+    Batch directories with an index are listed from it instead of being
+    walked; task_id is the one from the index, else None.
+    """
+    stack = [root for root in roots if os.path.isdir(root)]
+    while stack:
+        directory = stack.pop()
+        indexed = load_batch_index(directory)
+        if indexed is not None:
+            for task_id, entry in indexed.items():
+                yield entry["path"], entry["mtime"], entry["size"], task_id
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.name.endswith((".json", LEDGER_SUFFIX, ARCHIVE_SUFFIX)):
+                    st = entry.stat()
+                    yield entry.path, st.st_mtime, st.st_size, None
+
+def _batch_name(path):
+    """batch_results/<timestamp> directory name of a result path, at any depth below it"""
+    parts = path.split(os.sep)
+    if "batch_results" in parts[:-2]:
+        return parts[parts.index("batch_results") + 1]
+    return os.path.basename(os.path.dirname(path))
+
+def _index_experiment_info(connection, path):
+    if is_ledger(path):
+        data = load_ledger(path).task_infos
+    else:
+        with open(path, "r") as f:
+            data = json.load(f)
+    name = os.path.basename(path)
+    timestamp = _timestamp_from_name(name)
+    connection.execute("DELETE FROM experiments WHERE source = ?", (path,))
+    connection.executemany(
+        "INSERT OR REPLACE INTO experiments (task_id, source, experiment, timestamp, params) VALUES (?, ?, ?, ?, ?)",
+        [(task_id, path, name, timestamp, json.dumps(params)) for task_id, params in data.items()
+         if isinstance(params, dict) and (INCLUDE_SYNTHETIC or not params.get("synthetic"))]
+    )
+
+def _index_result(connection, path, mtime, timestamp=None, task_id=None):
+    # Large arrays are skipped rather than decoded, only their lengths are kept
+    fields = read_result_fields(path)
+    if fields.get("synthetic") and not INCLUDE_SYNTHETIC:
+        connection.execute("DELETE FROM results WHERE path = ?", (path,))
+        connection.execute("DELETE FROM calibrations WHERE path = ?", (path,))
+        return
+    name_task_id, task_type = task_from_filename(path)
+    task_id = task_id or name_task_id
+    # batch_results/<timestamp>/ carries the submission time, results/ only the file time
+    timestamp = timestamp or _timestamp_from_name(_batch_name(path))
+    if timestamp is None:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(mtime))
+    connection.execute(
+        "INSERT OR REPLACE INTO results (path, task_id, task_type, timestamp, fields) VALUES (?, ?, ?, ?, ?)",
+        (path, task_id, task_type, timestamp, json.dumps(fields))
+    )
+    _index_calibrations(connection, path, task_id, timestamp, fields)
+
+def _forget_archive(connection, path):
+    members = path + "/%"
+    connection.execute("DELETE FROM results WHERE path LIKE ?", (members,))
+    connection.execute("DELETE FROM calibrations WHERE path LIKE ?", (members,))
+
+def _index_archive(connection, path):
+    """Index the result files inside an archive under <archive>/<member> paths"""
+    _forget_archive(connection, path)
+    loose = os.path.dirname(path) == "results"
+    for member, entry in load_archive_index(path).items():
+        if not member.endswith(".json"):
+            continue
+        member_path = f"{path}/{member}"
+        mtime = entry.get("mtime", 0)
+        # Files from results/ keep their own time rather than the archive's name
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(mtime)) if loose else None
+        try:
+            _index_result(connection, member_path, mtime, timestamp)
+        except (OSError, ValueError) as e:
+            click.echo(f"Skipping {member_path}: {e}", err=True)
+
+def refresh_catalog(connection):
+    """Index new and modified files only; returns (indexed, removed)"""
+    known = {path: (mtime, size) for path, mtime, size in connection.execute("SELECT path, mtime, size FROM files")}
+    seen = set()
+    indexed = 0
+
+    for path, mtime, size, task_id in _scan((EXPERIMENT_INFO_DIR,) + RESULT_DIRS):
+        seen.add(path)
+        if known.get(path) == (mtime, size):
+            continue
+        try:
+            if path.startswith(EXPERIMENT_INFO_DIR + os.sep):
+                _index_experiment_info(connection, path)
+            elif path.endswith(ARCHIVE_SUFFIX):
+                _index_archive(connection, path)
+            else:
+                _index_result(connection, path, mtime, task_id=task_id)
+        except (OSError, ValueError) as e:
+            click.echo(f"Skipping {path}: {e}", err=True)
+        connection.execute("INSERT OR REPLACE INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, mtime, size))
+        indexed += 1
+
+    removed = [path for path in known if path not in seen]
+    for path in removed:
+        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        connection.execute("DELETE FROM results WHERE path = ?", (path,))
+        connection.execute("DELETE FROM calibrations WHERE path = ?", (path,))
+        connection.execute("DELETE FROM experiments WHERE source = ?", (path,))
+        if path.endswith(ARCHIVE_SUFFIX):
+            _forget_archive(connection, path)
+    connection.commit()
+    return indexed, len(removed)
+
+def _parse_value(raw):
+    """Return the candidate SQL values a filter value may match (numbers also match their text form)"""
+    if raw.lower() in ("true", "false"):
+        return [1 if raw.lower() == "true" else 0]
+    candidates = [raw]
+    try:
+        candidates.append(int(raw))
+    except ValueError:
+        try:
+            candidates.append(float(raw))
+        except ValueError:
+            pass
+    return candidates
+
+def _field_sql(field):
+    if field in COLUMNS:
+        return f"q.{field}"
+    path = "$." + field
+    return f"COALESCE(json_extract(q.fields, '{path}'), json_extract(q.params, '{path}'))"
+
+def build_query(filters=(), since=None, until=None, limit=None):
+    """Translate FIELD OP VALUE filters into SQL over results joined with experiment parameters"""
+    where = []
+    args = []
+    for expression in filters:
+        match = _FILTER.match(expression)
+        if not match:
+            raise click.BadParameter(f"Cannot parse filter '{expression}', expected FIELD=VALUE, FIELD>VALUE, ...")
+        field, op, raw = match.groups()
+        column = _field_sql(field)
+        values = _parse_value(raw)
+        if op in ("=", "!="):
+            clause = " OR ".join(f"{column} = ?" for _ in values)
+            where.append(f"({clause})" if op == "=" else f"NOT ({clause})")
+            args.extend(values)
+        else:
+            # Order comparisons only make sense for the numeric form, if there is one
+            where.append(f"{column} {op} ?")
+            args.append(values[-1])
+    if since:
+        where.append("q.timestamp >= ?")
+        args.append(since)
+    if until:
+        where.append("q.timestamp < ?")
+        args.append(until)
+
+    sql = """
+        SELECT * FROM (
+            SELECT r.path, r.task_id,
+                   r.task_type,
+                   e.experiment,
+                   COALESCE(e.timestamp, r.timestamp) AS timestamp,
+                   r.fields,
+                   COALESCE(e.params, '{}') AS params
+            FROM results r
+            LEFT JOIN experiments e ON e.task_id = r.task_id
+            GROUP BY r.path
+        ) q
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY q.timestamp, q.path"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql, args
+
+def query_catalog(filters=(), since=None, until=None, limit=None, refresh=True):
+    """Return matching results as flat dicts (metadata, experiment parameters and result fields)"""
+    connection = connect()
+    try:
+        if refresh:
+            refresh_catalog(connection)
+        sql, args = build_query(filters, since, until, limit)
+        rows = []
+        for path, task_id, task_type, experiment, timestamp, fields, params in connection.execute(sql, args):
+            row = {"path": path, "task_id": task_id, "task_type": task_type,
+                   "experiment": experiment, "timestamp": timestamp}
+            row.update(json.loads(params))
+            row.update(json.loads(fields))
+            rows.append(row)
+        return rows
+    finally:
+        connection.close()
+
+def query_paths(filters=(), since=None, until=None, limit=None, refresh=True):
+    return [row["path"] for row in query_catalog(filters, since, until, limit, refresh)]
+
+def query_dataframe(filters=(), since=None, until=None, limit=None, refresh=True):
+    """Return matching results as a pandas DataFrame with nested fields flattened to dotted columns"""
+    import pandas as pd
+    return pd.json_normalize(query_catalog(filters, since, until, limit, refresh))
+
+def index_results():
+    connection = connect()
+    try:
+        indexed, removed = refresh_catalog(connection)
+        total = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    finally:
+        connection.close()
+    click.echo(f"Indexed {indexed} new or changed file(s), removed {removed}; {total} result(s) in catalog")
+
+def print_query(filters, since, until, limit, output_format, refresh=True):
+    rows = query_catalog(filters, since, until, limit, refresh)
+    if output_format == "paths":
+        click.echo("\n".join(row["path"] for row in rows))
+    elif output_format == "json":
+        click.echo(json.dumps(rows, indent=2))
+    else:
+        render_table(
+            [('Timestamp', 20, '<'), ('Task ID', 38, '<'), ('initState', 9, '<'), ('Sweeps', 8, '>'),
+             ('Path', None, '<')],
+            [
+                [row['timestamp'] or '' for row in rows],
+                [row['task_id'] or '' for row in rows],
+                [str(row.get('initState', '')) for row in rows],
+                [str(row.get('sweeps', '')) for row in rows],
+                [row['path'] for row in rows],
+            ],
+            rule_width=120, rule_above=False
+        )
+        click.echo(f"\n{len(rows)} result(s)")
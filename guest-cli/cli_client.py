@@ -0,0 +1,381 @@
+import asyncio
+import io
+import json
+import os
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+from cli_http import SERVER_URL, VERIFY_SERVER_CERT, get_session, auth_headers, cache_enabled
+from cli_cache import TERMINAL_STATUSES
+from cli_store import put_chunks, record_task, lookup_task, link_object, object_path
+from cli_result_io import BINARY_ACCEPT, write_binary_result, write_binary_from_npz, load_result
+from cli_archive import find_archived, open_result
+from cli_authenticate import load_token_json, current_access_token
+from cli_health import (BREAKER_ENABLED, MODULE_STATE_TTL, PROBE_TIMEOUT, QUDI, BackendUnavailable, get_health,
+                        is_backend_failure)
+
+class GuestError(Exception):
+    """Raised by GuestClient for failures that are not HTTP errors, e.g. a missing token"""
+
+def _parse_duration(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+@dataclass
+class Task:
+    """A task as reported by the server"""
+    task_id: str
+    status: str = "UNKNOWN"
+    task_type: Optional[str] = None
+    submitted_at: Optional[str] = None
+    duration: Optional[float] = None
+    user_id: Optional[str] = None
+    user_name: Optional[str] = None
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    failure_type: Optional[str] = None
+    retries: Optional[str] = None
+    progress: Optional[str] = None
+    resubmitted_from: Optional[str] = None
+    message: Optional[str] = None
+    raw: Dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            task_id=data.get('task_id', 'Unknown'),
+            status=data.get('status', 'UNKNOWN'),
+            task_type=data.get('task_type'),
+            submitted_at=data.get('submitted_at'),
+            duration=_parse_duration(data.get('duration')),
+            user_id=data.get('user_id'),
+            user_name=data.get('user_name') or data.get('username'),
+            result=data.get('result'),
+            error=data.get('error'),
+            failure_type=data.get('failure_type'),
+            retries=data.get('retries'),
+            progress=data.get('progress'),
+            resubmitted_from=data.get('resubmitted_from'),
+            message=data.get('message'),
+            raw=data,
+        )
+
+    @cached_property
+    def parameters(self):
+        """The task's keyword arguments; parsed on first access since listings rarely need them"""
+        parameters = self.raw.get('task_kwargs') or {}
+        if isinstance(parameters, str):
+            try:
+                parameters = json.loads(parameters)
+            except json.JSONDecodeError:
+                parameters = {}
+        return parameters if isinstance(parameters, dict) else {}
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATUSES
+
+@dataclass
+class BatchSubmission:
+    """Result of a two-qubit batch submission: task_id -> experiment parameters"""
+    message: str
+    task_infos: Dict[str, Dict]
+
+@dataclass
+class CancelPendingResult:
+    canceled: List[str]
+    skipped: List[Dict]
+
+@dataclass
+class DownloadedResult:
+    """Where a result was saved; path is None if the task has not succeeded"""
+    task_id: str
+    path: Optional[str]
+    reused: bool
+    status: str
+
+# ----------------- RESULT DOWNLOADS -------------------------------------------------------------
+
+def _download_into_store(session, headers, job_id, task_type=None):
+    """Stream a finished job's result file into the object store and return its digest"""
+    download_response = session.get(
+        f"{SERVER_URL}/api/tasks/{job_id}/download",
+        headers=headers,
+        verify=VERIFY_SERVER_CERT,
+        stream=True  # Stream the response for large files
+    )
+    download_response.raise_for_status()
+    digest = put_chunks(download_response.iter_content(chunk_size=65536))
+    record_task(job_id, digest, task_type)
+    return digest
+
+def _download_binary(session, headers, job_id, json_path, output_format):
+    """Download a result as binary arrays, converting JSON on the fly if the server only offers that"""
+    download_response = session.get(
+        f"{SERVER_URL}/api/tasks/{job_id}/download",
+        headers=dict(headers, Accept=BINARY_ACCEPT),
+        verify=VERIFY_SERVER_CERT
+    )
+    download_response.raise_for_status()
+    if download_response.headers.get('Content-Type', '').startswith('application/x-npz'):
+        return write_binary_from_npz(io.BytesIO(download_response.content), json_path, output_format)
+    return write_binary_result(download_response.json(), json_path, output_format)
+
+def _restore_archived(job_id):
+    """Put an archived result back into the object store; returns its store entry or None"""
+    archived = find_archived(job_id)
+    if archived is None:
+        return None
+    if archived.get('sidecar'):
+        # Binary results are stored as plain JSON again
+        data = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                for key, value in load_result(archived['path']).items()}
+        digest = put_chunks([json.dumps(data, indent=2).encode("utf-8")])
+    else:
+        with open_result(archived['path'], 'rb') as f:
+            digest = put_chunks(iter(lambda: f.read(1 << 20), b""))
+    record_task(job_id, digest, archived.get('task_type'))
+    return {"digest": digest, "task_type": archived.get('task_type')}
+
+def save_result(session, headers, job_id, output_path, output_format='json'):
+    """Save a finished job's result; '{task_type}' in output_path is filled in.
+
+    Returns (saved_path, reused, status); saved_path is None if the job has not succeeded.
+    """
+    # Results never change once stored, so a known or archived task costs no request
+    stored = (lookup_task(job_id) or _restore_archived(job_id)) if cache_enabled() else None
+    if stored and (stored.get('task_type') or '{task_type}' not in output_path):
+        task_type = stored.get('task_type')
+    else:
+        # Not stored yet, or stored without its type (e.g. by 'guest dedupe' from a batch directory)
+        # First check if the job is completed
+        status_response = session.get(
+            f"{SERVER_URL}/api/tasks/{job_id}",
+            headers=headers,
+            verify=VERIFY_SERVER_CERT
+        )
+        status_response.raise_for_status()
+        
+        job_status = status_response.json()
+        if job_status.get('status') != 'SUCCESS':
+            return None, False, job_status.get('status')
+        task_type = job_status.get('task_type') or 'unknown'
+        if stored:
+            record_task(job_id, stored['digest'], task_type)
+    
+    output_path = output_path.format(task_type=task_type)
+    if output_format == 'json':
+        digest = stored['digest'] if stored else _download_into_store(session, headers, job_id, task_type)
+        link_object(digest, output_path)
+    elif stored:
+        # Convert the stored JSON locally instead of downloading again
+        with open(object_path(stored['digest']), 'r') as f:
+            output_path = write_binary_result(json.load(f), output_path, output_format)
+    else:
+        output_path = _download_binary(session, headers, job_id, output_path, output_format)
+    return output_path, bool(stored), 'SUCCESS'
+
+# ----------------- CLIENT -----------------------------------------------------------------------
+
+class GuestClient:
+    """Python API to the GUEST backend.
+
+    Methods return Task and other dataclasses instead of printing, and
+    raise requests.exceptions.RequestException on HTTP errors. All clients
+    share the pooled session of cli_http unless one is passed in.
+    """
+
+    def __init__(self, token=None, session=None):
+        if token is None:
+            token_json = load_token_json()
+            if not token_json:
+                raise GuestError("You are not authenticated. Please authenticate using the 'auth' command.")
+            token = token_json["access_token"]
+        self.token = token
+        self.session = session or get_session()
+        self.headers = auth_headers(token)
+
+    def _renew_token(self):
+        """Switch to the stored access token, renewed if due; False if that is the token already in use"""
+        token = current_access_token(self.token)
+        if token == self.token:
+            return False
+        self.token = token
+        self.headers = auth_headers(token)
+        return True
+
+    def _authenticated(self, call):
+        """Run call(), and once more with a renewed token if the server rejects the current one.
+
+        A client can outlive its access token, e.g. while waiting for tasks.
+        """
+        try:
+            return call()
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 401 or not self._renew_token():
+                raise
+        return call()
+
+    def _send(self, method, path, **kwargs):
+        response = self.session.request(method, f"{SERVER_URL}{path}", headers=self.headers,
+                                        verify=VERIFY_SERVER_CERT, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def _request(self, method, path, **kwargs):
+        return self._authenticated(lambda: self._send(method, path, **kwargs))
+
+    def _submitted(self, result):
+        if 'task_id' not in result:
+            raise GuestError(f"Unexpected response: {json.dumps(result)}")
+        return Task.from_json(result)
+
+    # Submission
+
+    def submit_qasm(self, qasm_file_path):
+        """Submit a QASM file for simulation"""
+        with open(qasm_file_path, "rb") as qasm_file:
+            # Read up front, so that a retry with a renewed token sends the file again
+            upload = (os.path.basename(qasm_file_path), qasm_file.read())
+        return self._submitted(self._request("POST", "/api/simulate_qasm", files={"qasm_file": upload}))
+
+    def _require_hardware(self):
+        """Fail fast if QUDI is known to be down: its circuit is open or its module states failed to load
+        less than MODULE_STATE_TTL seconds ago. Nothing is fetched; any other error comes from the submission itself."""
+        if BREAKER_ENABLED:
+            get_health().require(QUDI, MODULE_STATE_TTL)
+
+    def run_rabi(self):
+        self._require_hardware()
+        return self._submitted(self._request("POST", "/api/run_remote_rabi"))
+
+    def run_calibration(self):
+        self._require_hardware()
+        return self._submitted(self._request("POST", "/api/run_calibration"))
+
+    def run_two_qubit_circuit(self):
+        self._require_hardware()
+        return self._submitted(self._request("POST", "/api/run_two_qubit_circuit"))
+
+    def submit_two_qubit_batch(self, experiments, simulate=None, **fields):
+        """Submit a list of two-qubit experiments; returns their task_infos.
+
+        Other top-level fields of the request, if any, are passed as keyword arguments.
+        """
+        payload = dict(fields, experiments=list(experiments))
+        if simulate is not None:
+            payload["simulate"] = simulate
+        return self.submit_two_qubit_document(payload)
+
+    def submit_two_qubit_document(self, document):
+        """Submit the content of a two-qubit experiment file as it is; returns its task_infos"""
+        if not (isinstance(document, dict) and document.get("simulate") is True):
+            self._require_hardware()
+        result = self._request("POST", "/api/submit_two_qubit_batch", json=document)
+        if 'task_infos' not in result:
+            raise GuestError(f"Unexpected response: {json.dumps(result)}")
+        return BatchSubmission(result.get('message', ''), result['task_infos'])
+
+    # Status
+
+    def status(self, task_id):
+        """Current state of a task, including its result once it has succeeded"""
+        return Task.from_json(self._request("GET", f"/api/tasks/{task_id}"))
+
+    def list_tasks(self, limit=30, timeout=None):
+        tasks = self._request("GET", "/api/tasks", params={"limit": limit}, timeout=timeout).get('tasks', [])
+        return [Task.from_json(task) for task in tasks]
+
+    def states(self, task_ids):
+        """Current state of many tasks with one bulk request; unknown tasks are left out"""
+        from cli_experiment import fetch_task_states
+        states = self._authenticated(lambda: fetch_task_states(self.token, list(task_ids)))
+        return {task_id: Task.from_json(task) for task_id, task in states.items()}
+
+    def module_states(self, max_age=None):
+        """States of the QUDI modules; a fetch less than max_age seconds ago is reused, a failed one too"""
+        health = get_health()
+        if max_age:
+            states = health.module_states(max_age)
+            if states is not None:
+                return states
+        try:
+            states = self._request("GET", "/api/get_module_states", timeout=PROBE_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            if is_backend_failure(e) and not isinstance(e, BackendUnavailable):
+                health.record_module_states(error=e)
+            raise
+        health.record_module_states(states)
+        return states
+
+    # Results
+
+    def download(self, task_id, output_path=None, output_format='json'):
+        """Save a finished task's result to output_path (default results/<task_type>_<task_id>.json)"""
+        output_path = output_path or f"results/{{task_type}}_{task_id}.json"
+        path, reused, status = self._authenticated(
+            lambda: save_result(self.session, self.headers, task_id, output_path, output_format))
+        return DownloadedResult(task_id, path, reused, status)
+
+    def result(self, task_id):
+        """Return a finished task's result data, from the object store if it was downloaded before"""
+        stored = (lookup_task(task_id) or _restore_archived(task_id)) if cache_enabled() else None
+        if stored:
+            with open(object_path(stored['digest']), 'r') as f:
+                return json.load(f)
+        task = self.status(task_id)
+        if task.status != 'SUCCESS':
+            raise GuestError(f"Task {task_id} has not succeeded (status: {task.status})")
+        if not cache_enabled():
+            return self._request("GET", f"/api/tasks/{task_id}/download")
+        digest = self._authenticated(lambda: _download_into_store(self.session, self.headers, task_id, task.task_type))
+        with open(object_path(digest), 'r') as f:
+            return json.load(f)
+
+    # Queue management
+
+    def cancel(self, task_id, terminate=False):
+        result = self._request("POST", f"/api/cancel_task/{task_id}",
+                               params={"terminate": "true" if terminate else "false"})
+        result.setdefault('task_id', task_id)
+        return Task.from_json(result)
+
+    def cancel_pending(self):
+        result = self._request("POST", "/api/cancel_pending")
+        return CancelPendingResult(result.get('canceled', []), result.get('skipped', []))
+
+    def resubmit(self, task_id):
+        return self._submitted(self._request("POST", f"/api/resubmit_job/{task_id}"))
+
+def _async_method(name):
+    method = getattr(GuestClient, name)
+
+    async def call(self, *args, **kwargs):
+        return await asyncio.to_thread(method, self.client, *args, **kwargs)
+
+    call.__name__ = name
+    call.__doc__ = method.__doc__
+    return call
+
+class AsyncGuestClient:
+    """asyncio variant of GuestClient.
+
+    Every method is a coroutine that runs the blocking call in a worker
+    thread over the same pooled session, so many calls can be awaited
+    concurrently with asyncio.gather().
+    """
+
+    def __init__(self, token=None, session=None):
+        self.client = GuestClient(token, session)
+
+for _name in ("submit_qasm", "run_rabi", "run_calibration", "run_two_qubit_circuit",
+              "submit_two_qubit_batch", "submit_two_qubit_document", "status", "list_tasks", "states",
+              "module_states", "download", "result", "cancel", "cancel_pending", "resubmit"):
+    setattr(AsyncGuestClient, _name, _async_method(_name))
+del _name
@@ -0,0 +1,298 @@
+import json
+import queue
+import threading
+import time
+import click
+import requests
+import urllib3
+
+from cli_http import config, SERVER_URL, get_session, auth_headers
+from cli_authenticate import current_access_token
+from cli_cache import TERMINAL_STATUSES
+from cli_experiment import fetch_task_states, load_experiment_info, resolve_experiment_info_path, summarize_states
+from cli_ledger import record_status_changes
+
+EVENTS_CONFIG = config.get("events", {})
+# Server-sent event stream of the user's task status changes
+EVENTS_PATH = EVENTS_CONFIG.get("path", "/api/tasks/events")
+# The server sends heartbeats more often than this; a silent stream is reconnected
+EVENTS_READ_TIMEOUT = EVENTS_CONFIG.get("read_timeout_seconds", 30)
+# Adaptive polling when no stream is available: start fast, back off while nothing changes
+MIN_POLL_INTERVAL = EVENTS_CONFIG.get("min_poll_interval", 0.5)
+MAX_POLL_INTERVAL = EVENTS_CONFIG.get("max_poll_interval", 10.0)
+POLL_BACKOFF = 1.5
+
+# Responses meaning the server has no event stream at all
+_NO_STREAM_STATUS = {404, 405, 406, 501}
+
+class StreamUnavailable(Exception):
+    pass
+
+def _unauthorized(error):
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code == 401
+
+def parse_sse(lines):
+    """Yield (event, data, id) for each server-sent event in an iterator of text lines"""
+    event, data, event_id = "", [], None
+    for line in lines:
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event or "message", "\n".join(data), event_id
+            event, data = "", []
+            continue
+        if line.startswith(":"):
+            # Comment, used for heartbeats
+            continue
+        field, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+        elif field == "id":
+            event_id = value
+
+def _read_lines(raw):
+    """Yield text lines of a streamed response as soon as each one arrives.
+
+    Response.iter_lines() waits for full read chunks, which would hold
+    events back until enough later events arrive.
+    """
+    buffer = b""
+    while True:
+        try:
+            if hasattr(raw, "read1"):
+                data = raw.read1(65536, decode_content=True)
+            else:
+                data = raw.read(1, decode_content=True)
+        except urllib3.exceptions.ReadTimeoutError as e:
+            # Raised as the requests exceptions callers handle, as iter_content does
+            raise requests.exceptions.ReadTimeout(e)
+        except (urllib3.exceptions.HTTPError, OSError) as e:
+            raise requests.exceptions.ConnectionError(e)
+        if not data:
+            break
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
+
+class TaskEvents:
+    """Status changes of a set of tasks, pushed by the server where possible.
+
+    A background thread subscribes to the server's task event stream and
+    falls back to polling with an adaptive interval when the stream is not
+    available. Updated task dicts are delivered through get() and by
+    iterating; the first update of every task is its current state.
+    """
+
+    def __init__(self, token, task_ids):
+        self.token = token
+        self.waiting = set(task_ids)
+        self.known = {}
+        self.updates = queue.Queue()
+        self.mode = "connecting"
+        self.requests = 0
+        self.last_event_id = None
+        # Why watching stopped before all tasks finished, if it did
+        self.error = None
+        self._stop = threading.Event()
+        self._response = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def finished(self):
+        """True once every task reached a terminal state (or watching failed) and all updates were taken"""
+        return (not self.waiting or not self._thread.is_alive()) and self.updates.empty()
+
+    def get(self, timeout=None):
+        """Return the next updated task dict, or None if there is none within timeout"""
+        try:
+            return self.updates.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while not self.finished:
+            task = self.get(timeout=0.5)
+            if task is not None:
+                yield task
+
+    def _publish(self, task):
+        """Queue a task if its status changed; returns True if it did"""
+        task_id = task.get('task_id')
+        if task_id not in self.waiting:
+            return False
+        status = task.get('status')
+        if self.known.get(task_id) == status:
+            return False
+        self.known[task_id] = status
+        if status in TERMINAL_STATUSES:
+            self.waiting.discard(task_id)
+        self.updates.put(task)
+        return True
+
+    def _renew_token(self):
+        """Pick up the stored access token, renewed if due; returns whether it changed.
+
+        Waits can last longer than the access token does.
+        """
+        token = current_access_token(self.token)
+        changed = token != self.token
+        self.token = token
+        return changed
+
+    def _resync(self):
+        """Fetch the current state of all waiting tasks; returns whether any changed"""
+        self._renew_token()
+        waiting = sorted(self.waiting)
+        states = fetch_task_states(self.token, waiting)
+        self.requests += 1
+        changed = False
+        for task_id in waiting:
+            # Tasks the server does not know are reported once and not waited for
+            task = states.get(task_id, {'task_id': task_id, 'status': 'UNKNOWN'})
+            changed |= self._publish(task)
+            if task['status'] == 'UNKNOWN':
+                self.waiting.discard(task_id)
+        return changed
+
+    def _stream(self):
+        """Follow the event stream until all tasks are done; raises StreamUnavailable or RequestException"""
+        self._renew_token()
+        headers = auth_headers(self.token)
+        headers["Accept"] = "text/event-stream"
+        if self.last_event_id:
+            headers["Last-Event-ID"] = self.last_event_id
+        response = get_session().get(f"{SERVER_URL}{EVENTS_PATH}", headers=headers, stream=True,
+                                     timeout=(10, EVENTS_READ_TIMEOUT))
+        self.requests += 1
+        if response.status_code in _NO_STREAM_STATUS:
+            response.close()
+            raise StreamUnavailable(str(response.status_code))
+        response.raise_for_status()
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            response.close()
+            raise StreamUnavailable(response.headers.get("Content-Type", ""))
+
+        self._response = response
+        self.mode = "stream"
+        try:
+            # Events may have been missed before the subscription started
+            self._resync()
+            for event, data, event_id in parse_sse(_read_lines(response.raw)):
+                if event_id:
+                    self.last_event_id = event_id
+                if event not in ("message", "task", "status"):
+                    continue
+                try:
+                    payload = json.loads(data)
+                except ValueError:
+                    continue
+                for task in payload if isinstance(payload, list) else [payload]:
+                    if isinstance(task, dict):
+                        self._publish(task)
+                if not self.waiting or self._stop.is_set():
+                    return
+        finally:
+            self._response = None
+            response.close()
+
+    def _poll(self):
+        interval = MIN_POLL_INTERVAL
+        self.mode = "polling"
+        while self.waiting and not self._stop.is_set():
+            try:
+                changed = self._resync()
+            except requests.exceptions.RequestException as e:
+                if _unauthorized(e) and not self._renew_token():
+                    self.error = "authentication failed (401), run 'guest auth'"
+                    return
+                changed = False
+            interval = MIN_POLL_INTERVAL if changed else min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+            self._stop.wait(interval)
+
+    def _run(self):
+        backoff = MIN_POLL_INTERVAL
+        while self.waiting and not self._stop.is_set():
+            try:
+                self._stream()
+                # The server closed the stream; reconnect unless everything is done
+                backoff = MIN_POLL_INTERVAL
+                if self.waiting:
+                    self._stop.wait(backoff)
+            except StreamUnavailable:
+                self._poll()
+                return
+            except requests.exceptions.RequestException as e:
+                if self._stop.is_set():
+                    return
+                if _unauthorized(e) and not self._renew_token():
+                    # Reconnecting with a token the server rejects would never succeed
+                    self.error = "authentication failed (401), run 'guest auth'"
+                    return
+                # Dropped or silent stream: reconnect, catching up through the resync
+                self.mode = "reconnecting"
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_POLL_INTERVAL)
+            except Exception:
+                # An unusable stream must not end the watch, which would look like all tasks finished
+                self._poll()
+                return
+
+def wait_for_tasks(token, task_ids, quiet=False):
+    """Block until all tasks are finished, printing each status change; returns their last states"""
+    states = {}
+    try:
+        with TaskEvents(token, task_ids) as events:
+            for task in events:
+                states[task['task_id']] = task
+                if not quiet:
+                    click.echo(f"{time.strftime('%H:%M:%S')}  {task['task_id']:<38} {task.get('status', 'UNKNOWN')}")
+    except KeyboardInterrupt:
+        click.echo("\nStopped waiting")
+    if events.error:
+        click.echo(f"Stopped waiting: {events.error}")
+    if not quiet:
+        click.echo(f"Status updates: {events.mode}, {events.requests} request(s)")
+    return states
+
+def wait_for_experiment(token, experiment_info):
+    try:
+        experiment_data = load_experiment_info(experiment_info)
+    except FileNotFoundError as e:
+        click.echo(f"Experiment info file not found: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in experiment info file: {str(e)}")
+        return None
+
+    task_ids = list(experiment_data)
+    started = time.time()
+    states = wait_for_tasks(token, task_ids)
+    record_status_changes(resolve_experiment_info_path(experiment_info), states)
+    counts = summarize_states(task_ids, states)
+    click.echo(f"\n{len(task_ids)} task(s) after {time.time() - started:.1f}s: "
+               + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())))
+    return states
@@ -0,0 +1,231 @@
+import json
+import os
+import click
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cli_http import config, SERVER_URL, POOL_SIZE, get_session, auth_headers, echo_request_error
+from cli_cache import TERMINAL_STATUSES
+from cli_ledger import is_ledger, load_ledger, record_status_changes, record_events
+from cli_ratelimit import limiter_stats
+
+# Minimum number of recent tasks requested in the single bulk status fetch
+BULK_STATUS_LIMIT = config.get("experiment", {}).get("bulk_status_limit", 500)
+
+def resolve_experiment_info_path(experiment_info):
+    """Accept either a path or a file name inside ./experiment_infos"""
+    if os.path.exists(experiment_info):
+        return experiment_info
+    return os.path.join("./experiment_infos", experiment_info)
+
+def load_experiment_info(experiment_info):
+    """Return {task_id: parameters}, from the compacted ledger or a plain experiment info snapshot"""
+    path = resolve_experiment_info_path(experiment_info)
+    if is_ledger(path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        return load_ledger(path).task_infos
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def fetch_task_states(token, task_ids):
+    """Fetch the states of the given tasks with one bulk request to /api/tasks.
+
+    Tasks that are too old to appear in the bulk listing are looked up
+    individually, concurrently over the shared session.
+    """
+    session = get_session()
+    headers = auth_headers(token)
+    wanted = set(task_ids)
+
+    response = session.get(
+        f"{SERVER_URL}/api/tasks",
+        headers=headers,
+        params={"limit": max(len(task_ids), BULK_STATUS_LIMIT)}
+    )
+    response.raise_for_status()
+    states = {
+        task['task_id']: task
+        for task in response.json().get('tasks', [])
+        if task.get('task_id') in wanted
+    }
+
+    missing = [task_id for task_id in task_ids if task_id not in states]
+    if missing:
+        def fetch_one(task_id):
+            single = session.get(f"{SERVER_URL}/api/tasks/{task_id}", headers=headers)
+            if single.status_code == 404:
+                # Unknown to the server, reported as UNKNOWN by the callers
+                return None
+            single.raise_for_status()
+            return single.json()
+
+        with ThreadPoolExecutor(max_workers=POOL_SIZE) as pool:
+            for task_id, task in zip(missing, pool.map(fetch_one, missing)):
+                if task is not None:
+                    states[task_id] = task
+    return states
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    elif seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {(seconds % 3600) // 60}m"
+
+def summarize_states(task_ids, states):
+    """Count tasks per status, treating tasks the server does not know as UNKNOWN"""
+    counts = {}
+    for task_id in task_ids:
+        status = states.get(task_id, {}).get('status', 'UNKNOWN')
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+def estimate_progress(task_ids, states):
+    """Return (done, total, eta_seconds) with the ETA based on observed task durations"""
+    durations = []
+    for task in states.values():
+        if task.get('status') == 'SUCCESS' and task.get('duration'):
+            try:
+                durations.append(float(task['duration']))
+            except (ValueError, TypeError):
+                pass
+
+    done = sum(1 for task_id in task_ids if states.get(task_id, {}).get('status') in TERMINAL_STATUSES)
+    remaining = len(task_ids) - done
+    eta = None
+    if durations:
+        # The backend runs one task at a time, so remaining work adds up
+        eta = remaining * sum(durations) / len(durations)
+    return done, len(task_ids), eta
+
+def experiment_status(token, experiment_info):
+    """Show the aggregated status of all tasks of an experiment info file"""
+    try:
+        experiment_data = load_experiment_info(experiment_info)
+        task_ids = list(experiment_data.keys())
+        states = fetch_task_states(token, task_ids)
+    except FileNotFoundError as e:
+        click.echo(f"Experiment info file not found: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in experiment info file: {str(e)}")
+        return None
+    except requests.exceptions.RequestException as e:
+        echo_request_error(e)
+        return None
+
+    path = resolve_experiment_info_path(experiment_info)
+    record_status_changes(path, states)
+
+    counts = summarize_states(task_ids, states)
+    click.echo(f"\nExperiment: {experiment_info} ({len(task_ids)} tasks)")
+    click.echo("-" * 30)
+    for status, count in sorted(counts.items(), key=lambda item: -item[1]):
+        click.echo(f"{status:<12} {count:>6}")
+    click.echo("-" * 30)
+    if is_ledger(path):
+        view = load_ledger(path)
+        resubmitted = sum(1 for state in view.tasks.values() if "resubmitted_as" in state)
+        click.echo(f"{'Downloaded':<12} {len(view.downloads()):>6}")
+        if resubmitted:
+            click.echo(f"{'Resubmitted':<12} {resubmitted:>6}")
+
+    failed = [task_id for task_id in task_ids if states.get(task_id, {}).get('status') == 'FAILURE']
+    if failed:
+        click.echo(f"\nFailed tasks:")
+        for task_id in failed[:10]:
+            click.echo(f"  {task_id} ({states[task_id].get('failure_type', 'UNKNOWN')})")
+        if len(failed) > 10:
+            click.echo(f"  ... and {len(failed) - 10} more")
+    return counts
+
+def experiment_progress(token, experiment_info):
+    """Show the completion percentage and ETA of an experiment"""
+    try:
+        task_ids = list(load_experiment_info(experiment_info).keys())
+        states = fetch_task_states(token, task_ids)
+    except FileNotFoundError as e:
+        click.echo(f"Experiment info file not found: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in experiment info file: {str(e)}")
+        return None
+    except requests.exceptions.RequestException as e:
+        echo_request_error(e)
+        return None
+
+    record_status_changes(resolve_experiment_info_path(experiment_info), states)
+    done, total, eta = estimate_progress(task_ids, states)
+    percent = 100.0 * done / total if total else 100.0
+    bar_width = 40
+    filled = int(bar_width * percent / 100)
+    click.echo(f"[{'#' * filled}{'.' * (bar_width - filled)}] {percent:5.1f}% ({done}/{total} finished)")
+    if done == total:
+        click.echo("All tasks finished")
+    elif eta is not None:
+        click.echo(f"Estimated time remaining: {_format_duration(eta)}")
+    else:
+        click.echo("Estimated time remaining: unknown (no task has finished yet)")
+    return done, total, eta
+
+def cancel_experiment(token, experiment_info, terminate=False):
+    """Cancel all unfinished tasks of an experiment concurrently"""
+    try:
+        task_ids = list(load_experiment_info(experiment_info).keys())
+        states = fetch_task_states(token, task_ids)
+    except FileNotFoundError as e:
+        click.echo(f"Experiment info file not found: {e}")
+        return 0, 0
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in experiment info file: {str(e)}")
+        return 0, 0
+    except requests.exceptions.RequestException as e:
+        echo_request_error(e)
+        return 0, 0
+
+    to_cancel = [
+        task_id for task_id in task_ids
+        if task_id in states and states[task_id].get('status') not in TERMINAL_STATUSES
+    ]
+    if not to_cancel:
+        click.echo("No unfinished tasks to cancel.")
+        return 0, 0
+
+    session = get_session()
+    headers = auth_headers(token)
+
+    def cancel_one(task_id):
+        response = session.post(
+            f"{SERVER_URL}/api/cancel_task/{task_id}",
+            headers=headers,
+            params={"terminate": "true" if terminate else "false"}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    canceled = 0
+    failed = 0
+    events = []
+    with ThreadPoolExecutor(max_workers=POOL_SIZE) as pool:
+        futures = {pool.submit(cancel_one, task_id): task_id for task_id in to_cancel}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+                canceled += 1
+                events.append(("status", futures[future], {"status": result.get('status', 'REVOKED')}))
+            except requests.exceptions.RequestException as e:
+                click.echo(f"Failed to cancel {futures[future]}: {str(e)}")
+                failed += 1
+
+    path = resolve_experiment_info_path(experiment_info)
+    if is_ledger(path):
+        record_events(path, events)
+    click.echo(f"Canceled {canceled} of {len(to_cancel)} unfinished task(s).")
+    if failed:
+        click.echo(f"Failed:   {failed}")
+    throttle = limiter_stats()
+    if throttle["throttled"]:
+        click.echo(f"Rate limited: {throttle['throttled']} response(s), {throttle['retries']} retried")
+    return canceled, failed
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from cli_authenticate import file_lock
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+
+BREAKER_CONFIG = config.get("circuit_breaker", {})
+BREAKER_ENABLED = BREAKER_CONFIG.get("enabled", True)
+# Consecutive failures or timeouts of a backend after which its circuit opens
+FAILURE_THRESHOLD = BREAKER_CONFIG.get("failure_threshold", 3)
+# An open circuit fails requests at once for this long, then lets a single probe through
+COOLDOWN_SECONDS = BREAKER_CONFIG.get("cooldown_seconds", 30)
+# Hardware submissions fail fast for this long after fetching the module states failed
+MODULE_STATE_TTL = BREAKER_CONFIG.get("module_state_ttl_seconds", 15)
+PROBE_TIMEOUT = 10
+
+# Shared by all guest processes of the user, next to the HTTP cache
+TOKEN_FILE_PATH = config["paths"]["token_file_path"]
+HEALTH_PATH = os.path.join(os.path.dirname(TOKEN_FILE_PATH), "health.json")
+
+# Every request needs the GUEST server; these endpoints also need QUDI and the hardware behind it
+SERVER = "server"
+QUDI = "qudi"
+QUDI_PATHS = re.compile(r"/api/(run_remote_rabi|run_calibration|run_two_qubit_circuit|submit_two_qubit_batch|get_module_states)")
+# Probe of a half-open circuit; the same requests check-availability sends
+PROBES = {SERVER: "/api/tasks?limit=1", QUDI: "/api/get_module_states"}
+# Responses meaning the backend failed rather than the request
+FAILURE_STATUS = {502, 503, 504}
+
+class BackendUnavailable(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a backend that is known to be down"""
+
+def _simulated(request):
+    """Two-qubit batches sent with "simulate": true do not need the hardware"""
+    if not request.body or "json" not in request.headers.get("Content-Type", ""):
+        return False
+    try:
+        return json.loads(request.body).get("simulate") is True
+    except (ValueError, AttributeError):
+        return False
+
+def backends_for(request):
+    path = request.path_url.split("?", 1)[0]
+    if QUDI_PATHS.search(path) and not _simulated(request):
+        return (SERVER, QUDI)
+    return (SERVER,)
+
+def is_backend_failure(error):
+    """Whether a RequestException means the backend is down, as opposed to e.g. a rejected request"""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in FAILURE_STATUS
+
+def _describe_error(error):
+    return f"{type(error).__name__}: {error}"[:300] if isinstance(error, Exception) else str(error)
+
+class HealthState:
+    """Circuit breakers of the backends and the last-known QUDI module states.
+
+    A breaker opens after FAILURE_THRESHOLD consecutive failures and then
+    fails requests without sending them for COOLDOWN_SECONDS. After that
+    it is half-open: one probe is let through while other requests still
+    fail fast, and its outcome closes or reopens the circuit. The state is
+    kept in HEALTH_PATH so that later commands start from what earlier
+    ones learned. Reading it is cached by mtime and takes no file lock;
+    state changes hold one, so concurrent commands do not overwrite each
+    other's. While every circuit is closed, requests only stat the file.
+    """
+
+    def __init__(self, path=HEALTH_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = None
+        self.data = {"breakers": {}, "module_states": {}}
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self.loaded == (st.st_mtime_ns, st.st_size):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.data = {"breakers": data.get("breakers", {}), "module_states": data.get("module_states", {})}
+        self.loaded = (st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock around a read-modify-write of the state, shared by all guest processes"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.lock, file_lock(self.path + ".lock"):
+            self._load()
+            yield
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self.loaded = (st.st_mtime_ns, st.st_size)
+
+    def _breaker(self, backend):
+        return self.data["breakers"].setdefault(backend, {"state": "closed", "failures": 0})
+
+    def _healthy(self, backends):
+        """Whether the backends' circuits are closed with no failures counted, from the cached state"""
+        with self.lock:
+            self._load()
+            breakers = self.data["breakers"]
+            return all(breakers.get(backend, {}).get("state", "closed") == "closed"
+                       and not breakers.get(backend, {}).get("failures") for backend in backends)
+
+    def _refuse(self, backend, breaker, now):
+        """Raise BackendUnavailable if breaker fails requests at the moment"""
+        if breaker["state"] == "open" and now - breaker.get("opened_at", 0) < COOLDOWN_SECONDS:
+            raise BackendUnavailable(f"{backend} unavailable: circuit {self._describe(breaker, now)}")
+        # A probe that never reported back, e.g. of a killed process, is given up after two timeouts
+        if breaker["state"] == "half_open" and now - (breaker.get("probe_started") or 0) < 2 * PROBE_TIMEOUT:
+            raise BackendUnavailable(f"{backend} unavailable: circuit {self._describe(breaker, now)}")
+
+    def allow(self, backend):
+        """Return True if the request is the probe of a half-open circuit, False if the circuit is closed.
+
+        Raises BackendUnavailable while the circuit is open or another probe is in flight. Only
+        claiming the probe takes the file lock.
+        """
+        with self.lock:
+            self._load()
+            breaker = dict(self.data["breakers"].get(backend, {"state": "closed"}))
+        if breaker["state"] == "closed":
+            return False
+        self._refuse(backend, breaker, time.time())
+        with self._locked():
+            breaker = self._breaker(backend)
+            if breaker["state"] == "closed":
+                return False
+            now = time.time()
+            self._refuse(backend, breaker, now)
+            breaker.update(state="half_open", probe_started=now)
+            self._save()
+            return True
+
+    def success(self, backends):
+        if self._healthy(backends):
+            return
+        with self._locked():
+            changed = False
+            for backend in backends:
+                breaker = self._breaker(backend)
+                if breaker["state"] != "closed" or breaker["failures"]:
+                    self.data["breakers"][backend] = {"state": "closed", "failures": 0}
+                    changed = True
+            if changed:
+                self._save()
+
+    def failure(self, backend, error, released=()):
+        """Count a failure of backend; half-open circuits in released get their probe back"""
+        with self._locked():
+            breaker = self._breaker(backend)
+            breaker["failures"] = breaker.get("failures", 0) + 1
+            breaker["last_error"] = _describe_error(error)
+            if breaker["state"] == "half_open" or breaker["failures"] >= FAILURE_THRESHOLD:
+                breaker.update(state="open", opened_at=time.time(), probe_started=None)
+            for other in released:
+                if other != backend and self._breaker(other)["state"] == "half_open":
+                    self._breaker(other)["probe_started"] = None
+            self._save()
+
+    def force_probe(self):
+        """Let the next request to every open backend through as its probe"""
+        with self._locked():
+            changed = False
+            for breaker in self.data["breakers"].values():
+                if breaker["state"] != "closed":
+                    breaker.update(state="half_open", probe_started=None)
+                    changed = True
+            if changed:
+                self._save()
+
+    def _describe(self, breaker, now):
+        if breaker["state"] == "closed":
+            return f"closed, {breaker['failures']} failure(s) in a row" if breaker.get("failures") else "closed"
+        if breaker["state"] == "half_open":
+            text = "half-open, waiting for a probe"
+        else:
+            wait = max(0, COOLDOWN_SECONDS - (now - breaker.get("opened_at", 0)))
+            text = f"open after {breaker['failures']} failure(s), next probe in {wait:.0f}s"
+        if breaker.get("last_error"):
+            text += f" (last error: {breaker['last_error']})"
+        return text
+
+    def describe(self, backend):
+        with self.lock:
+            self._load()
+            return self._describe(self._breaker(backend), time.time())
+
+    def require(self, backend, max_age):
+        """Raise BackendUnavailable if backend is known to be down, without sending anything.
+
+        That is while its circuit is open, or for QUDI also if fetching the
+        module states failed within max_age. Unlike allow() this does not
+        claim the probe of a half-open circuit.
+        """
+        with self.lock:
+            self._load()
+            breaker = dict(self._breaker(backend))
+        if breaker["state"] == "open":
+            self._refuse(backend, breaker, time.time())
+        if backend == QUDI:
+            self.module_states(max_age)
+
+    def module_states(self, max_age):
+        """Module states fetched less than max_age seconds ago, or None.
+
+        Raises BackendUnavailable if fetching them failed within max_age.
+        """
+        with self.lock:
+            self._load()
+            cached = dict(self.data["module_states"])
+        now = time.time()
+        if cached.get("failed_at", 0) > cached.get("fetched_at", 0) and now - cached["failed_at"] < max_age:
+            raise BackendUnavailable(f"{QUDI} unavailable: module states failed {now - cached['failed_at']:.0f}s ago "
+                                     f"({cached['error']})")
+        if "states" in cached and now - cached.get("fetched_at", 0) < max_age:
+            return cached["states"]
+        return None
+
+    def record_module_states(self, states=None, error=None):
+        with self._locked():
+            cached = self.data["module_states"]
+            if error is None:
+                cached.update(states=states, fetched_at=time.time())
+            else:
+                # The last known states are kept alongside the failure
+                cached.update(error=_describe_error(error), failed_at=time.time())
+            self._save()
+
+_health = None
+_health_lock = threading.Lock()
+
+def get_health():
+    global _health
+    with _health_lock:
+        if _health is None:
+            _health = HealthState()
+    return _health
+
+class CircuitBreakerAdapter(HTTPAdapter):
+    """Transport adapter failing requests fast while a backend they need is down.
+
+    Connection errors, timeouts and 502/503/504 responses count as
+    failures of the backend; any other response closes its circuit again.
+    """
+
+    def send(self, request, **kwargs):
+        if not BREAKER_ENABLED:
+            return super().send(request, **kwargs)
+        health = get_health()
+        backends = backends_for(request)
+        for backend in backends:
+            if health.allow(backend) and request.path_url != PROBES[backend]:
+                self._probe(health, backend, request, kwargs)
+
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # A server that does not answer in time may be waiting for QUDI; one that cannot be reached is down
+            culprit = backends[-1] if isinstance(e, requests.exceptions.ReadTimeout) else SERVER
+            health.failure(culprit, e, released=backends)
+            raise
+        if response.status_code in FAILURE_STATUS:
+            health.failure(backends[-1], f"{response.status_code} {response.reason}", released=backends)
+        else:
+            health.success(backends)
+        return response
+
+    def _probe(self, health, backend, request, kwargs):
+        """Send the probe of a half-open backend ahead of the actual request"""
+        headers = {"Authorization": request.headers["Authorization"]} if "Authorization" in request.headers else {}
+        probe = requests.Request("GET", urljoin(request.url, PROBES[backend]), headers=headers).prepare()
+        try:
+            response = super().send(probe, **dict(kwargs, stream=False, timeout=PROBE_TIMEOUT))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            health.failure(backend, e)
+            raise BackendUnavailable(f"{backend} probe failed: {_describe_error(e)}", request=request)
+        response.close()
+        if response.status_code in FAILURE_STATUS:
+            health.failure(backend, f"{response.status_code} {response.reason}")
+            raise BackendUnavailable(f"{backend} probe failed: {response.status_code} {response.reason}",
+                                     request=request)
+        health.success((SERVER, backend))
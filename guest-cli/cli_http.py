@@ -0,0 +1,64 @@
+import json
+import click
+import requests
+
+from cli_cache import CachingAdapter
+from cli_ratelimit import RateLimitedAdapter
+from cli_health import CircuitBreakerAdapter
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+VERIFY_SERVER_CERT = config.get("security", {}).get("verify_server_cert", True)
+SERVER_URL = config['server']['url']
+
+# Number of connections kept alive per host for concurrent bulk operations
+POOL_SIZE = config.get("http", {}).get("pool_size", 16)
+
+# Serve task responses from the on-disk cache, disabled with 'guest --no-cache'
+CACHE_ENABLED = config.get("cache", {}).get("enabled", True)
+
+_session = None
+
+class _GuardedAdapter(CircuitBreakerAdapter, RateLimitedAdapter):
+    """Requests to a backend that is down fail before waiting for the rate limiter"""
+
+class _CachingGuardedAdapter(CachingAdapter, _GuardedAdapter):
+    """Cache hits are answered locally; only requests that reach the server are guarded and rate limited"""
+
+def set_cache_enabled(enabled):
+    global CACHE_ENABLED
+    CACHE_ENABLED = enabled
+
+def cache_enabled():
+    return CACHE_ENABLED
+
+def get_session():
+    """Return the process-wide session sharing one pooled connection per worker"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.verify = VERIFY_SERVER_CERT
+        if CACHE_ENABLED:
+            adapter = _CachingGuardedAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        else:
+            adapter = _GuardedAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"}
+
+def echo_request_error(e, indent=""):
+    """Print a RequestException together with the server's response body, if any"""
+    click.echo(f"{indent}Error: {str(e)}")
+    if hasattr(e, 'response') and e.response is not None:
+        try:
+            error_detail = e.response.json()
+            click.echo(f"{indent}Server response: {json.dumps(error_detail, indent=2)}")
+        except ValueError:
+            click.echo(f"{indent}Server response: {e.response.text}")
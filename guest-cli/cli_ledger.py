@@ -0,0 +1,208 @@
+import glob
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+from cli_http import config
+
+LEDGER_CONFIG = config.get("ledger", {})
+# Buffered events are written with one write() and fsync() once this many have accumulated ...
+FSYNC_BATCH = LEDGER_CONFIG.get("fsync_batch", 256)
+# ... or once the oldest buffered event is this many seconds old
+FSYNC_INTERVAL = LEDGER_CONFIG.get("fsync_interval_seconds", 1.0)
+
+EXPERIMENT_INFO_DIR = "experiment_infos"
+LEDGER_SUFFIX = ".jsonl"
+
+def new_ledger_path(kind):
+    """experiment_infos/<timestamp>_<kind>_experiment.jsonl for a new submission"""
+    timestamp = datetime.now().isoformat(timespec='seconds').replace(":", "-")
+    return Path(f"./{EXPERIMENT_INFO_DIR}/{timestamp}_{kind}_experiment{LEDGER_SUFFIX}")
+
+def is_ledger(path):
+    return str(path).endswith(LEDGER_SUFFIX)
+
+def _repair_tail(f):
+    """Cut off a partial last line left by a crash, so that new events start on a line of their own.
+
+    Only the end of the file is read, back to the last newline.
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        return
+    end = size
+    while end > 0:
+        start = max(0, end - 4096)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            return
+        end = start
+    f.truncate(0)
+
+class ExperimentLedger:
+    """Append-only JSONL event log of one experiment.
+
+    Each event is one line; recording an event only appends to a buffer,
+    which is written and fsynced in batches (see FSYNC_BATCH and
+    FSYNC_INTERVAL) and on close. Nothing already written is ever
+    rewritten: after a crash at most the unsynced tail is lost and a torn
+    last line is dropped the next time the ledger is opened.
+    """
+
+    def __init__(self, path, fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.file = open(self.path, "a+b")
+        _repair_tail(self.file)
+        self.pending = []
+        self.oldest_pending = None
+        self.count = 0
+
+    def record(self, event, task_id=None, **fields):
+        entry = {"event": event, "time": datetime.now().isoformat(timespec='seconds')}
+        if task_id is not None:
+            entry["task_id"] = task_id
+        entry.update(fields)
+        if not self.pending:
+            self.oldest_pending = time.monotonic()
+        self.pending.append(json.dumps(entry, separators=(",", ":")))
+        self.count += 1
+        if len(self.pending) >= self.fsync_batch or time.monotonic() - self.oldest_pending >= self.fsync_interval:
+            self.flush()
+
+    def submitted(self, task_infos):
+        for task_id, params in task_infos.items():
+            self.record("submitted", task_id, params=params)
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.file.write(("\n".join(self.pending) + "\n").encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_events(path):
+    """Yield the events of a ledger, skipping a torn last line and unreadable lines"""
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Partially written when the process died
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+@dataclass
+class LedgerView:
+    """Compacted state of an experiment ledger.
+
+    task_infos maps the experiment's current task IDs to their parameters,
+    in submission order, with resubmitted tasks replaced by their
+    replacement; tasks has the last known status, download path and
+    resubmission links of every task that ever belonged to the experiment.
+    """
+    task_infos: Dict[str, Dict] = field(default_factory=dict)
+    tasks: Dict[str, Dict] = field(default_factory=dict)
+
+    def status(self, task_id):
+        return self.tasks.get(task_id, {}).get("status")
+
+    def downloads(self):
+        return {task_id: state["path"] for task_id, state in self.tasks.items()
+                if task_id in self.task_infos and "path" in state}
+
+def compact(events):
+    view = LedgerView()
+    for event in events:
+        kind = event.get("event")
+        task_id = event.get("task_id")
+        if task_id is None:
+            continue
+        state = view.tasks.setdefault(task_id, {})
+        if kind == "submitted":
+            view.task_infos[task_id] = event.get("params") or {}
+        elif kind == "status":
+            state["status"] = event.get("status")
+        elif kind == "downloaded":
+            # Only finished tasks have results to download
+            state["path"] = event.get("path")
+            state["status"] = "SUCCESS"
+        elif kind == "resubmitted":
+            new_task_id = event.get("new_task_id")
+            state["resubmitted_as"] = new_task_id
+            view.tasks.setdefault(new_task_id, {})["resubmitted_from"] = task_id
+            view.task_infos[new_task_id] = view.task_infos.pop(task_id, event.get("params") or {})
+    return view
+
+def load_ledger(path):
+    return compact(read_events(path))
+
+def record_events(path, events):
+    """Append (event, task_id, fields) tuples to a ledger with a single fsync"""
+    events = list(events)
+    if not events:
+        return
+    with ExperimentLedger(path, fsync_batch=len(events) + 1, fsync_interval=float("inf")) as ledger:
+        for event, task_id, fields in events:
+            ledger.record(event, task_id, **fields)
+
+def record_status_changes(path, states, view=None):
+    """Record the tasks whose status differs from the ledger's; states maps task IDs to task dicts"""
+    if not is_ledger(path):
+        return
+    view = view or load_ledger(path)
+    record_events(path, [
+        ("status", task_id, {"status": task.get('status')})
+        for task_id, task in states.items()
+        if task_id in view.tasks and task.get('status') and view.status(task_id) != task.get('status')
+    ])
+
+# Bytes of a ledger searched at a time by find_ledger
+_SEARCH_BLOCK = 1 << 20
+
+def _mentions(path, needle):
+    with open(path, "rb") as f:
+        tail = b""
+        for block in iter(lambda: f.read(_SEARCH_BLOCK), b""):
+            if needle in tail + block:
+                return True
+            # A match may straddle two blocks
+            tail = block[-(len(needle) - 1):]
+    return False
+
+def find_ledger(task_id):
+    """The ledger under experiment_infos that a task belongs to, or None.
+
+    Ledgers are searched newest first, block by block, and the search stops
+    at the first one mentioning the task.
+    """
+    needle = f'"task_id":"{task_id}"'.encode("utf-8")
+    for path in sorted(glob.glob(os.path.join(EXPERIMENT_INFO_DIR, f"*{LEDGER_SUFFIX}")), reverse=True):
+        if _mentions(path, needle):
+            return path
+    return None
@@ -0,0 +1,193 @@
+import json
+import os
+import sys
+import time
+import click
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from cli_http import POOL_SIZE
+from cli_cache import TERMINAL_STATUSES
+from cli_experiment import load_experiment_info, resolve_experiment_info_path, summarize_states, _format_duration
+from cli_ledger import ExperimentLedger, is_ledger, load_ledger
+from cli_qudi_commands import submit_two_qubit_batch
+from cli_client import GuestClient
+from cli_result_io import load_result
+from cli_analyze import default_results_dir
+from cli_batch_index import BatchIndex
+from cli_top import _redraw
+from cli_events import TaskEvents
+
+class ResultAggregator:
+    """Running means of populations and expectation values per (circuit, initState)"""
+
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, params, data):
+        key = (params.get('circuit') or '', str(params.get('initState', '')))
+        group = self.groups.setdefault(key, {"count": 0, "sums": {}})
+        group["count"] += 1
+        values = {}
+        for field in ('populations', 'expectation_values'):
+            if isinstance(data.get(field), dict):
+                values.update({f"{field[0].upper()}{name}": value for name, value in data[field].items()
+                               if isinstance(value, (int, float))})
+        if not values and 'sigData' in data and len(data['sigData']):
+            values["signal"] = float(np.mean(data['sigData']))
+        for name, value in values.items():
+            group["sums"][name] = group["sums"].get(name, 0.0) + float(value)
+
+    def columns(self):
+        return sorted({name for group in self.groups.values() for name in group["sums"]})
+
+    def rows(self):
+        """Yield (circuit, initState, count, {column: mean})"""
+        for (circuit, init_state), group in sorted(self.groups.items()):
+            means = {name: total / group["count"] for name, total in group["sums"].items()}
+            yield circuit, init_state, group["count"], means
+
+    def lines(self):
+        columns = self.columns()
+        header = f"{'Circuit':<30} {'initState':<9} {'N':>5}" + "".join(f" {name:>10}" for name in columns)
+        lines = [header, "-" * len(header)]
+        for circuit, init_state, count, means in self.rows():
+            circuit = circuit.replace("\n", " ")
+            circuit = (circuit[:27] + "...") if len(circuit) > 30 else circuit
+            lines.append(f"{circuit or '(empty)':<30} {init_state:<9} {count:>5}"
+                         + "".join(f" {means[name]:>10.4f}" if name in means else f" {'':>10}" for name in columns))
+        return lines
+
+    def to_json(self):
+        return [{"circuit": circuit, "initState": init_state, "count": count, "means": means}
+                for circuit, init_state, count, means in self.rows()]
+
+def _progress_lines(task_ids, states, downloaded, failed, started):
+    total = len(task_ids)
+    done = downloaded + failed
+    width = 40
+    filled = int(width * done / total) if total else width
+    lines = [
+        f"[{'#' * filled}{'.' * (width - filled)}] {done}/{total} finished, {downloaded} analyzed, {failed} failed"
+        f"  ({_format_duration(time.time() - started)} elapsed)",
+        "  ".join(f"{status}: {count}" for status, count in sorted(summarize_states(task_ids, states).items())),
+        "",
+    ]
+    return lines
+
+def run_pipeline(token, experiment_path, output_dir=None, output_format='json', output=None, layout=None):
+    """Submit (or resume) an experiment and download and aggregate each result as soon as its task succeeds"""
+    try:
+        if is_ledger(experiment_path):
+            # An experiment ledger from an earlier submission
+            definition = None
+        else:
+            with open(experiment_path, "r") as f:
+                definition = json.load(f)
+    except FileNotFoundError:
+        # Not a path, maybe an experiment info name under ./experiment_infos
+        definition = None
+    except json.JSONDecodeError as e:
+        click.echo(f"Invalid JSON in {experiment_path}: {str(e)}")
+        return None
+
+    if isinstance(definition, dict) and 'experiments' in definition:
+        experiment_info = submit_two_qubit_batch(token, experiment_path)
+        if experiment_info is None:
+            return None
+    else:
+        # An experiment info file from an earlier submission: resume it
+        experiment_info = experiment_path
+    try:
+        experiment_data = load_experiment_info(experiment_info)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        click.echo(f"Cannot read experiment info {experiment_info}: {e}")
+        return None
+
+    ledger_path = resolve_experiment_info_path(experiment_info)
+    view = load_ledger(ledger_path) if is_ledger(ledger_path) else None
+    output_dir = output_dir or default_results_dir(experiment_info)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    client = GuestClient(token)
+
+    task_ids = list(experiment_data)
+    states = {}
+    downloads = {}
+    aggregator = ResultAggregator()
+    downloaded = failed = 0
+    started = time.time()
+    live = sys.stdout.isatty()
+    screen = []
+    reported = None
+
+    def show():
+        nonlocal screen, reported
+        lines = _progress_lines(task_ids, states, downloaded, failed, started) + aggregator.lines()
+        lines[1] += f"  ({events.mode}, {events.requests} requests)"
+        if live:
+            screen = _redraw(screen, lines)
+        elif reported != (downloaded, failed):
+            # Without a terminal only report progress, not every status change
+            reported = (downloaded, failed)
+            click.echo(lines[0])
+
+    if live:
+        sys.stdout.write("\x1b[2J")
+    try:
+        with TaskEvents(token, task_ids) as events, ThreadPoolExecutor(max_workers=POOL_SIZE) as pool, \
+                (ExperimentLedger(ledger_path) if view else nullcontext()) as ledger, BatchIndex(output_dir, layout) as index:
+            while not events.finished or downloads:
+                # Downloads are checked often while they run, otherwise just wait for the next event
+                task = events.get(timeout=0.05 if downloads else 0.5)
+                changed = False
+                while task is not None:
+                    task_id = task['task_id']
+                    states[task_id] = task
+                    status = task.get('status')
+                    if ledger and status != view.status(task_id) and status != 'SUCCESS':
+                        ledger.record("status", task_id, status=status)
+                    if status == 'SUCCESS':
+                        downloads[pool.submit(client.download, task_id, index.result_path(task_id), output_format)] = task_id
+                    elif status in TERMINAL_STATUSES or status == 'UNKNOWN':
+                        failed += 1
+                    changed = True
+                    task = events.get(timeout=0)
+
+                # Analyze downloads as they land
+                for future in [future for future in downloads if future.done()]:
+                    task_id = downloads.pop(future)
+                    try:
+                        download = future.result()
+                        index.add(task_id, download.path)
+                        aggregator.add(experiment_data[task_id], load_result(download.path))
+                        if ledger:
+                            ledger.record("downloaded", task_id, path=download.path)
+                        downloaded += 1
+                    except (requests.exceptions.RequestException, OSError, ValueError, TypeError) as e:
+                        failed += 1
+                        if not live:
+                            click.echo(f"Failed to download or analyze {task_id}: {e}")
+                    changed = True
+                if changed:
+                    show()
+    except KeyboardInterrupt:
+        click.echo(f"\nInterrupted. Resume with 'guest run {os.path.basename(experiment_info)}'")
+        return None
+
+    if live:
+        click.echo("")
+    else:
+        click.echo("\n".join(aggregator.lines()))
+    if events.error:
+        click.echo(f"Stopped waiting: {events.error}. Resume with 'guest run {os.path.basename(experiment_info)}'")
+    click.echo(f"\nFinished {downloaded + failed} of {len(task_ids)} task(s) in {_format_duration(time.time() - started)}: "
+               f"{downloaded} analyzed, {failed} failed. Results in {output_dir}")
+    click.echo(f"Status updates: {events.mode}, {events.requests} request(s)")
+    if output:
+        with open(output, "w") as f:
+            json.dump({"experiment_info": experiment_info, "groups": aggregator.to_json()}, f, indent=2)
+        click.echo(f"Saved aggregates to {output}")
+    return aggregator
@@ -1,8 +1,11 @@
 import requests
 import json
 import click
-from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cli_http import echo_request_error
+from cli_client import GuestClient, GuestError
+from cli_ledger import ExperimentLedger, new_ledger_path
 
 def load_config():
     with open("config.json", "r") as config_file:
@@ -14,68 +17,32 @@ VERIFY_SERVER_CERT = config.get("security", {}).get("verify_server_cert", True)
 
 TOKEN_FILE_PATH = config["paths"]["token_file_path"]
 
-def run_rabi(access_token):
-    
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    response = requests.post(
-        f"{config['server']['url']}/api/run_remote_rabi", 
-        headers=headers,
-        verify=VERIFY_SERVER_CERT
-    )
+# Experiments per submission request and concurrent requests when streaming from stdin
+STREAM_GROUP_SIZE = config.get("submit", {}).get("group_size", 100)
+STREAM_MAX_IN_FLIGHT = config.get("submit", {}).get("max_in_flight", 4)
 
+def _echo_submitted(task):
+    click.echo(f"Job submitted successfully with ID: {task.task_id}")
+    click.echo(f"Status: {task.status}")
+    click.echo(f"Use 'guest job-status {task.task_id}' to check the status")
+
+def _run_job(access_token, method):
     try:
-        result = response.json()
-        if 'task_id' in result:
-            click.echo(f"Job submitted successfully with ID: {result['task_id']}")
-            click.echo(f"Status: {result.get('status', 'unknown')}")
-            click.echo(f"Use 'guest job-status {result['task_id']}' to check the status")
-        else:
-            click.echo(response.text)
-    except ValueError:
-        click.echo(response.text)
+        task = getattr(GuestClient(access_token), method)()
+    except (requests.exceptions.RequestException, GuestError) as e:
+        echo_request_error(e)
+        return None
+    _echo_submitted(task)
+    return task.task_id
 
-def run_calibration(access_token):
-    
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    response = requests.post(
-        f"{config['server']['url']}/api/run_calibration", 
-        headers=headers,
-        verify=VERIFY_SERVER_CERT
-    )
+def run_rabi(access_token):
+    return _run_job(access_token, "run_rabi")
 
-    try:
-        result = response.json()
-        if 'task_id' in result:
-            click.echo(f"Job submitted successfully with ID: {result['task_id']}")
-            click.echo(f"Status: {result.get('status', 'unknown')}")
-            click.echo(f"Use 'guest job-status {result['task_id']}' to check the status")
-        else:
-            click.echo(response.text)
-    except ValueError:
-        click.echo(response.text)
+def run_calibration(access_token):
+    return _run_job(access_token, "run_calibration")
 
 def run_two_qubit_circuit(access_token):
-    
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    response = requests.post(
-        f"{config['server']['url']}/api/run_two_qubit_circuit", 
-        headers=headers,
-        verify=VERIFY_SERVER_CERT
-    )
-
-    try:
-        result = response.json()
-        if 'task_id' in result:
-            click.echo(f"Job submitted successfully with ID: {result['task_id']}")
-            click.echo(f"Status: {result.get('status', 'unknown')}")
-            click.echo(f"Use 'guest job-status {result['task_id']}' to check the status")
-        else:
-            click.echo(response.text)
-    except ValueError:
-        click.echo(response.text)
+    return _run_job(access_token, "run_two_qubit_circuit")
 
 def submit_two_qubit_batch(access_token, path=None):
     
@@ -84,30 +51,95 @@ def submit_two_qubit_batch(access_token, path=None):
 
     with open(path, "r") as f:
         experiment_data = json.load(f)
-        
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    response = requests.post(
-        f"{config['server']['url']}/api/submit_two_qubit_batch", 
-        headers=headers,
-        json=experiment_data,
-        verify=VERIFY_SERVER_CERT
-    )
 
     try:
-        result = response.json()
-        if 'task_infos' in result:
-            click.echo(result["message"])
-            task_infos = result["task_infos"]
-
-            timestamp = datetime.now().isoformat(timespec='seconds').replace(":", "-")
-            save_path = Path(f"./experiment_infos/{timestamp}_tq_experiment.json")
-            save_path.parent.mkdir(parents=True, exist_ok=True)
-
-            with open(save_path, "w") as f:
-                json.dump(task_infos, f, indent=2)
-            click.echo(f"Saved task_infos to {save_path}")
-        else:
-            click.echo(response.text)
-    except ValueError:
-        click.echo(response.text)
\ No newline at end of file
+        # Sent as it is, with any top-level fields besides the experiments
+        submission = GuestClient(access_token).submit_two_qubit_document(experiment_data)
+    except (requests.exceptions.RequestException, GuestError) as e:
+        echo_request_error(e)
+        return None
+
+    click.echo(submission.message)
+    save_path = new_ledger_path("tq")
+    with ExperimentLedger(save_path) as ledger:
+        ledger.submitted(submission.task_infos)
+    click.echo(f"Saved task_infos to {save_path}")
+    return str(save_path)
+
+def _read_ndjson(lines, failed):
+    """Yield experiments from NDJSON lines; unparsable lines are reported and collected in failed"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            experiment = json.loads(line)
+        except json.JSONDecodeError as e:
+            click.echo(f"Line {number}: invalid JSON ({e}), skipped", err=True)
+            failed.append(line)
+            continue
+        if not isinstance(experiment, dict):
+            click.echo(f"Line {number}: expected a JSON object, skipped", err=True)
+            failed.append(line)
+            continue
+        yield experiment
+
+def _groups(experiments, size):
+    group = []
+    for experiment in experiments:
+        group.append(experiment)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def stream_two_qubit_batch(access_token, lines, group_size=STREAM_GROUP_SIZE, max_in_flight=STREAM_MAX_IN_FLIGHT, simulate=None):
+    """Submit NDJSON experiments in groups as they are read, appending task_infos to the experiment ledger.
+
+    At most max_in_flight requests are outstanding; reading pauses until one
+    of them completes, so only a few groups are ever held in memory.
+    """
+    client = GuestClient(access_token)
+
+    save_path = new_ledger_path("tq")
+    failed_path = save_path.with_suffix(".failed.ndjson")
+    ledger = ExperimentLedger(save_path)
+    failed = []
+    in_flight = {}
+    submitted_requests = 0
+
+    def collect(futures):
+        nonlocal submitted_requests
+        for future in futures:
+            group = in_flight.pop(future)
+            try:
+                ledger.submitted(future.result().task_infos)
+                submitted_requests += 1
+            except (requests.exceptions.RequestException, GuestError, ValueError) as e:
+                click.echo(f"Submitting {len(group)} experiments failed:", err=True)
+                if isinstance(e, requests.exceptions.RequestException):
+                    echo_request_error(e, indent="  ")
+                else:
+                    click.echo(f"  Unexpected response: {e}", err=True)
+                failed.extend(json.dumps(experiment) for experiment in group)
+        click.echo(f"\rSubmitted {ledger.count} experiments in {submitted_requests} request(s)", nl=False, err=True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            for group in _groups(_read_ndjson(lines, failed), group_size):
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[pool.submit(client.submit_two_qubit_batch, group, simulate)] = group
+            collect(list(in_flight))
+    finally:
+        ledger.close()
+        click.echo("", err=True)
+        if failed:
+            with open(failed_path, "w") as f:
+                f.write("\n".join(failed) + "\n")
+            click.echo(f"{len(failed)} experiment(s) were not submitted; saved them to {failed_path} to pipe in again")
+
+    click.echo(f"Saved task_infos of {ledger.count} experiments to {save_path}")
+    return str(save_path)
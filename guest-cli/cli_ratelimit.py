@@ -0,0 +1,237 @@
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+
+RATE_LIMIT_CONFIG = config.get("rate_limit", {})
+RATE_LIMIT_ENABLED = RATE_LIMIT_CONFIG.get("enabled", True)
+
+# Requests per second and burst size of each endpoint class; "rate_limit": {"budgets": {...}} overrides them.
+# These are ceilings: below them the adaptive concurrency and the server's 429s set the pace
+DEFAULT_BUDGETS = {
+    "status": {"rate": 200.0, "burst": 400},
+    "download": {"rate": 100.0, "burst": 200},
+    "submit": {"rate": 50.0, "burst": 100},
+    "cancel": {"rate": 100.0, "burst": 200},
+    "default": {"rate": 100.0, "burst": 200},
+}
+BUDGETS = {name: dict(budget, **RATE_LIMIT_CONFIG.get("budgets", {}).get(name, {}))
+           for name, budget in DEFAULT_BUDGETS.items()}
+
+# First matching pattern of the request path picks the budget
+ENDPOINT_BUDGETS = (
+    (re.compile(r"/api/tasks/[^/]+/download"), "download"),
+    (re.compile(r"/api/(submit|run_|resubmit_job|upload)"), "submit"),
+    (re.compile(r"/api/cancel"), "cancel"),
+    (re.compile(r"/api/tasks"), "status"),
+)
+
+# Adaptive concurrency: start here, grow by one per round of successful requests, halve on overload
+INITIAL_CONCURRENCY = RATE_LIMIT_CONFIG.get("initial_concurrency", 4)
+MAX_CONCURRENCY = RATE_LIMIT_CONFIG.get("max_concurrency", config.get("http", {}).get("pool_size", 16))
+MIN_CONCURRENCY = 1
+DECREASE_FACTOR = 0.5
+# Smoothed latency above this multiple of the best one seen counts as overload
+LATENCY_TOLERANCE = RATE_LIMIT_CONFIG.get("latency_tolerance", 2.0)
+LATENCY_SMOOTHING = 0.2
+
+# Throttled requests are retried this often, waiting Retry-After or (429 only) an exponential backoff
+MAX_RETRIES = RATE_LIMIT_CONFIG.get("max_retries", 5)
+# A longer Retry-After is not waited for; the response is returned to the caller instead
+MAX_RETRY_AFTER = RATE_LIMIT_CONFIG.get("max_retry_after_seconds", 120)
+BACKOFF_BASE = 1.0
+THROTTLE_STATUS = {429, 503}
+
+def _retryable(response):
+    """429 is always throttling; a 503 only when it says when to come back.
+
+    A bare 503 is an outage, returned at once so the circuit breaker
+    counts every one of them.
+    """
+    return response.status_code == 429 or "Retry-After" in response.headers
+
+def budget_for(path):
+    path = path.split("?", 1)[0]
+    for pattern, budget in ENDPOINT_BUDGETS:
+        if pattern.search(path):
+            return budget
+    return "default"
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta seconds or HTTP date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self, now):
+        """Take a token and return 0, or return how long to wait for one"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+        # Start again from an empty bucket rather than bursting when the pause ends
+        self.tokens = 0.0
+        self.updated = max(self.updated, until)
+
+class RateLimiter:
+    """Process-wide limiter of API requests.
+
+    Each endpoint class has a token bucket, and the number of requests in
+    flight is capped by a limit adapted AIMD-style: it grows by one per
+    round of requests answered without overload and is halved, at most
+    once per smoothed round trip, when the server answers 429/503 or its
+    latency rises above LATENCY_TOLERANCE times the best seen.
+    """
+
+    def __init__(self, budgets=BUDGETS, initial=INITIAL_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        self.buckets = {name: TokenBucket(budget["rate"], budget["burst"]) for name, budget in budgets.items()}
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.latency = {}
+        self.best_latency = {}
+        self.last_decrease = 0.0
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "waited_seconds": 0.0}
+
+    def acquire(self, budget):
+        bucket = self.buckets.get(budget, self.buckets["default"])
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.in_flight >= int(self.limit):
+                    # Woken up by release()
+                    self.condition.wait()
+                    continue
+                wait = bucket.take(now)
+                if wait <= 0:
+                    self.in_flight += 1
+                    self.stats["requests"] += 1
+                    self.stats["waited_seconds"] += now - started
+                    return
+                self.condition.wait(wait)
+
+    def release(self, budget, latency, overloaded=False):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            smoothed = self.latency.get(budget)
+            smoothed = latency if smoothed is None else smoothed + LATENCY_SMOOTHING * (latency - smoothed)
+            self.latency[budget] = smoothed
+            best = self.best_latency[budget] = min(self.best_latency.get(budget, smoothed), smoothed)
+            if overloaded or smoothed > LATENCY_TOLERANCE * best:
+                if now - self.last_decrease > smoothed:
+                    self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def count(self, name):
+        with self.condition:
+            self.stats[name] += 1
+
+    def block(self, budget, seconds):
+        """Pause an endpoint class, or every one for budget None, e.g. after a Retry-After"""
+        with self.condition:
+            until = time.monotonic() + seconds
+            for name, bucket in self.buckets.items():
+                if budget is None or name == budget:
+                    bucket.block(until)
+            self.condition.notify_all()
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+    return _limiter
+
+def limiter_stats():
+    limiter = get_limiter()
+    with limiter.condition:
+        return dict(limiter.stats)
+
+def _replayable(request):
+    return request.body is None or isinstance(request.body, (bytes, str))
+
+class RateLimitedAdapter(HTTPAdapter):
+    """Transport adapter sending every request through the shared RateLimiter.
+
+    Throttled responses pause the endpoint class for Retry-After seconds
+    or an exponential backoff and are retried up to MAX_RETRIES times. A
+    503 pauses all endpoint classes and is only retried if it carries
+    Retry-After; without it the response is returned at once.
+    """
+
+    def send(self, request, **kwargs):
+        if not RATE_LIMIT_ENABLED:
+            return super().send(request, **kwargs)
+        limiter = get_limiter()
+        budget = budget_for(request.path_url)
+        attempt = 0
+        while True:
+            limiter.acquire(budget)
+            started = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                limiter.release(budget, time.monotonic() - started, overloaded=True)
+                raise
+            throttled = response.status_code in THROTTLE_STATUS
+            limiter.release(budget, time.monotonic() - started, overloaded=throttled)
+            if not throttled:
+                return response
+
+            limiter.count("throttled")
+            if not _retryable(response):
+                return response
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            if delay is None:
+                delay = BACKOFF_BASE * 2 ** attempt
+            if attempt >= MAX_RETRIES or delay > MAX_RETRY_AFTER or not _replayable(request):
+                return response
+            limiter.block(None if response.status_code == 503 else budget, delay)
+            response.close()
+            attempt += 1
+            limiter.count("retries")
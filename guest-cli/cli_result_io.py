@@ -0,0 +1,411 @@
+import json
+import os
+import re
+import zipfile
+import numpy as np
+
+from cli_archive import open_result, binary_source, result_size
+
+# Formats a result can be stored in locally
+RESULT_FORMATS = ("json", "npy", "npz")
+
+# Accept header asking the server for binary arrays, with JSON as fallback
+BINARY_ACCEPT = "application/x-npz, application/json;q=0.9"
+
+# Key of the sidecar JSON describing where the arrays of a binary result live
+ARRAYS_KEY = "_arrays"
+
+def split_arrays(data):
+    """Separate the numeric arrays of a result from its scalar and nested fields"""
+    arrays = {}
+    scalars = {}
+    for key, value in data.items():
+        if isinstance(value, (list, np.ndarray)):
+            try:
+                array = np.asarray(value)
+            except ValueError:
+                # Ragged nested lists stay JSON
+                scalars[key] = value
+                continue
+            if array.dtype.kind in "biuf":
+                arrays[key] = array
+                continue
+        scalars[key] = value
+    return arrays, scalars
+
+def write_binary_result(data, json_path, output_format="npz"):
+    """Write a result dict as binary arrays plus a small JSON sidecar at json_path.
+
+    npz puts all arrays into <base>.npz, npy writes one <base>.<key>.npy per
+    array. The sidecar keeps every non-array field and records the array
+    files and shapes under '_arrays'. Returns the sidecar path.
+    """
+    arrays, scalars = split_arrays(data)
+    base = os.path.splitext(json_path)[0]
+    directory = os.path.dirname(base)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if output_format == "npz":
+        np.savez_compressed(base + ".npz", **arrays)
+        files = {key: os.path.basename(base) + ".npz" for key in arrays}
+    elif output_format == "npy":
+        files = {}
+        for key, array in arrays.items():
+            np.save(f"{base}.{key}.npy", array)
+            files[key] = f"{os.path.basename(base)}.{key}.npy"
+    else:
+        raise ValueError(f"Unknown binary result format: {output_format}")
+
+    scalars[ARRAYS_KEY] = {
+        "format": output_format,
+        "files": files,
+        "shapes": {key: list(array.shape) for key, array in arrays.items()},
+    }
+    sidecar_path = base + ".json"
+    if os.path.lexists(sidecar_path):
+        # May be a read-only link into the object store, which must not be written through
+        os.remove(sidecar_path)
+    with open(sidecar_path, "w") as f:
+        json.dump(scalars, f, indent=2)
+    return sidecar_path
+
+def write_binary_from_npz(npz_file, json_path, output_format="npz"):
+    """Store an npz payload sent by the server; 0-d members become sidecar fields"""
+    data = {}
+    with np.load(npz_file, allow_pickle=False) as npz:
+        for key in npz.files:
+            value = npz[key]
+            data[key] = value.item() if value.ndim == 0 else value
+    return write_binary_result(data, json_path, output_format)
+
+def load_result(path):
+    """Load a result file; arrays of binary results are loaded as NumPy arrays"""
+    with open_result(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or ARRAYS_KEY not in data:
+        return data
+
+    info = data.pop(ARRAYS_KEY)
+    directory = os.path.dirname(path)
+    if info["format"] == "npz":
+        npz_files = set(info["files"].values())
+        for npz_file in npz_files:
+            with np.load(binary_source(os.path.join(directory, npz_file)), allow_pickle=False) as npz:
+                for key in npz.files:
+                    data[key] = npz[key]
+    else:
+        for key, filename in info["files"].items():
+            data[key] = np.load(binary_source(os.path.join(directory, filename)), allow_pickle=False)
+    return data
+
+# ----------------- STREAMING READER -----------------------------------------------------------
+
+# Elements (or rows, for 2-D arrays) per chunk yielded by the streaming reader
+DEFAULT_CHUNK_SIZE = 65536
+
+_READ_SIZE = 1 << 20
+_WHITESPACE = " \t\r\n"
+# Characters that may follow a complete value
+_DELIMITERS = ",}]" + _WHITESPACE
+_NUMBER_START = set("-0123456789NI")
+_BRACKETS = re.compile(r"[\[\]]")
+_decoder = json.JSONDecoder()
+
+def _parse_numbers(text):
+    """float64 array of comma-separated JSON numbers; null becomes NaN"""
+    try:
+        return np.array(text.split(","), dtype=np.float64)
+    except ValueError:
+        # Rare values like null take the slow path
+        values = json.loads(f"[{text}]")
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+class _JsonReader:
+    """Incremental access to a JSON text that keeps only one read block in memory"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next block, dropping the consumed text; returns False at end of file"""
+        if self.eof:
+            return False
+        data = self.f.read(_READ_SIZE)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def peek_from(self, offset):
+        """Return the first non-whitespace character at or after pos + offset and its offset"""
+        while True:
+            i = self.pos + offset
+            while i < len(self.buf) and self.buf[i] in _WHITESPACE:
+                i += 1
+            if i < len(self.buf):
+                return self.buf[i], i - self.pos
+            offset = i - self.pos
+            if not self.fill():
+                return "", offset
+
+    def peek(self):
+        char, offset = self.peek_from(0)
+        self.pos += offset
+        return char
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode one complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            if self.eof or (end < len(self.buf) and self.buf[end] in _DELIMITERS):
+                self.pos = end
+                return value
+            # A number cut at the block boundary decodes too early, e.g. "12." of "12.5"
+            self.fill()
+
+    def array_kind(self):
+        """Classify the upcoming value: None (not a numeric array), 'empty', 'flat' or 'rows'"""
+        if self.peek() != "[":
+            return None
+        char, offset = self.peek_from(1)
+        if char in _NUMBER_START:
+            return "flat"
+        if char == "]":
+            return "empty"
+        if char == "[":
+            inner, _ = self.peek_from(offset + 1)
+            if inner in _NUMBER_START or inner == "]":
+                return "rows"
+        return None
+
+    def numbers(self):
+        """Yield the numbers of a flat array as float64 blocks; the '[' must be consumed"""
+        while True:
+            end = self.buf.find("]", self.pos)
+            if end != -1:
+                text = self.buf[self.pos:end]
+                self.pos = end + 1
+                if text.strip():
+                    yield _parse_numbers(text)
+                return
+            cut = self.buf.rfind(",", self.pos)
+            if cut != -1:
+                text = self.buf[self.pos:cut]
+                self.pos = cut + 1
+                yield _parse_numbers(text)
+            if not self.fill():
+                raise ValueError("Unterminated array")
+
+    def rows(self):
+        """Yield the rows of a 2-D array one by one; the outer '[' must be consumed"""
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            self.expect("[")
+            blocks = list(self.numbers())
+            yield np.concatenate(blocks) if blocks else np.empty(0)
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' but found '{char}'")
+
+    def skip_array(self):
+        """Skip an array whose '[' is consumed and return its number of elements"""
+        depth = 1
+        commas = 0
+        empty = True
+        while True:
+            for match in _BRACKETS.finditer(self.buf, self.pos):
+                segment = self.buf[self.pos:match.start()]
+                if depth == 1:
+                    commas += segment.count(",")
+                if empty and (segment.strip() or match.group() == "["):
+                    empty = False
+                self.pos = match.end()
+                depth += 1 if match.group() == "[" else -1
+                if depth == 0:
+                    return 0 if empty else commas + 1
+            segment = self.buf[self.pos:]
+            if depth == 1:
+                commas += segment.count(",")
+            if empty and segment.strip():
+                empty = False
+            self.pos = len(self.buf)
+            if not self.fill():
+                raise ValueError("Unterminated array")
+
+def _rechunk(blocks, chunk_size):
+    """Turn blocks of arbitrary length into chunks of exactly chunk_size (the last one shorter)"""
+    pending = []
+    count = 0
+    for block in blocks:
+        pending.append(block)
+        count += len(block)
+        while count >= chunk_size:
+            merged = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield merged[:chunk_size]
+            pending = [merged[chunk_size:]]
+            count = len(pending[0])
+    if count:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+def _stack_rows(rows, chunk_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == chunk_size:
+            yield np.stack(batch)
+            batch = []
+    if batch:
+        yield np.stack(batch)
+
+def _walk_json(path, chunk_size, wanted):
+    with open_result(path) as f:
+        reader = _JsonReader(f)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            kind = reader.array_kind()
+            if kind is None:
+                yield key, reader.value(), "value"
+            else:
+                reader.pos += 1
+                if wanted is not None and key not in wanted:
+                    yield key, reader.skip_array(), "skipped"
+                elif kind == "empty":
+                    reader.expect("]")
+                    yield key, np.empty(0), "chunk"
+                elif kind == "flat":
+                    for chunk in _rechunk(reader.numbers(), chunk_size):
+                        yield key, chunk, "chunk"
+                else:
+                    for chunk in _stack_rows(reader.rows(), chunk_size):
+                        yield key, chunk, "chunk"
+            char = reader.peek()
+            reader.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}' after '{key}' but found '{char}'")
+
+def _iter_npz_member(npz_path, key, chunk_size):
+    """Read one array of an .npz archive in chunks without decompressing it as a whole"""
+    with zipfile.ZipFile(npz_path) as archive, archive.open(key + ".npy") as member:
+        version = np.lib.format.read_magic(member)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member)
+        if fortran_order and len(shape) > 1:
+            if hasattr(npz_path, "seek"):
+                npz_path.seek(0)
+            array = np.load(npz_path)[key]
+            for start in range(0, len(array), chunk_size):
+                yield array[start:start + chunk_size]
+            return
+        row_shape = shape[1:]
+        row_bytes = int(np.prod(row_shape, dtype=np.int64)) * dtype.itemsize
+        remaining = shape[0] if shape else 1
+        while remaining > 0:
+            rows = min(chunk_size, remaining)
+            data = member.read(rows * row_bytes)
+            yield np.frombuffer(data, dtype=dtype).reshape((rows,) + row_shape)
+            remaining -= rows
+
+def _walk_binary(path, data, chunk_size, wanted):
+    info = data.pop(ARRAYS_KEY)
+    directory = os.path.dirname(path)
+    for key, value in data.items():
+        yield key, value, "value"
+    for key, filename in info["files"].items():
+        if wanted is not None and key not in wanted:
+            shape = info["shapes"].get(key, [0])
+            yield key, shape[0] if shape else 0, "skipped"
+            continue
+        file_path = binary_source(os.path.join(directory, filename))
+        if info["format"] == "npz":
+            for chunk in _iter_npz_member(file_path, key, chunk_size):
+                yield key, chunk.astype(np.float64, copy=False), "chunk"
+        else:
+            # Archived arrays are already in memory and cannot be mapped
+            array = np.load(file_path, mmap_mode="r" if isinstance(file_path, str) else None)
+            for start in range(0, max(len(array), 1), chunk_size):
+                yield key, np.array(array[start:start + chunk_size], dtype=np.float64), "chunk"
+
+def _walk_loaded(data, chunk_size, wanted):
+    arrays, scalars = split_arrays(data)
+    for key, value in scalars.items():
+        yield key, value, "value"
+    for key, array in arrays.items():
+        if wanted is not None and key not in wanted:
+            yield key, len(array), "skipped"
+            continue
+        array = array.astype(np.float64)
+        for start in range(0, max(len(array), 1), chunk_size):
+            yield key, array[start:start + chunk_size], "chunk"
+
+def _walk(path, chunk_size, wanted):
+    if result_size(path) >= _READ_SIZE:
+        yield from _walk_json(path, chunk_size, wanted)
+        return
+    # Small files (and binary-result sidecars) are cheaper to parse in one go
+    with open_result(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("Result file is not a JSON object")
+    if ARRAYS_KEY in data:
+        yield from _walk_binary(path, data, chunk_size, wanted)
+    else:
+        yield from _walk_loaded(data, chunk_size, wanted)
+
+def iter_result(path, chunk_size=DEFAULT_CHUNK_SIZE, arrays=None):
+    """Walk a result file incrementally in bounded memory.
+
+    Yields (key, value, is_chunk). Numeric arrays arrive as consecutive float64
+    chunks of up to chunk_size elements (rows for 2-D arrays) with is_chunk set;
+    all other fields arrive once, fully decoded. If arrays is given, only those
+    array keys are decoded and the other arrays are skipped.
+    """
+    wanted = set(arrays) if arrays is not None else None
+    for key, value, kind in _walk(path, chunk_size, wanted):
+        if kind != "skipped":
+            yield key, value, kind == "chunk"
+
+def iter_array_chunks(path, key, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the chunks of a single array of a result file"""
+    for _, chunk, is_chunk in iter_result(path, chunk_size, arrays=(key,)):
+        if is_chunk:
+            yield chunk
+
+def read_result_fields(path):
+    """Return the non-array fields of a result, with '<key>_len' for each array, without decoding arrays"""
+    fields = {}
+    for key, value, kind in _walk(path, DEFAULT_CHUNK_SIZE, set()):
+        if kind == "skipped":
+            fields[f"{key}_len"] = value
+        else:
+            fields[key] = value
+    return fields
@@ -4,9 +4,20 @@ import requests
 import json
 import click
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
 
+from cli_client import GuestClient, GuestError
+from cli_experiment import load_experiment_info
+from cli_ledger import ExperimentLedger, is_ledger, load_ledger, find_ledger, record_events
+from cli_batch_index import BatchIndex
+from cli_http import POOL_SIZE, echo_request_error
+from cli_ratelimit import limiter_stats
+from cli_health import SERVER, QUDI, get_health
+from cli_table import render_table, short_timestamps, execution_time
+
 def load_config():
     with open("config.json", "r") as config_file:
         config = json.load(config_file)
@@ -27,24 +38,15 @@ def _extract_user_id_from_token(token: str):
         return None
 
 def get_job_status(token, job_id):
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.get(
-            f"{config['server']['url']}/api/tasks/{job_id}", 
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
-        
-        result = response.json()
+        task = GuestClient(token).status(job_id)
         
-        click.echo(f"Job ID: {result['task_id']}")
-        click.echo(f"Status: {result['status']}")
+        click.echo(f"Job ID: {task.task_id}")
+        click.echo(f"Status: {task.status}")
         
         # Show execution time for successful jobs
-        if result['status'] == 'SUCCESS':
-            duration = result.get('duration')
+        if task.status == 'SUCCESS':
+            duration = task.duration
             if duration:
                 try:
                     # Convert duration to float first, then to int for calculations
@@ -66,16 +68,16 @@ def get_job_status(token, job_id):
                     click.echo(f"Execution Time: {duration} (could not parse)")
             
             click.echo("\nResults:")
-            if 'result' in result:
+            if task.result is not None:
                 # Format the results nicely
-                formatted_results = json.dumps(result['result'], indent=2)
+                formatted_results = json.dumps(task.result, indent=2)
                 click.echo(formatted_results)   
             else:
                 click.echo("No result data available")
-        elif result['status'] == 'FAILURE':
-            error_msg = result.get('error', 'Unknown error')
-            failure_type = result.get('failure_type', 'UNKNOWN_ERROR')
-            retries = result.get('retries', '0')
+        elif task.status == 'FAILURE':
+            error_msg = task.error or 'Unknown error'
+            failure_type = task.failure_type or 'UNKNOWN_ERROR'
+            retries = task.retries or '0'
             
             click.echo(f"\nError: {error_msg}")
             click.echo(f"Failure Type: {failure_type}")
@@ -90,25 +92,18 @@ def get_job_status(token, job_id):
                 click.echo("Note: The operation timed out. The job will be retried automatically.")
             elif failure_type == 'CONNECTION_ERROR':
                 click.echo("Note: Connection error occurred. The job will be retried automatically.")
-        elif result['status'] == 'PENDING':
+        elif task.status == 'PENDING':
             click.echo("\nJob is still pending in the queue")
-        elif result['status'] == 'STARTED':
+        elif task.status == 'STARTED':
             click.echo("\nJob is currently running")
-            if 'progress' in result:
-                click.echo(f"Progress: {result['progress']}")
+            if task.progress is not None:
+                click.echo(f"Progress: {task.progress}")
         
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
 
-def list_jobs(token, limit=30):
+def list_jobs(token, limit=30, truncate=True):
     """List all jobs with their submission times, execution duration and submitting user"""
-    headers = {"Authorization": f"Bearer {token}"}
     user_id = _extract_user_id_from_token(token)
     
     # Job type abbreviations dictionary
@@ -120,156 +115,67 @@ def list_jobs(token, limit=30):
     }
     
     try:
-        response = requests.get(
-            f"{config['server']['url']}/api/tasks?limit={limit}", 
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
-        
-        result = response.json()        
-        tasks = result.get('tasks', [])
+        tasks = GuestClient(token).list_tasks(limit)
 
         if not tasks:
             click.echo("No jobs found.")
             return
             
-        click.echo("\nJobs:")
-        click.echo("-" * 120)
-        click.echo(f"{'ID':<26} {'Type':<4} {'Status':<10} {'User':<16} {'Submitted At':<12} {'Execution Time':<15} {'Failure Info'}")
-        click.echo("-" * 120)
-        
-        for task in tasks:
-            task_id = task.get('task_id', 'Unknown')
-            task_type = task.get('task_type', 'Unknown')
-            status = task.get('status', 'Unknown')
-            submitted_at = task.get('submitted_at', 'Unknown')
-            user_name = (
-                task.get('user_name')
-                or task.get('username')
-                or task.get('user_id', 'Unknown')
-            )
-            
-            # Format timestamp to show only MM-DDTHH:MM
-            if submitted_at != 'Unknown':
-                try:
-                    # Parse the timestamp and format it
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(submitted_at.replace('Z', '+00:00'))
-                    formatted_time = dt.strftime('%m-%dT%H:%M')
-                except (ValueError, AttributeError):
-                    formatted_time = submitted_at[:12]  # Fallback to first 12 chars
-            else:
-                formatted_time = 'Unknown'
-            
-            # Get job type abbreviation
-            job_type_abbrev = job_type_abbreviations.get(task_type, '--')
-            
-            # Calculate execution time for successful jobs
-            execution_time = ""
-            if status == 'SUCCESS':
-                duration = int(float(task.get('duration')))
-                if duration:
-                    # Convert seconds to human readable format
-                    if duration < 60:
-                        execution_time = f"{duration:.1f}s"
-                    elif duration < 3600:
-                        minutes = int(duration // 60)
-                        seconds = duration % 60
-                        execution_time = f"{minutes}m {seconds:.1f}s"
-                    else:
-                        hours = int(duration // 3600)
-                        minutes = int((duration % 3600) // 60)
-                        execution_time = f"{hours}h {minutes}m"
-                else:
-                    execution_time = "N/A"
-            
-            # Get failure information for failed jobs
-            failure_info = ""
-            if status == 'FAILURE':
-                failure_type = task.get('failure_type', 'UNKNOWN')
-                retries = task.get('retries', '0')
-                if failure_type == 'QUDI_MODULES_BUSY':
-                    failure_info = "QUDI busy"
-                elif failure_type == 'QUDI_SERVER_UNREACHABLE':
-                    failure_info = "QUDI unreachable"
-                elif failure_type == 'TIMEOUT':
-                    failure_info = "Timeout"
-                elif failure_type == 'CONNECTION_ERROR':
-                    failure_info = "Connection error"
-                else:
-                    failure_info = f"Error (retries: {retries})"
-            
-            click.echo(f"{task_id:<26} {job_type_abbrev:<4} {status:<10} {user_name:<16} {formatted_time:<12} {execution_time:<15} {failure_info}")
+        # Failure types with a short description; others show the retry count
+        failure_descriptions = {
+            'QUDI_MODULES_BUSY': "QUDI busy",
+            'QUDI_SERVER_UNREACHABLE': "QUDI unreachable",
+            'TIMEOUT': "Timeout",
+            'CONNECTION_ERROR': "Connection error",
+        }
+        
+        failure_info = [
+            (failure_descriptions.get(task.failure_type) or f"Error (retries: {task.retries or '0'})")
+            if task.status == 'FAILURE' else ""
+            for task in tasks
+        ]
+        
+        render_table(
+            [('ID', 26, '<'), ('Type', 4, '<'), ('Status', 10, '<'), ('User', 16, '<'),
+             ('Submitted At', 12, '<'), ('Execution Time', 15, '<'), ('Failure Info', None, '<')],
+            [
+                [task.task_id for task in tasks],
+                [job_type_abbreviations.get(task.task_type, '--') for task in tasks],
+                [task.status for task in tasks],
+                [task.user_name or task.user_id or 'Unknown' for task in tasks],
+                short_timestamps(task.submitted_at for task in tasks),
+                [execution_time(task.duration) if task.status == 'SUCCESS' else "" for task in tasks],
+                failure_info,
+            ],
+            title="\nJobs:", rule_width=120, width=None if truncate else 0
+        )
         
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
 
-def download_job_result(token, job_id, output_path=None):
+def download_job_result(token, job_id, output_path=None, output_format='json'):
     """Download the result file for a completed job"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        # First check if the job is completed
-        status_response = requests.get(
-            f"{config['server']['url']}/api/tasks/{job_id}",
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        status_response.raise_for_status()
-        
-        job_status = status_response.json()
-        if job_status.get('status') != 'SUCCESS':
-            click.echo(f"Job {job_id} is not completed yet. Current status: {job_status.get('status')}")
+        download = GuestClient(token).download(job_id, output_path, output_format)
+        if download.path is None:
+            click.echo(f"Job {job_id} is not completed yet. Current status: {download.status}")
             return False
         
-        # Download the result file
-        download_response = requests.get(
-            f"{config['server']['url']}/api/tasks/{job_id}/download",
-            headers=headers,
-            verify=VERIFY_SERVER_CERT,
-            stream=True  # Stream the response for large files
-        )
-        download_response.raise_for_status()
-        
-        # Determine output filename
-        if not output_path:
-            task_type = job_status.get('task_type', 'unknown')
-            output_path = f"results/{task_type}_{job_id}.json"
-        
-        # Save the file
-        with open(output_path, 'wb') as f:
-            for chunk in download_response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        click.echo(f"Results saved to {output_path}")
+        click.echo(f"Results saved to {download.path}")
         return True
         
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
         return False
 
-def batch_download_results(token, experiment_info_json, output_dir=None):
-    """Batch download all results from an experiment info file"""
-    headers = {"Authorization": f"Bearer {token}"}
+def batch_download_results(token, experiment_info_json, output_dir=None, output_format='json', layout=None):
+    """Batch download all results from an experiment info file; layout 'sharded' spreads them over subdirectories"""
+    client = GuestClient(token)
     
     try:
         experiment_info_path = f"./experiment_infos/{experiment_info_json}"
         
-        with open(experiment_info_path, 'r') as f:
-            experiment_data = json.load(f)
+        experiment_data = load_experiment_info(experiment_info_path)
 
         experiment_data_filename = os.path.basename(experiment_info_path)
         subfolder = experiment_data_filename[:experiment_data_filename.find('_')]
@@ -290,52 +196,47 @@ def batch_download_results(token, experiment_info_json, output_dir=None):
         
         successful_downloads = 0
         failed_downloads = 0
-        
-        for task_id in task_ids:
+        reused_downloads = 0
+        
+        # Download locations and statuses go into the experiment's ledger, if it has one
+        view = load_ledger(experiment_info_path) if is_ledger(experiment_info_path) else None
+        with (ExperimentLedger(experiment_info_path) if view else nullcontext()) as ledger, \
+                BatchIndex(output_dir, layout) as index, ThreadPoolExecutor(max_workers=POOL_SIZE) as pool:
+            if layout and index.layout != layout:
+                click.echo(f"Keeping the {index.layout} layout of {output_dir}")
+            # Downloads run concurrently, paced by the shared rate limiter, and are handled in order
+            futures = {task_id: pool.submit(client.download, task_id, index.result_path(task_id), output_format)
+                       for task_id in task_ids}
+            for task_id, future in futures.items():
             
-            try:
-                # First check if the job is completed
-                status_response = requests.get(
-                    f"{config['server']['url']}/api/tasks/{task_id}",
-                    headers=headers,
-                    verify=VERIFY_SERVER_CERT
-                )
-                status_response.raise_for_status()
-                
-                job_status = status_response.json()
-                if job_status.get('status') != 'SUCCESS':
-                    click.echo(f"WARNING: Job {task_id} is not completed yet. Status: {job_status.get('status')}")
+                try:
+                    download = future.result()
+                    if download.path is None:
+                        click.echo(f"WARNING: Job {task_id} is not completed yet. Status: {download.status}")
+                        failed_downloads += 1
+                        if ledger and view.status(task_id) != download.status:
+                            ledger.record("status", task_id, status=download.status)
+                        continue
+                    index.add(task_id, download.path)
+                    if ledger and view.tasks.get(task_id, {}).get("path") != download.path:
+                        ledger.record("downloaded", task_id, path=download.path)
+                    if download.reused:
+                        reused_downloads += 1
+
+                    successful_downloads += 1
+                except requests.exceptions.RequestException as e:
+                    click.echo(f"Failed to download {task_id}: {str(e)}")
                     failed_downloads += 1
                     continue
-                
-                # Download the result file
-                download_response = requests.get(
-                    f"{config['server']['url']}/api/tasks/{task_id}/download",
-                    headers=headers,
-                    verify=VERIFY_SERVER_CERT,
-                    stream=True
-                )
-                download_response.raise_for_status()
-                
-                output_filename = f"{task_id}.json"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Save the file
-                with open(output_path, 'wb') as f:
-                    for chunk in download_response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-
-                successful_downloads += 1
-                
-            except requests.exceptions.RequestException as e:
-                click.echo(f"Failed to download {task_id}: {str(e)}")
-                failed_downloads += 1
-                continue
         
         # Summary
         click.echo(f"\nDownload Summary:")
         click.echo(f"Successful:       {successful_downloads}")
         click.echo(f"Failed:           {failed_downloads}")
+        click.echo(f"Already stored:   {reused_downloads}")
+        throttle = limiter_stats()
+        if throttle["throttled"]:
+            click.echo(f"Rate limited:     {throttle['throttled']} response(s), {throttle['retries']} retried")
         click.echo(f"Output directory: {output_dir}")
         
         return successful_downloads, failed_downloads
@@ -350,156 +251,91 @@ def batch_download_results(token, experiment_info_json, output_dir=None):
         click.echo(f"Unexpected error: {str(e)}")
         return 0, 0
 
-def job_details(token, limit=30):
+def _parameter_strings(tasks):
+    """Task parameters as compact dict-like strings without None/empty values.
+
+    Batch jobs mostly share their parameters, so each distinct task_kwargs
+    string is parsed and formatted only once.
+    """
+    formatted = {}
+    strings = []
+    for task in tasks:
+        key = task.raw.get('task_kwargs')
+        if not isinstance(key, str):
+            key = id(task)
+        text = formatted.get(key)
+        if text is None:
+            text = formatted[key] = str({k: v for k, v in task.parameters.items() if v is not None and v != ''})
+        strings.append(text)
+    return strings
+
+def job_details(token, limit=30, truncate=True):
     """List all jobs with detailed information in a tabular format"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.get(
-            f"{config['server']['url']}/api/tasks?limit={limit}", 
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
+        tasks = GuestClient(token).list_tasks(limit)
         
-        result = response.json()
-        
-        if not result.get('tasks'):
+        if not tasks:
             click.echo("No jobs found.")
             return
             
-        click.echo("\nJob Details:")
-        click.echo("-" * 140)
-        click.echo(f"{'ID':<36} {'Type':<20} {'Status':<10} {'Submitted At':<25} {'Execution Time':<15} {'Parameters'}")
-        click.echo("-" * 140)
-        
-        for task in result.get('tasks', []):
-            task_id = task.get('task_id', 'Unknown')
-            task_type = task.get('task_type', 'Unknown')
-            status = task.get('status', 'Unknown')
-            submitted_at = task.get('submitted_at', 'Unknown')
-            
-            # Get task parameters
-            task_kwargs_str = task.get('task_kwargs', '{}')
-            try:
-                task_kwargs = json.loads(task_kwargs_str)
-            except json.JSONDecodeError:
-                task_kwargs = {}
-            
-            # Format parameters as a compact dict-like string
-            if task_kwargs:
-                # Filter out None/empty values and format nicely
-                filtered_params = {k: v for k, v in task_kwargs.items() if v is not None and v != ''}
-                if filtered_params:
-                    params_str = str(filtered_params)
-                else:
-                    params_str = "{}"
-            else:
-                params_str = "{}"
-            
-            # Calculate execution time for successful jobs
-            execution_time = ""
-            if status == 'SUCCESS':
-                duration = task.get('duration')
-                if duration:
-                    try:
-                        duration = int(float(duration))
-                        if duration < 60:
-                            execution_time = f"{duration:.1f}s"
-                        elif duration < 3600:
-                            minutes = int(duration // 60)
-                            seconds = duration % 60
-                            execution_time = f"{minutes}m {seconds:.1f}s"
-                        else:
-                            hours = int(duration // 3600)
-                            minutes = int((duration % 3600) // 60)
-                            execution_time = f"{hours}h {minutes}m"
-                    except (ValueError, TypeError):
-                        execution_time = "N/A"
-                else:
-                    execution_time = "N/A"
-            
-            click.echo(f"{task_id:<36} {task_type:<20} {status:<10} {submitted_at:<25} {execution_time:<15} {params_str}")
+        render_table(
+            [('ID', 36, '<'), ('Type', 20, '<'), ('Status', 10, '<'), ('Submitted At', 25, '<'),
+             ('Execution Time', 15, '<'), ('Parameters', None, '<')],
+            [
+                [task.task_id for task in tasks],
+                [task.task_type or 'Unknown' for task in tasks],
+                [task.status for task in tasks],
+                [task.submitted_at or 'Unknown' for task in tasks],
+                [execution_time(task.duration) if task.status == 'SUCCESS' else "" for task in tasks],
+                _parameter_strings(tasks),
+            ],
+            title="\nJob Details:", rule_width=140, width=None if truncate else 0
+        )
         
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
 
 def resubmit_job(token, job_id):
     """Resubmit a failed job with the same parameters"""
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.post(
-            f"{config['server']['url']}/api/resubmit_job/{job_id}",
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
-        
-        result = response.json()
+        task = GuestClient(token).resubmit(job_id)
+        # The replacement takes the original's place in its experiment
+        ledger_path = find_ledger(job_id)
+        if ledger_path:
+            record_events(ledger_path, [("resubmitted", job_id, {"new_task_id": task.task_id})])
         
         click.echo(f"Job resubmitted successfully!")
-        click.echo(f"New Job ID: {result['task_id']}")
-        click.echo(f"Status: {result.get('status', 'unknown')}")
-        click.echo(f"Resubmitted from: {result.get('resubmitted_from', 'unknown')}")
-        click.echo(f"Use 'guest job-status {result['task_id']}' to check the status")
+        click.echo(f"New Job ID: {task.task_id}")
+        click.echo(f"Status: {task.status}")
+        click.echo(f"Resubmitted from: {task.resubmitted_from or 'unknown'}")
+        click.echo(f"Use 'guest job-status {task.task_id}' to check the status")
         
-        return result['task_id']
+        return task.task_id
         
-    except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+    except (requests.exceptions.RequestException, GuestError) as e:
+        echo_request_error(e)
         return None
 
 def cancel_job(token, job_id, terminate=False):
     """Cancel a single job by ID"""
-    headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.post(
-            f"{config['server']['url']}/api/cancel_task/{job_id}",
-            headers=headers,
-            params={"terminate": "true" if terminate else "false"},
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
-        result = response.json()
-        click.echo(f"Canceled: {result.get('task_id', job_id)} (status: {result.get('status')})")
-        click.echo(result.get('message', ''))
+        task = GuestClient(token).cancel(job_id, terminate)
+        ledger_path = find_ledger(job_id)
+        if ledger_path:
+            record_events(ledger_path, [("status", job_id, {"status": task.status})])
+        click.echo(f"Canceled: {task.task_id} (status: {task.status})")
+        click.echo(task.message or '')
         return True
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
         return False
 
 def cancel_pending_jobs(token):
     """Cancel all pending/retrying jobs for the current user"""
-    headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.post(
-            f"{config['server']['url']}/api/cancel_pending",
-            headers=headers,
-            verify=VERIFY_SERVER_CERT
-        )
-        response.raise_for_status()
-        result = response.json()
-        canceled = result.get('canceled', [])
-        skipped = result.get('skipped', [])
+        result = GuestClient(token).cancel_pending()
+        canceled = result.canceled
+        skipped = result.skipped
         click.echo(f"Canceled {len(canceled)} job(s).")
         if skipped:
             click.echo(f"Skipped {len(skipped)} job(s):")
@@ -509,31 +345,22 @@ def cancel_pending_jobs(token):
                 click.echo(f"  ... and {len(skipped) - 10} more")
         return True
     except requests.exceptions.RequestException as e:
-        click.echo(f"Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"Server response: {e.response.text}")
+        echo_request_error(e)
         return False
 
 def check_availability(token):
     """Check if the server is reachable and get module states"""
-    headers = {"Authorization": f"Bearer {token}"}
+    client = GuestClient(token)
+    health = get_health()
+    # Probe even backends whose circuit is open, and let the outcome reset or confirm it
+    health.force_probe()
     
     try:
         # First check if the main server is reachable
         click.echo("🔍 Checking server availability...")
         
         # Try to reach the main API endpoint
-        response = requests.get(
-            f"{config['server']['url']}/api/tasks?limit=1",
-            headers=headers,
-            verify=VERIFY_SERVER_CERT,
-            timeout=10
-        )
-        response.raise_for_status()
+        client.list_tasks(1, timeout=10)
         
         click.echo("✅ Server is reachable")
         
@@ -542,15 +369,7 @@ def check_availability(token):
         
         try:
             # Try to reach the quantum computer's module states endpoint
-            module_response = requests.get(
-                f"{config['server']['url']}/api/get_module_states",
-                headers=headers,
-                verify=VERIFY_SERVER_CERT,
-                timeout=10
-            )
-            module_response.raise_for_status()
-            
-            module_states = module_response.json()
+            module_states = client.module_states()
             
             click.echo("✅ Quantum computer is reachable")
             click.echo("\n📊 Module States:")
@@ -590,24 +409,16 @@ def check_availability(token):
             
         except requests.exceptions.RequestException as e:
             click.echo("❌ Quantum computer is not reachable")
-            click.echo(f"   Error: {str(e)}")
-            if hasattr(e, 'response') and e.response:
-                try:
-                    error_detail = e.response.json()
-                    click.echo(f"   Server response: {json.dumps(error_detail, indent=2)}")
-                except ValueError:
-                    click.echo(f"   Server response: {e.response.text}")
+            echo_request_error(e, indent="   ")
         
     except requests.exceptions.RequestException as e:
         click.echo("❌ Server is not reachable")
-        click.echo(f"   Error: {str(e)}")
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_detail = e.response.json()
-                click.echo(f"   Server response: {json.dumps(error_detail, indent=2)}")
-            except ValueError:
-                click.echo(f"   Server response: {e.response.text}")
+        echo_request_error(e, indent="   ")
     except requests.exceptions.Timeout:
         click.echo("❌ Server request timed out")
     except Exception as e:
-        click.echo(f"❌ Unexpected error: {str(e)}")
\ No newline at end of file
+        click.echo(f"❌ Unexpected error: {str(e)}")
+
+    click.echo("\nCircuit breakers:")
+    for backend in (SERVER, QUDI):
+        click.echo(f"{backend:<20} {health.describe(backend)}")
\ No newline at end of file
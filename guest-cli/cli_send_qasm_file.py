@@ -1,8 +1,15 @@
 import requests
 import json
+import os
+import glob
 import time
 import argparse
 import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cli_http import POOL_SIZE, echo_request_error
+from cli_client import GuestClient, GuestError
+from cli_ledger import ExperimentLedger, new_ledger_path
 
 def load_config():
     with open("config.json", "r") as config_file:
@@ -15,26 +22,90 @@ VERIFY_SERVER_CERT = config.get("security", {}).get("verify_server_cert", True)
 TOKEN_FILE_PATH = config["paths"]["token_file_path"]
 
 def send_qasm_file(qasm_file_path, access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    with open(qasm_file_path, "rb") as qasm_file:
-        response = requests.post(
-            f"{config['server']['url']}/api/simulate_qasm", 
-            headers=headers, 
-            files={"qasm_file": qasm_file},
-            verify=VERIFY_SERVER_CERT
-        )
+    try:
+        task = GuestClient(access_token).submit_qasm(qasm_file_path)
+    except (requests.exceptions.RequestException, GuestError) as e:
+        echo_request_error(e)
+        return None
+    click.echo(f"QASM simulation submitted successfully with ID: {task.task_id}")
+    click.echo(f"Status: {task.status}")
+    click.echo(f"Use 'guest job-status {task.task_id}' to check the status and retrieve results")
+    return task.task_id
+
+def expand_qasm_paths(patterns):
+    """Expand files, glob patterns and directories (their *.qasm files) into a list of files, in order"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, "*.qasm")))
+        elif glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+        elif os.path.isfile(pattern):
+            matches = [pattern]
+        else:
+            click.echo(f"WARNING: QASM file '{pattern}' does not exist")
+            continue
+        if not matches:
+            click.echo(f"WARNING: No QASM files match '{pattern}'")
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+def _submit_one(client, qasm_file_path):
+    """Upload one file; returns (task_id, error)"""
+    try:
+        return client.submit_qasm(qasm_file_path).task_id, None
+    except requests.exceptions.JSONDecodeError as e:
+        # The server's answer is more telling than the decode error
+        return None, e.doc
+    except (OSError, GuestError) as e:
+        # Includes requests' RequestException
+        return None, str(e)
+
+def send_qasm_files(patterns, access_token, concurrency=POOL_SIZE):
+    """Upload many QASM files concurrently over one session and save their task IDs as experiment info"""
+    paths = expand_qasm_paths(patterns)
+    if not paths:
+        click.echo("No QASM files to submit.")
+        return None
+    if len(paths) == 1:
+        send_qasm_file(paths[0], access_token)
+        return None
+
+    client = GuestClient(access_token)
+    task_infos = {}
+    failures = []
+
+    save_path = new_ledger_path("qasm")
+    ledger = ExperimentLedger(save_path)
 
+    click.echo(f"Submitting {len(paths)} QASM files with up to {concurrency} concurrent uploads...")
+    done = 0
     try:
-        result = response.json()
-        if 'task_id' in result:
-            click.echo(f"QASM simulation submitted successfully with ID: {result['task_id']}")
-            click.echo(f"Status: {result.get('status', 'unknown')}")
-            click.echo(f"Use 'guest job-status {result['task_id']}' to check the status and retrieve results")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(_submit_one, client, path): path for path in paths}
+            for future in as_completed(futures):
+                done += 1
+                path = futures[future]
+                task_id, error = future.result()
+                if task_id is None:
+                    failures.append(path)
+                    click.echo(f"[{done}/{len(paths)}] {path}: FAILED ({error})")
+                    continue
+                with open(path, "r") as qasm_file:
+                    circuit = qasm_file.read()
+                task_infos[task_id] = {"qasm_file": path, "circuit": circuit, "simulate": True}
+                ledger.record("submitted", task_id, params=task_infos[task_id])
+                click.echo(f"[{done}/{len(paths)}] {path}: {task_id}")
+    finally:
+        # Everything submitted is in the ledger already, even if the run is interrupted
+        ledger.close()
+        if not task_infos:
+            os.remove(save_path)
         else:
-            click.echo(response.text)
-    except ValueError:
-        click.echo(response.text)
+            click.echo(f"\nSubmitted {len(task_infos)} of {len(paths)} file(s), {len(failures)} failed")
+            click.echo(f"Saved task_infos to {save_path}")
+            click.echo(f"Use 'guest batch-download {save_path.name}' once the jobs have finished")
+    return str(save_path) if task_infos else None
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Send a QASM file to the Keycloak server for simulation.")
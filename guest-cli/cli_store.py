@@ -0,0 +1,282 @@
+import json
+import os
+import shutil
+import stat
+import hashlib
+import tempfile
+import threading
+import click
+
+from cli_batch_index import load_batch_index
+
+def load_config():
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    return config
+
+config = load_config()
+
+STORE_DIR = config["paths"].get("object_store_path", "object_store")
+OBJECTS_DIR = os.path.join(STORE_DIR, "objects")
+TASK_INDEX_PATH = os.path.join(STORE_DIR, "task_index.jsonl")
+# Files written by "copy" mode, to tell a stale copy from one the user edited since
+COPIES_PATH = os.path.join(STORE_DIR, "copies.jsonl")
+
+# How downloaded results refer to their stored object. "hardlink" stores each result once on any
+# filesystem, but the results are read-only like the objects themselves. "copy" writes an independent,
+# writable file; only where the filesystem supports copy-on-write reflinks does that not double the space
+LINK_MODE = config.get("object_store", {}).get("link_mode", "hardlink")
+LINK_MODES = ("copy", "hardlink")
+# Linux ioctl cloning a file's blocks (reflink)
+_FICLONE = 0x40049409
+
+_task_index = None
+_copies = None
+_index_lock = threading.Lock()
+
+def object_path(digest):
+    return os.path.join(OBJECTS_DIR, digest[:2], digest)
+
+def _load_task_index():
+    global _task_index
+    if _task_index is None:
+        index = {}
+        if os.path.exists(TASK_INDEX_PATH):
+            with open(TASK_INDEX_PATH, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line of an interrupted append
+                        continue
+                    index[entry.pop("task_id")] = entry
+        _task_index = index
+    return _task_index
+
+def lookup_task(task_id):
+    """Return the index entry ({'digest', 'task_type'}) of a downloaded task result, or None"""
+    with _index_lock:
+        entry = _load_task_index().get(task_id)
+    if entry and os.path.exists(object_path(entry["digest"])):
+        return entry
+    return None
+
+def record_task(task_id, digest, task_type=None):
+    with _index_lock:
+        index = _load_task_index()
+        entry = {"digest": digest, "task_type": task_type}
+        previous = index.get(task_id)
+        if previous and previous["digest"] == digest and (task_type is None or previous.get("task_type") == task_type):
+            return
+        if previous and task_type is None:
+            entry["task_type"] = previous.get("task_type")
+        index[task_id] = entry
+        os.makedirs(STORE_DIR, exist_ok=True)
+        # Single small appends are atomic, so concurrent writers do not interleave lines
+        with open(TASK_INDEX_PATH, "a") as f:
+            f.write(json.dumps(dict(entry, task_id=task_id)) + "\n")
+
+def _commit(tmp_path, digest):
+    """Move a finished temporary file into the store unless the object already exists; True if it did not"""
+    target = object_path(digest)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Objects are shared by every path linking to them and must never change
+    os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp_path, target)
+    return True
+
+def _store_chunks(chunks):
+    """Store a stream of byte chunks; returns (digest, whether the object is new)"""
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=OBJECTS_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                sha.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    digest = sha.hexdigest()
+    return digest, _commit(tmp_path, digest)
+
+def put_chunks(chunks):
+    """Store a stream of byte chunks and return its sha256 digest"""
+    return _store_chunks(chunks)[0]
+
+def put_file(path):
+    """Store the content of an existing file and return its digest"""
+    with open(path, "rb") as f:
+        return put_chunks(iter(lambda: f.read(1024 * 1024), b""))
+
+def _load_copies():
+    global _copies
+    if _copies is None:
+        copies = {}
+        if os.path.exists(COPIES_PATH):
+            with open(COPIES_PATH, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    copies[entry.pop("path")] = entry
+        _copies = copies
+    return _copies
+
+def _record_copy(target_path, digest):
+    st = os.stat(target_path)
+    entry = {"digest": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    with _index_lock:
+        _load_copies()[os.path.abspath(target_path)] = entry
+        os.makedirs(STORE_DIR, exist_ok=True)
+        with open(COPIES_PATH, "a") as f:
+            f.write(json.dumps(dict(entry, path=os.path.abspath(target_path))) + "\n")
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _written_copy(target_path):
+    """Digest of the copy written to target_path if the file is unchanged since, else None"""
+    with _index_lock:
+        entry = _load_copies().get(os.path.abspath(target_path))
+    if entry is None:
+        return None
+    st = os.stat(target_path)
+    if (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+        return None
+    return entry["digest"]
+
+def _reflink(source, target):
+    """Clone source into target sharing its blocks copy-on-write; False where the filesystem cannot"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            return False
+
+def _copy_object(source, target_path):
+    """Replace target_path by a writable copy of source; returns 'reflink' or 'copy'"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        method = "reflink" if _reflink(source, tmp_path) else "copy"
+        if method == "copy":
+            shutil.copyfile(source, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+def link_object(digest, target_path, mode=None):
+    """Make target_path hold a stored object; returns how: 'reflink', 'copy', 'hardlink', 'symlink' or 'kept'.
+
+    In "copy" mode target_path is an independent file the user may edit:
+    a copy written earlier is refreshed only while unchanged since, an
+    edited or foreign file is kept ('kept'). Hardlinks and symlinks share
+    the object itself, which is read-only.
+    """
+    mode = mode or LINK_MODE
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{mode}', expected one of {', '.join(LINK_MODES)}")
+    source = object_path(digest)
+    target_dir = os.path.dirname(target_path)
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+    if os.path.lexists(target_path):
+        linked = os.path.exists(target_path) and os.path.samefile(source, target_path)
+        if mode == "hardlink" and linked:
+            return "hardlink"
+        if mode == "copy" and not linked and not os.path.islink(target_path):
+            written = _written_copy(target_path)
+            if written is None and os.path.getsize(target_path) == os.path.getsize(source) \
+                    and file_digest(target_path) == digest:
+                # E.g. saved by an older version; adopt it as our copy
+                _record_copy(target_path, digest)
+                written = digest
+            if written == digest:
+                return "copy"
+            if written is None:
+                click.echo(f"Warning: {target_path} was changed locally and is kept; "
+                           f"move it away to save the result there", err=True)
+                return "kept"
+    if mode == "copy":
+        method = _copy_object(source, target_path)
+        _record_copy(target_path, digest)
+        return method
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source, target_path)
+        return "hardlink"
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(source), target_path)
+            return "symlink"
+        except OSError:
+            return _copy_object(source, target_path)
+
+def dedupe_file(path, task_id=None, task_type=None):
+    """Replace a regular file by a hardlink to its stored object; return (digest, bytes_saved)"""
+    with open(path, "rb") as f:
+        digest, created = _store_chunks(iter(lambda: f.read(1024 * 1024), b""))
+    saved = 0
+    if not os.path.samefile(object_path(digest), path):
+        if not created:
+            # The store already held this content, so this copy of it is freed
+            saved = os.path.getsize(path)
+        link_object(digest, path, mode="hardlink")
+    if task_id:
+        record_task(task_id, digest, task_type)
+    return digest, saved
+
+def task_from_filename(path):
+    """Guess (task_id, task_type) from results/<task_type>_<id>.json or batch_results/<ts>/<id>.json"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem.startswith("run_") and "_" in stem[4:]:
+        task_type, task_id = stem.rsplit("_", 1)
+        return task_id, task_type
+    if os.path.basename(os.path.dirname(os.path.dirname(path))) == "batch_results":
+        return stem, None
+    return None, None
+
+def dedupe_directories(directories):
+    """Move the result files below the given directories into the object store"""
+    files = 0
+    saved = 0
+    for directory in directories:
+        for root, subdirectories, filenames in os.walk(directory):
+            indexed = load_batch_index(root)
+            if indexed is not None:
+                # Batch directories with an index are not walked
+                subdirectories.clear()
+                found = [(entry["path"], task_id) for task_id, entry in indexed.items()]
+            else:
+                found = [(os.path.join(root, filename), None) for filename in filenames]
+            for path, indexed_task_id in found:
+                if not path.endswith(".json") or os.path.islink(path):
+                    continue
+                task_id, task_type = task_from_filename(path)
+                _, file_saved = dedupe_file(path, indexed_task_id or task_id, task_type)
+                files += 1
+                saved += file_saved
+    click.echo(f"Stored {files} result file(s), freed {saved / 1024:.1f} KiB of duplicates")
+    if files:
+        click.echo("The files are now hardlinks to the object store and read-only; copy one to edit it")
+    return files, saved
@@ -0,0 +1,236 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Tuple
+import click
+import numpy as np
+
+from cli_batch_index import BatchIndex
+from cli_ledger import ExperimentLedger, EXPERIMENT_INFO_DIR, LEDGER_SUFFIX
+from cli_result_io import write_binary_result
+
+KINDS = ("tq", "rabi")
+TASK_TYPES = {"tq": "run_two_qubit_circuit", "rabi": "run_rabi_oscillation"}
+INIT_STATES = ("00", "01", "10", "11")
+# Reference runs without a circuit plus the circuits used in our experiments so far
+DEFAULT_CIRCUITS = ("", "sxQB1", "sxQB2", "sxQB1_sxQB2", "sxQB1_c0xQB2")
+
+# A two-qubit readout block is 4 calibration points, the levels of |00> .. |11>, then 10 measurement points
+CALIBRATION_POINTS = 4
+MEASUREMENT_POINTS = 10
+# 4 blocks give the 56 points of our stored results
+DEFAULT_BLOCKS = 4
+# Normalised signal of each basis state, brightest first
+STATE_LEVELS = np.array([1.45, 1.30, 1.15, 1.00])
+# Sweeps the noise level refers to; noise scales with 1 / sqrt(sweeps)
+REFERENCE_SWEEPS = 100000
+# Mean photons per shot of a bright (qubit 1 in |0>) and a dark readout
+BRIGHT_PHOTONS = 3.0
+DARK_PHOTONS = 0.4
+# Calibration of the first experiment; later ones drift away from it
+BASE_CALIBRATION = {"odmr_res_freq": 1.4663e9, "rabi_period_fast": 1.28e-07, "rabi_period_slow": 4.1e-07}
+
+# Tasks generated and written per worker call
+TASKS_PER_CHUNK = 500
+
+# Scratch root of the synthetic experiment infos and batch results; the catalog, archive and
+# calibration checks only read the real ones in the working directory
+SYNTH_ROOT = "synthetic"
+
+_SX = 0.5 * np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]])
+_X = np.array([[0, 1], [1, 0]], dtype=complex)
+_I = np.eye(2, dtype=complex)
+_P0 = np.diag([1, 0]).astype(complex)
+_P1 = np.diag([0, 1]).astype(complex)
+# Gates of circuit names like sxQB1_c0xQB2, as 4x4 matrices on |qb1 qb2>
+GATES = {
+    "sxQB1": np.kron(_SX, _I),
+    "sxQB2": np.kron(_I, _SX),
+    "xQB1": np.kron(_X, _I),
+    "xQB2": np.kron(_I, _X),
+    "cxQB2": np.kron(_P0, _I) + np.kron(_P1, _X),
+    "c0xQB2": np.kron(_P0, _X) + np.kron(_P1, _I),
+    "cxQB1": np.kron(_I, _P0) + np.kron(_X, _P1),
+    "c0xQB1": np.kron(_X, _P0) + np.kron(_I, _P1),
+}
+
+@dataclass
+class SynthOptions:
+    kind: str = "tq"
+    blocks: int = DEFAULT_BLOCKS
+    points: int = 50
+    sweeps: int = 500000
+    noise: float = 0.05
+    fidelity: float = 0.95
+    drift: float = 1e-5
+    single_shot: int = 0
+    circuits: Tuple[str, ...] = field(default_factory=lambda: DEFAULT_CIRCUITS)
+    output_format: str = "json"
+
+def ideal_populations(circuit, init_state):
+    """Populations of |00> .. |11> after a circuit, or None if it has gates we do not model"""
+    state = np.zeros(4, dtype=complex)
+    state[int(init_state, 2)] = 1
+    for gate in filter(None, circuit.split("_")):
+        if gate not in GATES:
+            return None
+        state = GATES[gate] @ state
+    return np.abs(state) ** 2
+
+def drifted_calibration(rng, hours, drift):
+    """Calibration after some hours: a linear drift of `drift` per hour plus a random walk of the same size"""
+    walk = rng.normal(0, drift * np.sqrt(max(hours, 0)))
+    return {name: value * (1 + drift * hours + walk) for name, value in BASE_CALIBRATION.items()}
+
+def _two_qubit_results(rng, params, calibration, options):
+    n = len(params)
+    populations = np.empty((n, 4))
+    for i, task in enumerate(params):
+        ideal = ideal_populations(task["circuit"], task["initState"])
+        populations[i] = rng.dirichlet(np.ones(4)) if ideal is None else ideal
+    # Gate and readout errors mix in the fully mixed state
+    populations = options.fidelity * populations + (1 - options.fidelity) / 4
+    populations = np.array([rng.dirichlet(p * 2000 + 1e-3) for p in populations])
+
+    sigma = options.noise * np.sqrt(REFERENCE_SWEEPS / options.sweeps) * STATE_LEVELS.mean()
+    expected = populations @ STATE_LEVELS
+    block = np.concatenate([np.broadcast_to(STATE_LEVELS, (n, CALIBRATION_POINTS)),
+                            np.repeat(expected[:, None], MEASUREMENT_POINTS, axis=1)], axis=1)
+    clean = np.tile(block, (1, options.blocks))
+    signal = clean + rng.normal(0, sigma, clean.shape)
+    errors = np.abs(rng.normal(sigma, sigma * 0.1, clean.shape))
+    t_data = (np.arange(MEASUREMENT_POINTS) * calibration["rabi_period_fast"]).tolist()
+
+    shots = None
+    if options.single_shot:
+        # qubit 1 in |0> reads out bright
+        bright = rng.random((n, options.single_shot)) < (populations[:, 0] + populations[:, 1])[:, None]
+        shots = rng.poisson(np.where(bright, BRIGHT_PHOTONS, DARK_PHOTONS))
+
+    results = []
+    for i in range(n):
+        result = {
+            "populations": {state: float(p) for state, p in zip(INIT_STATES, populations[i])},
+            "tData": t_data,
+            "sigData": signal[i],
+            "errData": errors[i],
+            # Tasks of one experiment run after the same calibration
+            "qb1_calibration_results": dict(calibration),
+            "qb2_calibration_results": None,
+            "synthetic": True,
+        }
+        if shots is not None:
+            result["photon_counts"] = shots[i]
+        results.append(result)
+    return results
+
+def _rabi_results(rng, params, calibration, options):
+    n = len(params)
+    tau_start, tau_step = 10.0, 10.0
+    t = tau_start + tau_step * np.arange(options.points)
+    # Every trace has its own period around the calibrated one
+    periods = calibration["rabi_period_fast"] * 1e9 * (1 + rng.normal(0, 0.02, (n, 1)))
+    rate = (BRIGHT_PHOTONS + DARK_PHOTONS) / 2 + (BRIGHT_PHOTONS - DARK_PHOTONS) / 2 * np.cos(2 * np.pi * t / periods)
+    # Counts summed over 1000 sweeps per point, scaled down to keep the numbers readable
+    scale = options.sweeps / 1000
+    counts = rng.poisson(np.maximum(rate, 0) * scale) / scale
+    return [{
+        "pulse_durations_ns": t,
+        "photon_counts": counts[i],
+        "parameters": {"tau_start_ns": tau_start, "tau_step_ns": tau_step, "num_of_points": options.points},
+        "synthetic": True,
+    } for i in range(n)]
+
+def _write_chunk(options, calibration, seed, tasks):
+    """Generate and write the results of (task_id, params, path) tuples; runs in a worker process"""
+    rng = np.random.default_rng(seed)
+    params = [task_params for _, task_params, _ in tasks]
+    if options.kind == "tq":
+        results = _two_qubit_results(rng, params, calibration, options)
+    else:
+        results = _rabi_results(rng, params, calibration, options)
+    written = []
+    for (task_id, _, path), result in zip(tasks, results):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if options.output_format == "json":
+            result = {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in result.items()}
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2)
+        else:
+            path = write_binary_result(result, path, options.output_format)
+        written.append((task_id, path))
+    return written
+
+def _task_params(rng, options, count):
+    if options.kind == "rabi":
+        return [{"num_of_points": options.points, "simulate": True, "synthetic": True}] * count
+    circuits = rng.choice(len(options.circuits), count)
+    return [{
+        "circuit": options.circuits[circuit],
+        "initState": INIT_STATES[i % len(INIT_STATES)],
+        "sweeps": options.sweeps,
+        "single_shot": bool(options.single_shot),
+        "simulate": True,
+        "synthetic": True,
+    } for i, circuit in enumerate(circuits)]
+
+def _experiment_paths(root, started, kind):
+    """Experiment info ledger and batch directory below root of an experiment started at a datetime, not yet taken"""
+    while True:
+        timestamp = started.isoformat(timespec='seconds').replace(":", "-")
+        ledger_path = os.path.join(root, EXPERIMENT_INFO_DIR, f"{timestamp}_{kind}_experiment{LEDGER_SUFFIX}")
+        batch_dir = os.path.join(root, "batch_results", timestamp)
+        if not os.path.exists(ledger_path) and not os.path.exists(batch_dir):
+            return ledger_path, batch_dir
+        started += timedelta(seconds=1)
+
+def synthesize(options, tasks=1000, experiments=1, interval_minutes=60.0, layout=None, jobs=None, seed=0,
+               output_dir=SYNTH_ROOT):
+    """Write synthetic experiments below output_dir: an experiment info ledger and a batch result directory each.
+
+    Experiments are dated interval_minutes apart, ending now, and the
+    calibration drifts between them. Results are generated in parallel
+    chunks; the same seed gives the same data. Task parameters and
+    results are marked "synthetic".
+    """
+    if os.path.abspath(output_dir) == os.getcwd():
+        raise ValueError("Synthetic results must not be written next to the real ones; choose a scratch directory")
+    first = datetime.now().replace(microsecond=0) - timedelta(minutes=interval_minutes * (experiments - 1))
+    calibration_rng = np.random.default_rng([seed, 0])
+    started = time.time()
+    written_total = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for experiment in range(experiments):
+            hours = experiment * interval_minutes / 60
+            calibration = drifted_calibration(calibration_rng, hours, options.drift)
+            ledger_path, batch_dir = _experiment_paths(output_dir, first + timedelta(minutes=interval_minutes * experiment),
+                                                       options.kind)
+            rng = np.random.default_rng([seed, 1, experiment])
+            task_ids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(tasks)]
+            params = _task_params(rng, options, tasks)
+
+            with ExperimentLedger(ledger_path) as ledger, BatchIndex(batch_dir, layout) as index:
+                ledger.submitted(dict(zip(task_ids, params)))
+                chunks = [
+                    [(task_id, task_params, index.result_path(task_id))
+                     for task_id, task_params in zip(task_ids[start:start + TASKS_PER_CHUNK],
+                                                     params[start:start + TASKS_PER_CHUNK])]
+                    for start in range(0, tasks, TASKS_PER_CHUNK)
+                ]
+                futures = [pool.submit(_write_chunk, options, calibration, [seed, 2, experiment, number], chunk)
+                           for number, chunk in enumerate(chunks)]
+                for future in futures:
+                    for task_id, path in future.result():
+                        index.add(task_id, path)
+                        ledger.record("downloaded", task_id, path=path)
+                        written_total += 1
+            click.echo(f"{ledger_path}: {tasks} {TASK_TYPES[options.kind]} result(s) in {batch_dir}")
+
+    elapsed = time.time() - started
+    click.echo(f"\nWrote {written_total} synthetic result(s) in {elapsed:.1f}s "
+               f"({written_total / max(elapsed, 1e-9):.0f}/s)")
+    return written_total
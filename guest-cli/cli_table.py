@@ -0,0 +1,85 @@
+import os
+import shutil
+import sys
+from datetime import datetime
+from functools import lru_cache
+
+# Rows written per write() call
+BLOCK_ROWS = 4096
+ELLIPSIS = "…"
+
+def terminal_width():
+    """Width to clip table lines to, or None if stdout is not a terminal (pipes get full lines)"""
+    if not sys.stdout.isatty():
+        return None
+    return shutil.get_terminal_size().columns
+
+def short_timestamps(values, missing='Unknown'):
+    """Format ISO timestamps as MM-DDTHH:MM, slicing well-formed ones instead of parsing each"""
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if not value:
+            append(missing)
+        elif len(value) >= 16 and value[4] == '-' and value[7] == '-' and value[13] == ':':
+            append(f"{value[5:10]}T{value[11:16]}")
+        else:
+            try:
+                append(datetime.fromisoformat(value.replace('Z', '+00:00')).strftime('%m-%dT%H:%M'))
+            except (ValueError, AttributeError):
+                append(str(value)[:12])
+    return formatted
+
+@lru_cache(maxsize=4096)
+def _format_seconds(duration):
+    if duration < 60:
+        return f"{duration:.1f}s"
+    elif duration < 3600:
+        return f"{int(duration // 60)}m {duration % 60:.1f}s"
+    return f"{int(duration // 3600)}h {int((duration % 3600) // 60)}m"
+
+def execution_time(duration, missing="N/A"):
+    """Human readable whole-second duration; repeated values are formatted once"""
+    duration = int(duration or 0)
+    return _format_seconds(duration) if duration else missing
+
+def _pad(values, width, align):
+    if width is None:
+        return values
+    if align == '>':
+        return [value.rjust(width) for value in values]
+    return [value.ljust(width) for value in values]
+
+def render_table(columns, rows, title=None, rule_width=None, rule_above=True, width=None, out=None):
+    """Write a table given column-wise data.
+
+    columns is a list of (header, width, align) with width None for a
+    free-width column; rows is a list of equally long lists of strings, one
+    per column. Each column is padded in a single pass and the lines are
+    written in blocks of BLOCK_ROWS. Lines longer than width (the terminal
+    width by default, 0 for no limit) are clipped with an ellipsis instead
+    of wrapping.
+    """
+    out = out or sys.stdout
+    if width is None:
+        width = terminal_width()
+
+    def clip(lines):
+        if not width:
+            return lines
+        return [line if len(line) <= width else line[:width - 1] + ELLIPSIS for line in lines]
+
+    header = " ".join(_pad([name], column_width, align)[0] for name, column_width, align in columns).rstrip()
+    rule = "-" * min(rule_width or len(header), width or sys.maxsize)
+    head = ([title] if title is not None else []) + ([rule] if rule_above else []) + [header, rule]
+
+    padded = [_pad(values, column_width, align) for (_, column_width, align), values in zip(columns, rows)]
+    lines = list(map(" ".join, zip(*padded)))
+    try:
+        out.write("\n".join(clip(head)) + "\n")
+        for start in range(0, len(lines), BLOCK_ROWS):
+            out.write("\n".join(clip(lines[start:start + BLOCK_ROWS])) + "\n")
+        out.flush()
+    except BrokenPipeError:
+        # Output piped into e.g. head: stop quietly, also when the interpreter flushes stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
@@ -0,0 +1,158 @@
+import sys
+import time
+import shutil
+import click
+import requests
+
+from cli_http import SERVER_URL, get_session, auth_headers
+from cli_authenticate import current_access_token
+
+STATE_ICONS = {"idle": "🟢", "locked": "🔴", "inactive": "⚪"}
+
+class ConditionalFetcher:
+    """GET an endpoint repeatedly, sending ETag/Last-Modified validators from the last response"""
+
+    def __init__(self, session, url, headers, params=None):
+        self.session = session
+        self.url = url
+        self.headers = headers
+        self.params = params
+        self.etag = None
+        self.last_modified = None
+        self.data = None
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_received = 0
+
+    def fetch(self):
+        """Return (data, changed); data is the last known body when the server answers 304"""
+        headers = dict(self.headers)
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        response = self.session.get(self.url, headers=headers, params=self.params, timeout=10)
+        self.requests += 1
+        if response.status_code == 304 and self.data is not None:
+            self.not_modified += 1
+            return self.data, False
+        response.raise_for_status()
+
+        self.bytes_received += len(response.content)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        data = response.json()
+        changed = data != self.data
+        self.data = data
+        return data, changed
+
+def _task_row(task):
+    # Fields may be missing or null
+    task_id = str(task.get('task_id') or 'Unknown')
+    task_type = str(task.get('task_type') or 'Unknown')
+    status = str(task.get('status') or 'Unknown')
+    submitted_at = str(task.get('submitted_at') or 'Unknown')
+    # Keep only MM-DDTHH:MM:SS of the ISO timestamp
+    submitted = submitted_at[5:19] if len(submitted_at) >= 19 else submitted_at
+    duration = task.get('duration')
+    try:
+        duration = f"{float(duration):.1f}s" if duration else ""
+    except (ValueError, TypeError):
+        duration = ""
+    return f"{task_id:<36} {task_type:<22} {status:<10} {submitted:<15} {duration:>10}"
+
+def _error_text(e):
+    """Short description of a failed poll; a rejected token is not a backend outage"""
+    response = getattr(e, "response", None)
+    if response is not None and response.status_code in (401, 403):
+        return f"authentication failed ({response.status_code}), run 'guest auth'"
+    return f"unreachable ({type(e).__name__})"
+
+def _module_line(module_states, error=None):
+    if error:
+        return f"Modules: {error}"
+    if not isinstance(module_states, dict):
+        return f"Modules: {module_states}"
+    parts = [f"{name} {STATE_ICONS.get(state, '❓')} {state}" for name, state in module_states.items()]
+    return "Modules: " + "   ".join(parts)
+
+def _render(tasks, tasks_error, module_line, interval, fetchers, height):
+    counts = {}
+    for task in tasks:
+        status = task.get('status') or 'Unknown'
+        counts[status] = counts.get(status, 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    if tasks_error:
+        summary = f"{tasks_error}, showing last known state"
+    total_requests = sum(f.requests for f in fetchers)
+    not_modified = sum(f.not_modified for f in fetchers)
+    received = sum(f.bytes_received for f in fetchers)
+
+    lines = [
+        f"guest top - {time.strftime('%H:%M:%S')} - refresh every {interval:g}s (Ctrl-C to quit)",
+        module_line,
+        f"Tasks: {summary or 'none'}",
+        f"Requests: {total_requests} ({not_modified} not modified), received {received / 1024:.1f} KiB",
+        "",
+        f"{'ID':<36} {'Type':<22} {'Status':<10} {'Submitted':<15} {'Duration':>10}",
+        "-" * 97,
+    ]
+    room = max(height - len(lines) - 1, 0)
+    lines.extend(_task_row(task) for task in tasks[:room])
+    return lines
+
+def _redraw(screen, lines):
+    """Rewrite only the terminal lines that differ from what is currently shown"""
+    out = []
+    for row, line in enumerate(lines):
+        if row >= len(screen) or screen[row] != line:
+            out.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+    for row in range(len(lines), len(screen)):
+        out.append(f"\x1b[{row + 1};1H\x1b[K")
+    if out:
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
+    return list(lines)
+
+def run_top(token, interval=2.0, limit=30):
+    """Show a live, in-place updating view of the task queue and module states"""
+    session = get_session()
+    tasks_fetcher = ConditionalFetcher(session, f"{SERVER_URL}/api/tasks", auth_headers(token), params={"limit": limit})
+    modules_fetcher = ConditionalFetcher(session, f"{SERVER_URL}/api/get_module_states", auth_headers(token))
+    fetchers = (tasks_fetcher, modules_fetcher)
+
+    screen = []
+    tasks = []
+    tasks_error = None
+    module_line = "Modules: ..."
+    # Alternate screen buffer, hidden cursor
+    sys.stdout.write("\x1b[?1049h\x1b[?25l\x1b[2J")
+    try:
+        while True:
+            # The session outlives the access token; pick up the renewed one
+            token = current_access_token(token)
+            for fetcher in fetchers:
+                fetcher.headers = auth_headers(token)
+            try:
+                data, _ = tasks_fetcher.fetch()
+                tasks = data.get('tasks', [])
+                tasks_error = None
+            except requests.exceptions.RequestException as e:
+                tasks_error = _error_text(e)
+            try:
+                module_states, _ = modules_fetcher.fetch()
+                module_line = _module_line(module_states)
+            except requests.exceptions.RequestException as e:
+                module_line = _module_line(None, error=_error_text(e))
+
+            height = shutil.get_terminal_size().lines
+            screen = _redraw(screen, _render(tasks, tasks_error, module_line, interval, fetchers, height))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout.write("\x1b[?25h\x1b[?1049l")
+        sys.stdout.flush()
+    click.echo(f"Sent {sum(f.requests for f in fetchers)} requests, "
+               f"{sum(f.not_modified for f in fetchers)} answered with 304 Not Modified")
@@ -13,5 +13,5 @@ setup(
         [console_scripts]
         guest=cli:cli
     """,
-    py_modules=['cli', 'cli_authenticate', 'cli_send_qasm_file', 'cli_userinfo', "cli_qudi_commands", "cli_scheduling"],
+    py_modules=['cli', 'cli_authenticate', 'cli_send_qasm_file', 'cli_userinfo', "cli_qudi_commands", "cli_scheduling", "cli_http", "cli_experiment", "cli_top", "cli_cache", "cli_store", "cli_catalog", "cli_result_io", "cli_analyze", "cli_calibration", "cli_pipeline", "cli_events", "cli_client", "cli_table", "cli_ledger", "cli_archive", "cli_batch_index", "cli_synth", "cli_ratelimit", "cli_health"],
 ) 
\ No newline at end of file
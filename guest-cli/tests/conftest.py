@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The cli modules read config.json from the working directory when they are imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
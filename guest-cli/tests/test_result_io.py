@@ -0,0 +1,54 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+import cli_result_io
+
+RESULT = {
+    "task_type": "run_rabi",
+    "duration": 12.5,
+    "offset": -3.25e-2,
+    "fitted": True,
+    "error": None,
+    "tData": [0.0, 1.5, 12.25, -4e-3, None],
+    "sigData": [[1.0, 2.5], [3.75, 100.125]],
+    "empty": [],
+    "meta": {"laser": "idle", "power": 0.125},
+}
+
+class _SplitFile(io.StringIO):
+    """File whose first read stops at offset, then returns the rest in blocks"""
+
+    def __init__(self, text, offset):
+        super().__init__(text)
+        self.offset = offset
+
+    def read(self, size=-1):
+        if self.offset is not None:
+            size, self.offset = self.offset, None
+        return super().read(size)
+
+def _collect(text, offset, monkeypatch):
+    monkeypatch.setattr(cli_result_io, "open_result", lambda path, *args: _SplitFile(text, offset))
+    data = {}
+    for key, value, kind in cli_result_io._walk_json("result.json", 2, None):
+        if kind == "chunk":
+            data.setdefault(key, []).append(value)
+        else:
+            data[key] = value
+    return {key: np.concatenate(value) if isinstance(value, list) else value for key, value in data.items()}
+
+@pytest.mark.parametrize("indent", [None, 1])
+def test_walk_json_split_at_every_offset(indent, monkeypatch):
+    text = json.dumps(RESULT, indent=indent)
+    for offset in range(1, len(text)):
+        data = _collect(text, offset, monkeypatch)
+        assert data.keys() == RESULT.keys(), offset
+        for key, expected in RESULT.items():
+            if isinstance(expected, list):
+                expected = np.array(expected, dtype=np.float64)
+                np.testing.assert_array_equal(data[key], expected.reshape(data[key].shape), err_msg=str(offset))
+            else:
+                assert data[key] == expected, offset